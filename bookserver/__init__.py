@@ -0,0 +1,7 @@
+"""
+Server-side support for the bookreader application.
+
+The application itself is entirely client-side Javascript (see
+js/bookreader.js). The modules in this package make it fast and simple to
+serve that application (and the book it displays) from a local machine.
+"""
@@ -0,0 +1,300 @@
+"""
+A durable home for annotations: an SQLite database holding one row per
+comment, rather than one packed string per block and user.
+
+Rows are indexed by the about value of the block, by author and by time, so
+finding every comment on a block, or everything a user has written, is a
+single query that reads only the rows it returns. Comments on a block can
+also be read a page at a time, newest first: each page comes with an opaque
+cursor that picks up where it left off, so reading a page of a popular
+block costs the same as reading one of a quiet block.
+
+Every comment added or deleted is also recorded in a log of changes, whose
+sequence numbers serve as watermarks: a client that has read a block's
+comments can ask for just the changes to it since the watermark it was
+given.
+
+import_values() reads the comment tags of objects in the format Fluidinfo's
+/values endpoint returns them (see scripts/migrate.py).
+"""
+import base64
+import json
+import sqlite3
+import threading
+from email.utils import mktime_tz, parsedate_tz
+
+from bookserver.comments import unpack_comments
+from bookserver.compat import number_types
+from bookserver.heatmap import is_comment_path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY,
+    about TEXT NOT NULL,
+    author TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_about ON comments (about, created);
+CREATE INDEX IF NOT EXISTS comments_author ON comments (author, created);
+CREATE INDEX IF NOT EXISTS comments_created ON comments (created);
+CREATE TABLE IF NOT EXISTS changes (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    about TEXT NOT NULL,
+    comment INTEGER NOT NULL,
+    deleted INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_about ON changes (about, sequence);
+"""
+
+COLUMNS = 'id, about, author, timestamp, created, text'
+
+
+def timestamp_seconds(timestamp):
+    """
+    Returns the number of seconds since the epoch of a date in the format
+    of Date.toUTCString(), or 0 if it can't be read.
+    """
+    try:
+        parsed = parsedate_tz(timestamp)
+        return mktime_tz(parsed) if parsed else 0
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def encode_cursor(comment):
+    """
+    Returns the cursor for the comments after the given one.
+    """
+    token = json.dumps([comment['created'], comment['id']])
+    return base64.urlsafe_b64encode(token.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (created, id) of the comment a cursor follows. Raises
+    ValueError if it isn't a cursor.
+    """
+    try:
+        created, comment_id = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('ascii'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Not a cursor: %r' % (cursor,))
+    if not all(isinstance(value, number_types)
+               for value in (created, comment_id)):
+        raise ValueError('Not a cursor: %r' % (cursor,))
+    return created, comment_id
+
+
+def row_comment(row):
+    """
+    Returns a row of the comments table as a dictionary.
+    """
+    return dict(zip(('id', 'about', 'author', 'timestamp', 'created',
+                     'text'), row))
+
+
+class AnnotationStore(object):
+    """
+    The comments in the SQLite database at path (created if need be). Safe
+    to use from several threads at once.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def select(self, where, parameters, limit=-1):
+        """
+        Returns the comments matching the where clause, newest first (and
+        no more than limit of them, if it isn't negative).
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT %s FROM comments WHERE %s '
+                'ORDER BY created DESC, id DESC LIMIT ?' % (COLUMNS, where),
+                tuple(parameters) + (limit,)).fetchall()
+        return [row_comment(row) for row in rows]
+
+    def insert(self, about, author, timestamp, text):
+        """
+        Adds a comment, and the change, and returns its id. Call with the
+        lock held, in a transaction.
+        """
+        # The comment's id is the change's sequence number, as those are
+        # never used again (unlike the ids of deleted rows).
+        comment_id = self._connection.execute(
+            'INSERT INTO changes (about, comment, deleted) VALUES (?, 0, 0)',
+            (about,)).lastrowid
+        self._connection.execute(
+            'UPDATE changes SET comment = ? WHERE sequence = ?',
+            (comment_id, comment_id))
+        self._connection.execute(
+            'INSERT INTO comments (id, about, author, timestamp, created, '
+            'text) VALUES (?, ?, ?, ?, ?, ?)',
+            (comment_id, about, author, timestamp,
+             timestamp_seconds(timestamp), text))
+        return comment_id
+
+    def remove(self, about, where, parameters):
+        """
+        Deletes the comments on a block matching the where clause, recording
+        the changes, and returns how many there were. Call with the lock
+        held, in a transaction.
+        """
+        ids = [row[0] for row in self._connection.execute(
+            'SELECT id FROM comments WHERE about = ? AND ' + where,
+            (about,) + tuple(parameters))]
+        self._connection.executemany(
+            'DELETE FROM comments WHERE id = ?',
+            [(comment_id,) for comment_id in ids])
+        self._connection.executemany(
+            'INSERT INTO changes (about, comment, deleted) VALUES (?, ?, 1)',
+            [(about, comment_id) for comment_id in ids])
+        return len(ids)
+
+    def add(self, about, author, timestamp, text):
+        """
+        Adds a comment and returns its id.
+        """
+        with self._lock:
+            with self._connection:
+                return self.insert(about, author, timestamp, text)
+
+    def delete(self, comment_id):
+        """
+        Deletes the comment with the given id. Returns False if there isn't
+        one.
+        """
+        with self._lock:
+            with self._connection:
+                comment = self.comment(comment_id)
+                if comment is None:
+                    return False
+                return self.remove(comment['about'], 'id = ?',
+                                   (comment_id,)) == 1
+
+    def replace(self, about, author, comments):
+        """
+        Replaces the author's comments on a block with the given list of
+        (timestamp, text) pairs.
+        """
+        with self._lock:
+            with self._connection:
+                self.remove(about, 'author = ?', (author,))
+                for timestamp, text in comments:
+                    self.insert(about, author, timestamp, text)
+
+    def watermark(self):
+        """
+        Returns the sequence number of the latest change.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT MAX(sequence) FROM changes').fetchone()[0] or 0
+
+    def comment(self, comment_id):
+        """
+        Returns the comment with the given id, or None if there isn't one.
+        """
+        comments = self.select('id = ?', (comment_id,))
+        return comments[0] if comments else None
+
+    def block_comments(self, about):
+        """
+        Returns every comment on the block with the given about value.
+        """
+        return self.select('about = ?', (about,))
+
+    def block_page(self, about, limit, cursor=None):
+        """
+        Returns a list of up to limit comments on a block, newest first,
+        following those the cursor (if any) was returned with, and the
+        cursor for the next page (None if there are no more).
+        """
+        if cursor is None:
+            where, parameters = 'about = ?', (about,)
+        else:
+            created, comment_id = decode_cursor(cursor)
+            where = 'about = ? AND (created < ? OR (created = ? AND id < ?))'
+            parameters = (about, created, created, comment_id)
+        comments = self.select(where, parameters, limit + 1)
+        if len(comments) <= limit:
+            return comments, None
+        comments = comments[:limit]
+        return comments, encode_cursor(comments[-1])
+
+    def block_changes(self, about, since):
+        """
+        Returns the comments added to a block after the change with the
+        given sequence number (that are still there), newest first, and the
+        ids of those deleted since.
+        """
+        with self._lock:
+            changes = self._connection.execute(
+                'SELECT comment, deleted FROM changes WHERE about = ? AND '
+                'sequence > ? ORDER BY sequence', (about, since)).fetchall()
+            added = self.select('about = ? AND id IN (%s)' % ', '.join(
+                str(comment_id) for comment_id, deleted in changes
+                if not deleted) or 'NULL', (about,))
+        return added, sorted(set(comment_id for comment_id, deleted
+                                 in changes if deleted))
+
+    def author_comments(self, author):
+        """
+        Returns every comment written by author.
+        """
+        return self.select('author = ?', (author,))
+
+    def grouped(self):
+        """
+        Yields (about, author, comments) for each block and author, where
+        comments is a list of (timestamp, text) pairs oldest first.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT about, author, timestamp, text FROM comments '
+                'ORDER BY about, author, created, id').fetchall()
+        key, comments = None, []
+        for about, author, timestamp, text in rows:
+            if (about, author) != key:
+                if comments:
+                    yield key[0], key[1], comments
+                key, comments = (about, author), []
+            comments.append((timestamp, text))
+        if comments:
+            yield key[0], key[1], comments
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM comments').fetchone()[0]
+
+
+def import_values(annotations, data):
+    """
+    Imports the comment tags in data, a response from Fluidinfo's /values
+    endpoint that includes the objects' about values, into annotations (an
+    AnnotationStore), replacing any comments already there from the same
+    users on the same blocks. Returns the number of comments imported.
+    """
+    count = 0
+    for tags in data['results']['id'].values():
+        about = tags.get('fluiddb/about', {}).get('value')
+        if about is None:
+            continue
+        for path, value in tags.items():
+            if is_comment_path(path):
+                comments = unpack_comments(value.get('value'))
+                annotations.replace(about, path.split('/')[0], comments)
+                count += len(comments)
+    return count
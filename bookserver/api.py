@@ -0,0 +1,464 @@
+"""
+A local implementation of the parts of the Fluidinfo HTTP API used by
+js/bookreader.js (via fluidinfo.js), backed by a bookserver.store.TagStore.
+
+Supported endpoints (relative to wherever the API is mounted):
+
+    GET|HEAD|POST           about/<about>
+    GET|HEAD|PUT|DELETE     about/<about>/<tag path>
+    POST                    objects
+    GET|HEAD                objects/<id>
+    GET|HEAD|PUT|DELETE     objects/<id>/<tag path>
+    GET|PUT|DELETE          values
+    GET                     users/<username>
+
+There are also some endpoints Fluidinfo doesn't have:
+
+    GET|HEAD                counts?chapter=<about>&about=<about>...
+    GET|HEAD                heatmap?chapter=<about>
+    GET|HEAD|POST           comments/<about>
+    GET|HEAD                comments/<about>?since=<watermark>
+    DELETE                  comments/<about>?id=<id>
+    GET                     events?chapter=<about>
+
+The first returns the number of users who have commented on each block of
+the given chapters and on each of the given objects, so a chapter's counts
+can be shown with one request instead of one per block. The second returns
+both the number of users and the number of comments for each block of a
+chapter. The others list the comments on a block, newest first, a page at
+a time (see FluidinfoAPI.get_comments), list only the changes to them since
+a watermark returned by an earlier request (see FluidinfoAPI.get_changes),
+add a comment (the body is {"text": <comment>}) to the user's comment tag on
+a block and delete the user's comment with the given id (as returned when
+it was added), without the client rewriting the whole tag (see
+bookserver.comments). The last is a stream of server-sent events about a
+chapter, answered by the request handler (see bookserver.events): a "count"
+event with the numbers of participants and comments whenever they change
+for one of the chapter's blocks, and a "comment" event for each comment
+added through the comments endpoint.
+
+Requests authenticate with HTTP basic auth. If the API is given a dictionary
+of users and passwords only those users may log in, otherwise any username
+and password is accepted (handy when developing). As in Fluidinfo, users may
+only write tags in the namespace that matches their username.
+"""
+import base64
+import json
+
+from bookserver.annotations import AnnotationStore
+from bookserver.comments import CommentLog
+from bookserver.compat import text_type, unquote
+from bookserver.events import EventHub
+from bookserver.heatmap import MISSING, chapter_of, is_comment_path
+from bookserver.query import QueryError
+from bookserver.store import ABOUT_TAG
+
+
+JSON = 'application/json'
+VALUE = 'application/vnd.fluiddb.value+json'
+
+# The number of comments on a page of comments, unless a client asks for
+# another number (up to MAX_PAGE).
+PAGE_SIZE = 20
+MAX_PAGE = 100
+
+
+class Response(object):
+    """
+    The status, headers and body to send in reply to a request.
+    """
+
+    def __init__(self, status, body=None, content_type=JSON, headers=None):
+        self.status = status
+        self.headers = list(headers or [])
+        if body is None:
+            self.body = b''
+        else:
+            self.body = json.dumps(body).encode('utf-8')
+            self.headers.append(('Content-Type', content_type))
+
+
+def error(status, error_class):
+    """
+    Returns an error response, with the error class in a header just as
+    Fluidinfo does.
+    """
+    return Response(status, headers=[('X-FluidDB-Error-Class', error_class)])
+
+
+def decode(value):
+    """
+    Returns value as text (Python 2 URL parsing returns bytes).
+    """
+    if isinstance(value, text_type):
+        return value
+    return value.decode('utf-8')
+
+
+def comment_json(comment):
+    """
+    Returns what clients are told about a comment from an AnnotationStore.
+    """
+    return dict((key, comment[key])
+                for key in ('id', 'author', 'timestamp', 'text'))
+
+
+class FluidinfoAPI(object):
+    """
+    Turns API requests into operations on a TagStore. Comments added and
+    deleted through the comments endpoint are kept in a CommentLog, which
+    is compacted into the store in the background (see runserver.py). Comment
+    tags read through the API have the comments logged since merged in, and
+    a comment tag is compacted before it's written as a whole.
+    Comments are also kept in annotations (an AnnotationStore, held in
+    memory unless one is given), from which they're listed. Changes to them
+    are published to readers through events (an EventHub).
+    """
+
+    def __init__(self, store, users=None, annotations=None):
+        self.store = store
+        self.users = users
+        if annotations is None:
+            annotations = AnnotationStore()
+        self.annotations = annotations
+        self.comments = CommentLog(store, annotations)
+        self.events = EventHub()
+        store.listeners.append(self.comment_counted)
+
+    def handle(self, method, path, args, body, authorization):
+        """
+        Returns the Response to a request. The path is relative to where the
+        API is mounted and still URL encoded, args is a dictionary mapping
+        query string arguments to lists of values, body is the raw request
+        body and authorization is the value of the Authorization header (or
+        None).
+        """
+        user = self.authenticate(authorization)
+        if user is False:
+            return error(401, 'TUnauthorized')
+        segments = [decode(unquote(segment)) for segment in
+                    path.strip('/').split('/')]
+        args = dict((decode(key), [decode(v) for v in values])
+                    for key, values in args.items())
+        try:
+            if segments[0] == 'comments' and len(segments) == 2:
+                return self.handle_comments(method, segments[1], args, body,
+                                            user)
+            if segments[0] in ('about', 'objects') and len(segments) >= 2:
+                return self.handle_object(method, segments, args, body, user)
+            if segments == ['objects'] and method == 'POST':
+                return self.create_object(body, user)
+            if segments == ['values']:
+                return self.handle_values(method, args, body, user)
+            if segments in (['counts'], ['heatmap']):
+                if method not in ('GET', 'HEAD'):
+                    return error(405, 'TBadRequest')
+                if segments == ['counts']:
+                    return self.get_counts(args)
+                return self.get_heatmap(args)
+            if segments[0] == 'users' and len(segments) == 2:
+                if method not in ('GET', 'HEAD'):
+                    return error(405, 'TBadRequest')
+                return self.get_user(segments[1])
+        except QueryError:
+            return error(400, 'TParseError')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # Malformed JSON or values that can't be stored.
+            return error(400, 'TBadRequest')
+        return error(404, 'TNoSuchPath')
+
+    def authenticate(self, authorization):
+        """
+        Returns the username in the Authorization header, None if there
+        isn't one or False if the credentials are wrong.
+        """
+        if not authorization:
+            return None
+        scheme, _, token = authorization.partition(' ')
+        if scheme.lower() != 'basic':
+            return False
+        try:
+            credentials = base64.b64decode(token.strip().encode('ascii'))
+            username, _, password = credentials.decode('utf-8').partition(':')
+        except (TypeError, ValueError):
+            return False
+        if self.users is not None and self.users.get(username) != password:
+            return False
+        return username
+
+    def can_write(self, user, path):
+        """
+        Returns an error response if user may not write the tag at path,
+        otherwise None.
+        """
+        if user is None:
+            return error(401, 'TUnauthorized')
+        if path == ABOUT_TAG or path.split('/')[0] != user:
+            return error(403, 'TPathPermissionDenied')
+        return None
+
+    def handle_object(self, method, segments, args, body, user):
+        """
+        Handles requests for an object, or a tag on an object, identified by
+        its about value or its id.
+        """
+        by_about = segments[0] == 'about'
+        path = '/'.join(segments[2:])
+        if by_about:
+            create = user is not None and method in ('POST', 'PUT')
+            object_id = self.store.object_id(segments[1], create=create)
+        else:
+            object_id = segments[1]
+        if object_id is None or not self.store.exists(object_id):
+            return error(404, 'TNoInstanceOnObject' if path else
+                         'TNonexistentObject')
+        if not path:
+            if method == 'POST' and by_about:
+                return Response(201, {'id': object_id,
+                                      'URI': 'objects/' + object_id})
+            if method not in ('GET', 'HEAD'):
+                return error(405, 'TBadRequest')
+            result = {'tagPaths': sorted(self.comments.merge(
+                self.store.get_many(object_id, ['*'])))}
+            if by_about:
+                result['id'] = object_id
+            elif args.get('showAbout', [''])[0].lower() == 'true':
+                result['about'] = self.store.get_many(
+                    object_id, [ABOUT_TAG]).get(ABOUT_TAG)
+            return Response(200, result)
+        if method in ('GET', 'HEAD'):
+            tags = self.comments.merge(
+                self.store.get_many(object_id, [path, ABOUT_TAG]), [path])
+            if path not in tags:
+                return error(404, 'TNoInstanceOnObject')
+            return Response(200, tags[path], VALUE)
+        denied = self.can_write(user, path)
+        if denied:
+            return denied
+        if method == 'PUT':
+            value = json.loads(decode(body))
+            self.tag_writing(object_id, path)
+            self.store.set(object_id, path, value)
+            self.tag_written(object_id, path)
+            return Response(204)
+        if method == 'DELETE':
+            self.tag_writing(object_id, path)
+            if not self.store.delete(object_id, path):
+                return error(404, 'TNoInstanceOnObject')
+            self.tag_written(object_id, path)
+            return Response(204)
+        return error(405, 'TBadRequest')
+
+    def create_object(self, body, user):
+        """
+        Creates a new object, with the about value given in the body (if
+        any).
+        """
+        if user is None:
+            return error(401, 'TUnauthorized')
+        about = None
+        if body:
+            about = json.loads(decode(body)).get('about')
+        object_id = self.store.create(about)
+        return Response(201, {'id': object_id, 'URI': 'objects/' + object_id})
+
+    def handle_values(self, method, args, body, user):
+        """
+        Gets, sets or deletes tags on the objects that match a query.
+        """
+        if method == 'PUT':
+            queries = json.loads(decode(body))['queries']
+            for query, values in queries:
+                for path in values:
+                    denied = self.can_write(user, path)
+                    if denied:
+                        return denied
+            for query, values in queries:
+                for object_id in self.store.query(query):
+                    for path, value in values.items():
+                        self.tag_writing(object_id, path)
+                        self.store.set(object_id, path, value['value'])
+                        self.tag_written(object_id, path)
+            return Response(204)
+        query = args.get('query', [None])[0]
+        paths = args.get('tag', [])
+        if query is None or not paths:
+            return error(400, 'TBadRequest')
+        if method == 'GET':
+            results = {}
+            for object_id in self.store.query(query):
+                values = self.comments.merge(
+                    self.store.get_many(object_id, paths + [ABOUT_TAG]),
+                    paths)
+                if ABOUT_TAG not in paths and '*' not in paths:
+                    values.pop(ABOUT_TAG, None)
+                results[object_id] = dict((path, {'value': value})
+                                          for path, value in values.items())
+            return Response(200, {'results': {'id': results}})
+        if method == 'DELETE':
+            for path in paths:
+                denied = self.can_write(user, path)
+                if denied:
+                    return denied
+            for object_id in self.store.query(query):
+                for path in paths:
+                    self.tag_writing(object_id, path)
+                    if self.store.delete(object_id, path):
+                        self.tag_written(object_id, path)
+            return Response(204)
+        return error(405, 'TBadRequest')
+
+    def tag_writing(self, object_id, path):
+        """
+        Compacts the comments logged for a user's comment tag before it's
+        written as a whole, rather than through the comments endpoint.
+        """
+        if is_comment_path(path):
+            about = self.store.get_many(object_id, [ABOUT_TAG]).get(ABOUT_TAG)
+            if about is not None:
+                self.comments.flush(about, path.split('/')[0])
+
+    def tag_written(self, object_id, path):
+        """
+        Tells the comment log when a user's comment tag has been written as
+        a whole, rather than through the comments endpoint.
+        """
+        if is_comment_path(path):
+            about = self.store.get_many(object_id, [ABOUT_TAG]).get(ABOUT_TAG)
+            if about is not None:
+                self.comments.replaced(about, path.split('/')[0])
+
+    def chapter(self, about):
+        """
+        Returns the about value of the chapter a block is in, or None.
+        """
+        object_id = self.store.object_id(about)
+        if object_id is None:
+            return None
+        parent = self.store.heatmap.parent_tag
+        chapter = chapter_of(self.store.get_many(object_id, [parent]).get(
+            parent, MISSING))
+        return None if chapter is MISSING else chapter
+
+    def comment_counted(self, tags, path, old, new):
+        """
+        Tells readers of a chapter when the counts of the comments on one of
+        its blocks change. Called by the store whenever a tag changes.
+        """
+        chapter = chapter_of(tags.get(self.store.heatmap.parent_tag,
+                                      MISSING))
+        if not is_comment_path(path) or chapter is MISSING:
+            return
+        about = tags[ABOUT_TAG]
+        participants, comments = self.store.heatmap.counts(chapter, about)
+        self.events.publish(chapter, 'count', {
+            'about': about, 'participants': participants,
+            'comments': comments})
+
+    def handle_comments(self, method, about, args, body, user):
+        """
+        Lists the comments on a block, adds a comment by the user to it or
+        deletes one of theirs.
+        """
+        if method in ('GET', 'HEAD'):
+            if 'since' in args:
+                return self.get_changes(about, args)
+            return self.get_comments(about, args)
+        if method not in ('POST', 'DELETE'):
+            return error(405, 'TBadRequest')
+        if user is None:
+            return error(401, 'TUnauthorized')
+        if method == 'POST':
+            text = json.loads(decode(body))['text']
+            timestamp, comment_id = self.comments.add(about, user, text)
+            self.events.publish(self.chapter(about), 'comment', {
+                'id': comment_id, 'about': about, 'author': user,
+                'timestamp': timestamp, 'text': text})
+            return Response(201, {'id': comment_id, 'about': about,
+                                  'author': user, 'timestamp': timestamp})
+        comment = self.annotations.comment(int(args['id'][0]))
+        if (comment is None or comment['about'] != about or
+                comment['author'] != user):
+            return error(404, 'TNoInstanceOnObject')
+        self.comments.delete(about, user, comment['timestamp'],
+                             comment['text'], comment['id'])
+        return Response(204)
+
+    def get_comments(self, about, args):
+        """
+        Returns a page of the comments on a block, newest first. The limit
+        argument sets the size of the page (up to MAX_PAGE) and the cursor
+        argument, if given, is the cursor returned with the page before. The
+        watermark returned with the first page is the one to ask for changes
+        since.
+        """
+        limit = int(args.get('limit', [PAGE_SIZE])[0])
+        if not 0 < limit <= MAX_PAGE:
+            return error(400, 'TBadRequest')
+        # Taken first, so nothing that changes while the page is read is
+        # missed (it may be sent again, which is harmless).
+        watermark = self.annotations.watermark()
+        comments, cursor = self.annotations.block_page(
+            about, limit, args.get('cursor', [None])[0])
+        return Response(200, {
+            'comments': [comment_json(comment) for comment in comments],
+            'cursor': cursor,
+            'watermark': watermark,
+        })
+
+    def get_changes(self, about, args):
+        """
+        Returns the comments added to a block (newest first) and the ids of
+        those deleted since the watermark in the since argument, with the
+        watermark to ask for the next changes since.
+        """
+        since = int(args['since'][0])
+        watermark = self.annotations.watermark()
+        added, deleted = self.annotations.block_changes(about, since)
+        return Response(200, {
+            'added': [comment_json(comment) for comment in added],
+            'deleted': deleted,
+            'watermark': watermark,
+        })
+
+    def get_counts(self, args):
+        """
+        Returns the number of participants commenting on the blocks of the
+        chapters and the objects named by about value in args.
+        """
+        chapters = args.get('chapter', [])
+        abouts = args.get('about', [])
+        if not chapters and not abouts:
+            return error(400, 'TBadRequest')
+        counts = {}
+        for chapter in chapters:
+            heatmap = self.store.chapter_heatmap(chapter)
+            for about, (participants, comments) in heatmap.items():
+                counts[about] = participants
+        object_ids = [self.store.object_id(about) for about in abouts]
+        counts.update(self.store.participant_counts(
+            object_id for object_id in object_ids if object_id is not None))
+        return Response(200, {'counts': counts})
+
+    def get_heatmap(self, args):
+        """
+        Returns the number of participants and of comments for each block of
+        a chapter.
+        """
+        chapter = args.get('chapter', [None])[0]
+        if chapter is None:
+            return error(400, 'TBadRequest')
+        heatmap = self.store.chapter_heatmap(chapter)
+        return Response(200, {'blocks': dict(
+            (about, {'participants': participants, 'comments': comments})
+            for about, (participants, comments) in heatmap.items())})
+
+    def get_user(self, username):
+        """
+        Returns details of a user. Every user exists unless a dictionary of
+        users was given.
+        """
+        if self.users is not None and username not in self.users:
+            return error(404, 'TNoSuchUser')
+        object_id = self.store.object_id('@' + username, create=True)
+        return Response(200, {'name': username, 'id': object_id})
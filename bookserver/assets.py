@@ -0,0 +1,346 @@
+"""
+An in-memory cache of the static files (HTML, Javascript, CSS, images and
+book data) that make up the application.
+
+Text-like files are compressed once, after they're read into the cache, by
+a background thread (or up front, by AssetCache.preload()), so requests
+never wait for compression: until a file's compressed copies are ready it's
+sent as it is. Content the server generates itself (see Asset.from_bytes())
+is compressed by the same thread.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from email.utils import formatdate
+from io import BytesIO
+
+from bookserver.compat import queue
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content types worth compressing. Images such as PNGs are already
+# compressed.
+COMPRESSIBLE_TYPES = set([
+    'application/javascript',
+    'application/json',
+    'application/x-javascript',
+    'application/xml',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+])
+
+# Files smaller than this aren't worth compressing.
+MIN_COMPRESS_BYTES = 256
+
+
+def gzip_compress(data):
+    """
+    Returns data gzipped at the highest compression level. The timestamp is
+    left out so the output only depends upon the input.
+    """
+    buf = BytesIO()
+    f = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=buf,
+                      mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+
+# The available encodings in order of preference.
+ENCODERS = [('gzip', gzip_compress)]
+if brotli is not None:
+    ENCODERS.insert(0, ('br', lambda data: brotli.compress(data)))
+
+
+def is_compressible(path):
+    """
+    Returns True if the file at path is a type that compresses well.
+    """
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type is None:
+        return False
+    return (content_type.startswith('text/') or
+            content_type in COMPRESSIBLE_TYPES)
+
+
+class Asset(object):
+    """
+    A file's contents along with the metadata needed to serve it.
+
+    The variants attribute maps content codings (e.g. "gzip") to compressed
+    copies of the body. Only those that are actually smaller are kept. They
+    are made when the Asset is, unless compress is False, in which case
+    pending is True until compress() is called.
+
+    Files too big to hold in memory have a body of None and must be read
+    from disk. Their ETag is based upon the file's size and modification
+    time rather than its contents.
+    """
+
+    def __init__(self, path, body, stat, compress=True):
+        self.path = path
+        self.body = body
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        if body is None:
+            self.etag = '"%x-%x"' % (int(self.mtime * 1000000), self.size)
+        else:
+            self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.last_modified = formatdate(int(self.mtime), usegmt=True)
+        self.compressible = is_compressible(path)
+        self.variants = {}
+        self.pending = (body is not None and self.compressible and
+                        self.size >= MIN_COMPRESS_BYTES)
+        self.memory = self.size
+        if compress:
+            self.compress()
+
+    def compress(self):
+        """
+        Makes the compressed copies of the body, unless that's been done.
+        """
+        if not self.pending:
+            return
+        variants = {}
+        for coding, encode in ENCODERS:
+            compressed = encode(self.body)
+            if len(compressed) < self.size * 0.9:
+                variants[coding] = compressed
+        self.variants = variants
+        self.memory = self.size + sum(len(v) for v in variants.values())
+        self.pending = False
+
+    @classmethod
+    def from_bytes(cls, name, body, mtime):
+        """
+        Returns an Asset for content the server generates rather than reads
+        from a file. The name (e.g. "prologue.json") decides whether it's
+        compressed, in the background, and mtime is used for Last-Modified.
+        """
+        stat = os.stat_result((0, 0, 0, 0, 0, 0, len(body), mtime, mtime,
+                               mtime))
+        asset = cls(name, body, stat, compress=False)
+        compressor.add(asset)
+        return asset
+
+    def __getstate__(self):
+        # Compressed now, as there's no telling whether anything will
+        # compress it once it's unpickled.
+        self.compress()
+        return self.__dict__
+
+    def is_current(self, stat):
+        """
+        Returns True if the file on disk hasn't changed since it was read.
+        """
+        return self.mtime == stat.st_mtime and self.size == stat.st_size
+
+    def variant_etag(self, coding):
+        """
+        Returns the ETag of the body encoded with coding (or of the body
+        itself if coding is None). Each encoding is a different
+        representation so it needs its own strong ETag.
+        """
+        if coding is None:
+            return self.etag
+        return '%s-%s"' % (self.etag[:-1], coding)
+
+    def negotiate(self, accept_encoding):
+        """
+        Given the value of an Accept-Encoding header, returns a tuple
+        (coding, body) of the best variant to send. The coding is None for
+        the uncompressed body.
+        """
+        if not self.variants or not accept_encoding:
+            return None, self.body
+        accepted = {}
+        for item in accept_encoding.split(','):
+            parts = item.strip().split(';')
+            coding = parts[0].strip().lower()
+            quality = 1.0
+            for param in parts[1:]:
+                name, _, value = param.strip().partition('=')
+                if name.strip() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            accepted[coding] = quality
+        for coding, encode in ENCODERS:
+            if coding not in self.variants:
+                continue
+            if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+                return coding, self.variants[coding]
+        return None, self.body
+
+
+class Compressor(object):
+    """
+    Compresses Assets one at a time in a background thread, started when
+    the first one is added.
+    """
+
+    def __init__(self):
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, asset, compress=None):
+        """
+        Queues asset to be compressed, unless it doesn't need to be. If
+        given, compress is called with the asset instead of its compress()
+        method.
+        """
+        if not asset.pending:
+            return
+        self._pending.put((asset, compress or Asset.compress))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run,
+                                                name='compressor')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def run(self):
+        while True:
+            asset, compress = self._pending.get()
+            try:
+                compress(asset)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._pending.task_done()
+
+    def wait(self):
+        """
+        Waits until every Asset waiting to be compressed has been.
+        """
+        self._pending.join()
+
+
+# Shared by everything that compresses in the background.
+compressor = Compressor()
+
+
+class AssetCache(object):
+    """
+    Holds the most recently used files in memory, up to max_bytes in total
+    (including compressed copies).
+
+    Each lookup checks the file's modification time so edits on disk are
+    picked up straight away. Files bigger than max_file_bytes are never
+    cached. Files read into the cache by get() are compressed in a
+    background thread.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_file_bytes=None):
+        self.max_bytes = max_bytes
+        if max_file_bytes is None:
+            max_file_bytes = max_bytes // 4
+        self.max_file_bytes = max_file_bytes
+        self.size = 0
+        self._assets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, compress=False):
+        """
+        Returns the Asset for the file at path. If the file is too big to
+        cache the Asset has no body. A file that's read into the cache is
+        compressed straight away if compress is True, otherwise in the
+        background. Raises IOError/OSError if the file can't be read.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            asset = self._assets.pop(path, None)
+            if asset is not None:
+                if asset.is_current(stat):
+                    # Re-insert to mark it as the most recently used.
+                    self._assets[path] = asset
+                    return asset
+                self.size -= asset.memory
+        if stat.st_size > self.max_file_bytes:
+            return Asset(path, None, stat)
+        with open(path, 'rb') as f:
+            body = f.read()
+            stat = os.fstat(f.fileno())
+        if len(body) != stat.st_size:
+            # The file changed while it was being read.
+            return Asset(path, None, stat)
+        asset = Asset(path, body, stat, compress)
+        with self._lock:
+            old = self._assets.pop(path, None)
+            if old is not None:
+                self.size -= old.memory
+            self._assets[path] = asset
+            self.size += asset.memory
+            self.evict()
+        compressor.add(asset, self.compress)
+        return asset
+
+    def evict(self):
+        """
+        Drops the least recently used files until the cache is within its
+        size limit. Call with the lock held.
+        """
+        while self.size > self.max_bytes:
+            evicted_path, evicted = self._assets.popitem(last=False)
+            self.size -= evicted.memory
+
+    def compress(self, asset):
+        """
+        Compresses a cached file, from the compressor's thread, keeping
+        count of the memory its compressed copies use.
+        """
+        # Files dropped from the cache in the meantime are skipped.
+        if self._assets.get(asset.path) is asset:
+            before = asset.memory
+            asset.compress()
+            with self._lock:
+                if self._assets.get(asset.path) is asset:
+                    self.size += asset.memory - before
+                    self.evict()
+
+    def wait(self):
+        """
+        Waits until every file waiting to be compressed has been.
+        """
+        compressor.wait()
+
+    def preload(self, root, exclude=()):
+        """
+        Reads (and compresses) the files under root ahead of time, so the
+        first readers to visit don't pay for it. Hidden files and
+        directories, and files whose names end with anything in exclude,
+        are skipped. Stops once the cache is full.
+        """
+        exclude = tuple(exclude)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.startswith('.') or (exclude and
+                                                filename.endswith(exclude)):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getsize(path) + self.size > self.max_bytes:
+                        continue
+                    self.get(path, compress=True)
+                except (IOError, OSError):
+                    continue
+
+    def __len__(self):
+        return len(self._assets)
+
+    def __contains__(self, path):
+        return path in self._assets
@@ -0,0 +1,306 @@
+"""
+A compact binary form of a book file, holding the same chapters and blocks
+as the JSON (see bookserver.book) without repeating the keys, or the about
+values' prefixes, for every block.
+
+The file starts with MAGIC. Everything after it is made of unsigned
+varints (seven bits per byte, least significant first, the top bit set on
+every byte but the last) and strings (a varint length followed by that
+many bytes of UTF-8):
+
+    atom count, then each atom (a string)
+    chapter count, then for each chapter:
+        about, parent               names (see below)
+        position                    varint
+        title                       string
+        flags                       varint, COMPRESSED if the HTML is
+                                    compressed with zlib
+        block count, then for each block:
+            about, parent           names
+            position                varint
+            html start, html length varints, the block's HTML in the
+                                    chapter's (uncompressed) HTML
+            reference count, then each reference's name and text
+                                    (strings)
+        HTML length                 varint, as stored
+        HTML                        the blocks' HTML, one after the other
+
+A name, such as "barefootintocyberspace:prologue:1", is split at each
+colon and written as the number of parts followed by each part's index in
+the atoms, so each distinct part of every about value is only stored once.
+"""
+import io
+import zlib
+
+from bookserver.compat import byte_at
+
+
+MAGIC = b'BOOKBIN1'
+
+# Chapter flags.
+COMPRESSED = 1
+
+
+def encode_varint(value, out):
+    """
+    Appends the varint encoding of value (a non-negative integer) to out
+    (a bytearray).
+    """
+    if value < 0:
+        raise ValueError('Cannot encode a negative number: %r' % value)
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+class BookWriter(object):
+    """
+    Encodes a list of chapters, as returned by bookserver.book.load_book,
+    in the binary form.
+    """
+
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.atoms = {}
+
+    def atom(self, part):
+        if part not in self.atoms:
+            self.atoms[part] = len(self.atoms)
+        return self.atoms[part]
+
+    def name(self, value, out):
+        parts = value.split(u':')
+        encode_varint(len(parts), out)
+        for part in parts:
+            encode_varint(self.atom(part), out)
+
+    def string(self, value, out):
+        data = value.encode('utf-8')
+        encode_varint(len(data), out)
+        out.extend(data)
+
+    def chapter(self, chapter, out):
+        self.name(chapter['about'], out)
+        self.name(chapter['parent'], out)
+        encode_varint(chapter['position'], out)
+        self.string(chapter['title'], out)
+        encode_varint(COMPRESSED if self.compress else 0, out)
+        encode_varint(len(chapter['blocks']), out)
+        html = bytearray()
+        for block in chapter['blocks']:
+            self.name(block['about'], out)
+            self.name(block['parent'], out)
+            encode_varint(block['position'], out)
+            data = block['html'].encode('utf-8')
+            encode_varint(len(html), out)
+            encode_varint(len(data), out)
+            html.extend(data)
+            references = block.get('references') or {}
+            encode_varint(len(references), out)
+            for name in sorted(references):
+                self.string(name, out)
+                self.string(references[name], out)
+        html = bytes(html)
+        if self.compress:
+            html = zlib.compress(html, 9)
+        encode_varint(len(html), out)
+        out.extend(html)
+
+    def encode(self, chapters):
+        """
+        Returns the binary form (bytes) of chapters.
+        """
+        body = bytearray()
+        encode_varint(len(chapters), body)
+        for chapter in chapters:
+            self.chapter(chapter, body)
+        out = bytearray(MAGIC)
+        atoms = sorted(self.atoms, key=self.atoms.get)
+        encode_varint(len(atoms), out)
+        for atom in atoms:
+            self.string(atom, out)
+        return bytes(out + body)
+
+
+class BinaryBlock(object):
+    """
+    A block read from the binary form. Its HTML is only decoded when asked
+    for; html_bytes() gives it without copying.
+    """
+
+    __slots__ = ('about', 'parent', 'position', 'references', '_book',
+                 '_chapter', '_start', '_end')
+
+    def __init__(self, about, parent, position, references, book, chapter,
+                 start, end):
+        self.about = about
+        self.parent = parent
+        self.position = position
+        self.references = references
+        self._book = book
+        self._chapter = chapter
+        self._start = start
+        self._end = end
+
+    def html_bytes(self):
+        """
+        Returns a memoryview of the block's HTML, as UTF-8.
+        """
+        return self._book.chapter_html(self._chapter)[self._start:self._end]
+
+    @property
+    def html(self):
+        return self.html_bytes().tobytes().decode('utf-8')
+
+    def to_dict(self):
+        """
+        Returns the block as it appears in the JSON book file.
+        """
+        block = {'about': self.about, 'parent': self.parent,
+                 'position': self.position, 'html': self.html}
+        if self.references:
+            block['references'] = dict(self.references)
+        return block
+
+
+class BinaryBook(object):
+    """
+    A book in the binary form, read from data (bytes). Every chapter's
+    details and blocks are read up front, but HTML is left where it is in
+    data (or, if compressed, decompressed the first time it's needed).
+    Raises ValueError if data isn't a whole binary book.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        if self._view[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError('Not a binary book file')
+        self._offset = len(MAGIC)
+        self._html = {}
+        self._compressed = {}
+        self.chapters = []
+        self.blocks = {}
+        try:
+            self._atoms = [self.string() for i in range(self.varint())]
+            for index in range(self.varint()):
+                self.chapters.append(self.chapter(index))
+        except IndexError:
+            # Truncated, or a name refers to an atom there isn't.
+            raise ValueError('Not a binary book file')
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            byte = byte_at(self._view, self._offset)
+            self._offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def take(self, length):
+        """
+        Returns a memoryview of the next length bytes.
+        """
+        start = self._offset
+        self._offset += length
+        if self._offset > len(self._view):
+            raise IndexError('Past the end of the data')
+        return self._view[start:self._offset]
+
+    def string(self):
+        return self.take(self.varint()).tobytes().decode('utf-8')
+
+    def name(self):
+        return u':'.join(self._atoms[self.varint()]
+                         for i in range(self.varint()))
+
+    def chapter(self, index):
+        chapter = {
+            'about': self.name(),
+            'parent': self.name(),
+            'position': self.varint(),
+            'title': self.string(),
+        }
+        flags = self.varint()
+        blocks = []
+        for i in range(self.varint()):
+            about = self.name()
+            parent = self.name()
+            position = self.varint()
+            start = self.varint()
+            end = start + self.varint()
+            references = [(self.string(), self.string())
+                          for j in range(self.varint())]
+            block = BinaryBlock(about, parent, position, references, self,
+                                index, start, end)
+            blocks.append(block)
+            self.blocks[about] = block
+        chapter['blocks'] = blocks
+        html = self.take(self.varint())
+        if flags & COMPRESSED:
+            # Decompressed when first needed, by chapter_html().
+            self._compressed[index] = html
+        else:
+            self._html[index] = html
+        return chapter
+
+    def chapter_html(self, index):
+        """
+        Returns a memoryview of the HTML of all the blocks in the chapter at
+        index.
+        """
+        html = self._html.get(index)
+        if html is None:
+            compressed = self._compressed.pop(index)
+            html = memoryview(zlib.decompress(compressed.tobytes()))
+            self._html[index] = html
+        return html
+
+    def block_html(self, about):
+        """
+        Returns a memoryview of the HTML of the block with the given about
+        value, as UTF-8.
+        """
+        return self.blocks[about].html_bytes()
+
+    def to_list(self):
+        """
+        Returns the book as a list of chapters, just as
+        bookserver.book.load_book would read it from the JSON.
+        """
+        chapters = []
+        for chapter in self.chapters:
+            chapter = dict(chapter)
+            chapter['blocks'] = [block.to_dict()
+                                 for block in chapter['blocks']]
+            chapters.append(chapter)
+        return chapters
+
+
+def dump_book(chapters, path, compress=False):
+    """
+    Writes chapters (as returned by bookserver.book.load_book) to the file
+    at path in the binary form.
+    """
+    with open(path, 'wb') as f:
+        f.write(BookWriter(compress).encode(chapters))
+
+
+def open_book(path):
+    """
+    Returns the BinaryBook in the file at path.
+    """
+    with io.open(path, 'rb') as f:
+        return BinaryBook(f.read())
+
+
+def load_binary_book(path):
+    """
+    Returns the list of chapters in the binary book file at path, ordered by
+    position, as bookserver.book.load_book does for JSON.
+    """
+    chapters = open_book(path).to_list()
+    chapters.sort(key=lambda chapter: chapter['position'])
+    return chapters
@@ -0,0 +1,170 @@
+"""
+Holding one or more books in memory without a dictionary (and its keys)
+for every block.
+
+A BlockStore keeps the blocks of every book it's given in columns: their
+positions, parents and the offsets of their HTML in arrays of integers,
+their HTML, as UTF-8, in a single buffer, and their about values in a list
+of strings shared with everything else that refers to them. Blocks are only
+turned back into dictionaries (as found in the book file) when asked for.
+"""
+from array import array
+
+from bookserver.book import DEFAULT_BOOK, chapter_name, load_book
+
+
+class BlockStore(object):
+    """
+    The blocks of any number of books. Behaves as a read-only dictionary
+    mapping chapters' short names (e.g. "prologue") to chapters, as returned
+    by bookserver.book.load_book. If books share a chapter name, the first
+    book added has it.
+    """
+
+    def __init__(self):
+        # Each distinct string (about value, title) is only held once.
+        self._strings = {}
+        self._abouts = []
+        self._index = {}
+        self._positions = array('l')
+        # Indexes into _parent_abouts.
+        self._parents = array('l')
+        self._parent_abouts = []
+        self._parent_ids = {}
+        # A block's HTML is from _offsets[i] to _offsets[i + 1] in _html.
+        self._offsets = array('l', [0])
+        self._html = bytearray()
+        # Few blocks have references, so they're kept by the block's index.
+        self._references = {}
+        # Tuples of (about, parent, position, title, first block, end),
+        # ordered by position within each book.
+        self._chapters = []
+        self._names = {}
+
+    def intern(self, value):
+        return self._strings.setdefault(value, value)
+
+    def parent_id(self, parent):
+        if parent not in self._parent_ids:
+            self._parent_ids[parent] = len(self._parent_abouts)
+            self._parent_abouts.append(self.intern(parent))
+        return self._parent_ids[parent]
+
+    def add_book(self, chapters):
+        """
+        Adds the chapters of a book (as returned by
+        bookserver.book.load_book).
+        """
+        for chapter in sorted(chapters, key=lambda c: c['position']):
+            first = len(self._abouts)
+            for block in sorted(chapter['blocks'],
+                                key=lambda block: block['position']):
+                self.add_block(block)
+            about = self.intern(chapter['about'])
+            self._names.setdefault(chapter_name(about), len(self._chapters))
+            self._chapters.append((about,
+                                   self.intern(chapter.get('parent')),
+                                   chapter['position'],
+                                   self.intern(chapter['title']),
+                                   first, len(self._abouts)))
+
+    def add_block(self, block):
+        index = len(self._abouts)
+        about = self.intern(block['about'])
+        self._abouts.append(about)
+        self._index[about] = index
+        self._positions.append(block['position'])
+        self._parents.append(self.parent_id(block['parent']))
+        self._html.extend(block['html'].encode('utf-8'))
+        self._offsets.append(len(self._html))
+        if block.get('references'):
+            self._references[index] = block['references']
+
+    def html_bytes(self, index):
+        """
+        Returns a memoryview of the HTML, as UTF-8, of the block at index.
+        """
+        return memoryview(self._html)[self._offsets[index]:
+                                      self._offsets[index + 1]]
+
+    def block_at(self, index):
+        block = {
+            'about': self._abouts[index],
+            'parent': self._parent_abouts[self._parents[index]],
+            'position': self._positions[index],
+            'html': self.html_bytes(index).tobytes().decode('utf-8'),
+        }
+        if index in self._references:
+            block['references'] = dict(self._references[index])
+        return block
+
+    def block(self, about):
+        """
+        Returns the block with the given about value, or None if there isn't
+        one.
+        """
+        index = self._index.get(about)
+        return None if index is None else self.block_at(index)
+
+    def html(self, about):
+        """
+        Returns the HTML of the block with the given about value.
+        """
+        index = self._index[about]
+        return self.html_bytes(index).tobytes().decode('utf-8')
+
+    def chapter_at(self, index):
+        about, parent, position, title, first, end = self._chapters[index]
+        chapter = {
+            'about': about,
+            'position': position,
+            'title': title,
+            'blocks': [self.block_at(i) for i in range(first, end)],
+        }
+        if parent is not None:
+            chapter['parent'] = parent
+        return chapter
+
+    def chapters(self):
+        """
+        Yields every chapter, one book after another.
+        """
+        for index in range(len(self._chapters)):
+            yield self.chapter_at(index)
+
+    def count_blocks(self):
+        return len(self._abouts)
+
+    def get(self, name, default=None):
+        """
+        Returns the named chapter.
+        """
+        index = self._names.get(name)
+        return default if index is None else self.chapter_at(index)
+
+    def __getitem__(self, name):
+        chapter = self.get(name)
+        if chapter is None:
+            raise KeyError(name)
+        return chapter
+
+    def keys(self):
+        return sorted(self._names, key=self._names.get)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+
+def load_blocks(path=DEFAULT_BOOK):
+    """
+    Returns a BlockStore holding the book in the book file at path.
+    """
+    store = BlockStore()
+    store.add_book(load_book(path))
+    return store
@@ -0,0 +1,60 @@
+"""
+Reading the book's content from the JSON files in the data directory.
+
+A book file (such as data/barefoot.json) is a list of chapters. Each chapter
+has a position, an about value (e.g. "barefootintocyberspace:prologue"), a
+title and a list of blocks. Each block has a position, an about value (e.g.
+"barefootintocyberspace:prologue:1"), its parent chapter's about value, some
+HTML and, optionally, a dictionary of the references it cites.
+"""
+import io
+import json
+import os
+
+
+# The book that ships with the application.
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'data', 'barefoot.json')
+
+# The namespace in which the book's tags live in Fluidinfo.
+NAMESPACE = 'beckyhogge'
+
+# The tags, in the book's namespace, that block_tags() may give a block.
+BLOCK_TAGS = ('html', 'position', 'parent', 'references')
+
+
+def load_book(path=DEFAULT_BOOK):
+    """
+    Returns the list of chapters in the book file at path, ordered by
+    position.
+    """
+    with io.open(path, 'r', encoding='utf-8') as f:
+        chapters = json.load(f)
+    chapters.sort(key=lambda chapter: chapter['position'])
+    return chapters
+
+
+def chapter_name(about):
+    """
+    Returns the short name used in URLs for the chapter or block identified
+    by about, e.g. "prologue" for "barefootintocyberspace:prologue:1".
+    """
+    return about.split(':')[1]
+
+
+def block_tags(block, namespace=NAMESPACE):
+    """
+    Returns a dictionary of the Fluidinfo tag values for a block, as found in
+    the book's namespace.
+    """
+    tags = {
+        'fluiddb/about': block['about'],
+        namespace + '/html': block['html'],
+        namespace + '/position': block['position'],
+        namespace + '/parent': block['parent'],
+    }
+    references = block.get('references')
+    if references:
+        tags[namespace + '/references'] = [references[name] for name in
+                                           sorted(references)]
+    return tags
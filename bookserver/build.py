@@ -0,0 +1,164 @@
+"""
+Builds the application as a static site, for hosting on a CDN (or any web
+server) without a Python process. The output directory holds:
+
+    index.html                  the application
+    read/<name>.html            the application showing a chapter
+    chapters/<name>.html        a chapter's markup, fetched by getChapter
+    chapters/<name>.json        a chapter's blocks, in order
+    backend.js                  says to use Fluidinfo for annotations
+    js/..., images/...          the assets, as they are and fingerprinted
+    manifest.json               maps asset paths to fingerprinted paths
+    _headers                    cache headers, in the format understood by
+                                Netlify and Cloudflare Pages
+
+The scripts, stylesheets and images index.html refers to are copied with a
+hash of their content in the name (e.g. js/bookreader.0123456789ab.js) and
+the pages refer to those copies, which can be cached forever. Everything is
+also copied under its original name for anything referred to from
+Javascript.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+
+from bookserver.blocks import load_blocks
+from bookserver.book import DEFAULT_BOOK, NAMESPACE, chapter_name
+from bookserver.chapters import chapter_document, encode_document
+from bookserver.handler import NO_BACKEND_SCRIPT
+from bookserver.render import render_chapter, render_page
+
+
+# The directories and files under the application's root that are served
+# to browsers.
+STATIC_PATHS = ('favicon.ico', 'images', 'js')
+
+# Matches relative URLs in src and href attributes.
+URL_RE = re.compile(r'''(\s(?:src|href)=")([^"#?:/][^"#?:]*)(")''')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+
+def fingerprint(path, body):
+    """
+    Returns path with (part of) a hash of body before its extension.
+    """
+    base, extension = os.path.splitext(path)
+    return '%s.%s%s' % (base, hashlib.sha1(body).hexdigest()[:12], extension)
+
+
+def write(output, path, body):
+    """
+    Writes body (bytes) to the file at path (a URL path) under output.
+    """
+    target = os.path.join(output, *path.split('/'))
+    directory = os.path.dirname(target)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(target, 'wb') as f:
+        f.write(body)
+
+
+class SiteBuilder(object):
+    """
+    Builds the application found at root into the output directory.
+    """
+
+    def __init__(self, root, output, book=DEFAULT_BOOK, namespace=NAMESPACE):
+        self.root = root
+        self.output = output
+        self.book = book
+        self.namespace = namespace
+        self.manifest = {}
+        self.headers = []
+
+    def build(self):
+        """
+        Builds the site and returns the manifest of fingerprinted assets.
+        """
+        if not os.path.isdir(self.output):
+            os.makedirs(self.output)
+        self.copy_static()
+        with io.open(os.path.join(self.root, 'index.html'),
+                     encoding='utf-8') as f:
+            page = self.rewrite(f.read())
+        write(self.output, 'index.html', page.encode('utf-8'))
+        self.headers.append(('/index.html', REVALIDATE))
+        write(self.output, 'backend.js', NO_BACKEND_SCRIPT)
+        self.headers.append(('/backend.js', REVALIDATE))
+        for chapter in load_blocks(self.book).chapters():
+            self.build_chapter(chapter, page)
+        self.headers.append(('/chapters/*', REVALIDATE))
+        self.headers.append(('/read/*', REVALIDATE))
+        write(self.output, 'manifest.json', json.dumps(
+            self.manifest, indent=2, sort_keys=True).encode('utf-8'))
+        write(self.output, '_headers', ''.join(
+            '%s\n  Cache-Control: %s\n' % rule
+            for rule in self.headers).encode('utf-8'))
+        return self.manifest
+
+    def copy_static(self):
+        """
+        Copies the assets into the output directory under their own names.
+        """
+        for name in STATIC_PATHS:
+            source = os.path.join(self.root, name)
+            if os.path.isfile(source):
+                shutil.copy2(source, os.path.join(self.output, name))
+                continue
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                target = os.path.join(self.output,
+                                      os.path.relpath(dirpath, self.root))
+                if not os.path.isdir(target):
+                    os.makedirs(target)
+                for filename in filenames:
+                    if not filename.startswith('.'):
+                        shutil.copy2(os.path.join(dirpath, filename),
+                                     os.path.join(target, filename))
+
+    def asset_url(self, path):
+        """
+        Returns the URL of the fingerprinted copy of the asset at path
+        (relative to the root), making the copy if needed. Paths that
+        aren't assets, or are missing, are returned unchanged.
+        """
+        if path in self.manifest:
+            return self.manifest[path]
+        source = os.path.join(self.root, *path.split('/'))
+        if (path.split('/')[0] not in STATIC_PATHS or
+                not os.path.isfile(source)):
+            return path
+        with open(source, 'rb') as f:
+            body = f.read()
+        url = fingerprint(path, body)
+        write(self.output, url, body)
+        self.manifest[path] = url
+        self.headers.append(('/' + url, IMMUTABLE))
+        return url
+
+    def rewrite(self, markup):
+        """
+        Returns markup with the assets it refers to replaced by their
+        fingerprinted copies.
+        """
+        return URL_RE.sub(lambda match: match.group(1) +
+                          self.asset_url(match.group(2)) + match.group(3),
+                          markup)
+
+    def build_chapter(self, chapter, page):
+        """
+        Writes a chapter's JSON, markup and page.
+        """
+        name = chapter_name(chapter['about'])
+        document = chapter_document(chapter, self.namespace)
+        write(self.output, 'chapters/%s.json' % name,
+              encode_document(document))
+        markup = self.rewrite(render_chapter(document, self.namespace))
+        write(self.output, 'chapters/%s.html' % name, markup.encode('utf-8'))
+        write(self.output, 'read/%s.html' % name,
+              render_page(page, chapter, markup).encode('utf-8'))
@@ -0,0 +1,175 @@
+"""
+Every book in the data directory, so one server can host many of them.
+
+When it's made, a Catalog looks at each book file (*.json) in the directory
+and keeps a description of it: its title and the names and titles of its
+chapters. These come from the book's offset index (see
+bookserver.offsets), so for books that have been seen before none of their
+content is read. A book's chapters are only read, and rendered, when one of
+them is asked for, and only the most recently used max_books books are kept
+in memory.
+
+Calling scan() again picks up books that have been added, changed or
+removed since. A book that's asked for is loaded again straight away if its
+file has changed since it was loaded.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from bookserver.assets import Asset
+from bookserver.book import DEFAULT_BOOK, NAMESPACE
+from bookserver.chapters import ChapterIndex
+from bookserver.offsets import LazyBook
+
+
+# Where the application's books live.
+DATA_DIRECTORY = os.path.dirname(DEFAULT_BOOK)
+
+BOOK_EXTENSION = '.json'
+
+
+def describe(book_id, book):
+    """
+    Returns a dictionary describing a book (a LazyBook), for the catalog.
+    """
+    about = book.about()
+    title = about
+    if title is not None and title.startswith('book:'):
+        title = title[len('book:'):]
+    return {
+        'id': book_id,
+        'about': about,
+        'title': title,
+        'chapters': [{'name': name, 'title': chapter_title}
+                     for name, chapter_title in book.contents()],
+        'blocks': book.count_blocks(),
+    }
+
+
+class Catalog(object):
+    """
+    Maps the id of each book in directory (its file name without the
+    extension, e.g. "barefoot") to a ChapterIndex of its chapters, loaded
+    when first asked for. Loading a book beyond max_books evicts the least
+    recently used one.
+    """
+
+    def __init__(self, directory=DATA_DIRECTORY, max_books=16,
+                 namespace=NAMESPACE):
+        self.directory = directory
+        self.max_books = max_books
+        self.namespace = namespace
+        self._paths = {}
+        self._stats = {}
+        self._descriptions = {}
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        """
+        Finds and describes every book in the directory. Books already in
+        memory whose files have changed (or gone) are dropped, to be loaded
+        again when next asked for.
+        """
+        paths = {}
+        stats = {}
+        descriptions = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(BOOK_EXTENSION):
+                continue
+            path = os.path.join(self.directory, filename)
+            book_id = filename[:-len(BOOK_EXTENSION)]
+            try:
+                stat = os.stat(path)
+                book = LazyBook(path)
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                if book_id in self._descriptions:
+                    # Probably caught half written, so keep the version we
+                    # have until the next scan.
+                    descriptions[book_id] = self._descriptions[book_id]
+                    paths[book_id] = path
+                    stats[book_id] = self._stats[book_id]
+                # Otherwise it's not a book.
+                continue
+            try:
+                descriptions[book_id] = describe(book_id, book)
+            finally:
+                book.close()
+            paths[book_id] = path
+            stats[book_id] = (stat.st_mtime, stat.st_size)
+        books = [descriptions[book_id] for book_id in sorted(descriptions)]
+        mtime = max([stat[0] for stat in stats.values()] or [0])
+        listing = Asset.from_bytes(
+            'books.json', json.dumps({'books': books}, sort_keys=True,
+                                     separators=(',', ':')).encode('utf-8'),
+            mtime)
+        with self._lock:
+            for book_id, (version, index) in list(self._loaded.items()):
+                if stats.get(book_id) != version:
+                    del self._loaded[book_id]
+            self._paths = paths
+            self._stats = stats
+            self._descriptions = descriptions
+            self.listing = listing
+
+    def get(self, book_id):
+        """
+        Returns the ChapterIndex of the book with the given id, or None if
+        there isn't one. A book whose file has changed since it was loaded
+        is loaded again, without waiting for the next scan().
+        """
+        with self._lock:
+            path = self._paths.get(book_id)
+            if path is None:
+                return None
+            version, index = self._loaded.get(book_id, (None, None))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if version != (stat.st_mtime, stat.st_size):
+            # Read without the lock held, so requests for other books
+            # aren't kept waiting.
+            try:
+                book = LazyBook(path)
+            except (ValueError, KeyError, TypeError):
+                if index is None:
+                    raise
+                # Probably caught half written, so keep the version we have
+                # until it's complete.
+                book = None
+            if book is not None:
+                version = (book.mtime, book.size)
+                index = ChapterIndex(book, book.mtime, self.namespace)
+        with self._lock:
+            if self._paths.get(book_id) != path:
+                # Dropped by a scan in the meantime.
+                return index
+            loaded = self._loaded.pop(book_id, None)
+            if loaded is not None and loaded[0] == version:
+                # Another request loaded the same version first.
+                index = loaded[1]
+            else:
+                while len(self._loaded) >= self.max_books:
+                    # Requests already using an evicted book keep it until
+                    # they're done with it.
+                    self._loaded.popitem(last=False)
+            # Most recently used last.
+            self._loaded[book_id] = (version, index)
+            return index
+
+    def loaded(self):
+        """
+        Returns the ids of the books in memory, least recently used first.
+        """
+        with self._lock:
+            return list(self._loaded)
+
+    def __contains__(self, book_id):
+        return book_id in self._paths
+
+    def __len__(self):
+        return len(self._paths)
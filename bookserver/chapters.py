@@ -0,0 +1,160 @@
+"""
+The book's chapters, each ready to be served at /chapters/<name> (e.g.
+/chapters/prologue) as a single JSON document holding the chapter's blocks
+already in order, and at /chapters/<name>.html as the markup
+js/bookreader.js displays. Given the application's page (index.html) the
+index also holds a copy of the page for each chapter, with the chapter in
+place, to serve at /read/<name>.
+
+Each block in the JSON has the same tag values js/bookreader.js would
+otherwise fetch from Fluidinfo, so a client can render a chapter without a
+query and without sorting it.
+"""
+import json
+import threading
+
+from bookserver.assets import Asset
+from bookserver.book import NAMESPACE, block_tags, chapter_name
+from bookserver.render import render_chapter, render_page
+
+
+def chapter_document(chapter, namespace=NAMESPACE):
+    """
+    Returns a dictionary describing a chapter and its blocks, ordered by
+    position, ready to be encoded as JSON.
+    """
+    blocks = sorted(chapter['blocks'], key=lambda block: block['position'])
+    return {
+        'about': chapter['about'],
+        'title': chapter['title'],
+        'position': chapter['position'],
+        'blocks': [block_tags(block, namespace) for block in blocks],
+    }
+
+
+def encode_document(document):
+    """
+    Returns a chapter's document (see chapter_document()) as compact JSON.
+    """
+    return json.dumps(document, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class ChapterIndex(object):
+    """
+    Maps each chapter's short name to an Asset holding the chapter as JSON
+    (and the name followed by ".html" to one holding its markup). Chapters
+    may be a list of chapters or a dictionary mapping names to chapters
+    (such as a bookserver.offsets.LazyBook). Each chapter is rendered (and
+    compressed) the first time it's asked for, after which serving it is a
+    dictionary lookup.
+    """
+
+    def __init__(self, chapters, mtime, namespace=NAMESPACE, page=None):
+        self.set_book(chapters)
+        self._mtime = mtime
+        self._namespace = namespace
+        self._page = page
+        self._assets = {}
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def set_book(self, chapters):
+        """
+        Sets the chapters that those not yet rendered are read from. An
+        index loaded from a pickle needs them set again, as only what had
+        already been rendered is pickled, not the book itself.
+        """
+        if isinstance(chapters, list):
+            chapters = dict((chapter_name(chapter['about']), chapter)
+                            for chapter in chapters)
+        self._chapters = chapters
+
+    def render(self, name):
+        """
+        Renders the named chapter's assets, unless that's already been done.
+        Returns False if there's no such chapter.
+        """
+        if name in self._assets:
+            return True
+        with self._lock:
+            if name in self._assets:
+                return True
+            chapter = self._chapters.get(name)
+            if chapter is None:
+                return False
+            document = chapter_document(chapter, self._namespace)
+            markup = render_chapter(document, self._namespace)
+            self._assets[name + '.html'] = Asset.from_bytes(
+                name + '.html', markup.encode('utf-8'), self._mtime)
+            if self._page is not None:
+                body = render_page(self._page, chapter, markup)
+                self._pages[name] = Asset.from_bytes(
+                    name + '.html', body.encode('utf-8'), self._mtime)
+            # Set last, as it's what tells other threads the work is done.
+            self._assets[name] = Asset.from_bytes(
+                name + '.json', encode_document(document), self._mtime)
+        return True
+
+    def get(self, name):
+        """
+        Returns the Asset for the named chapter, or None if there isn't one.
+        """
+        if name.endswith('.html'):
+            if not self.render(name[:-len('.html')]):
+                return None
+        elif not self.render(name):
+            return None
+        return self._assets.get(name)
+
+    def page(self, name):
+        """
+        Returns the Asset for the page showing the named chapter, or None if
+        there isn't one.
+        """
+        if not self.render(name):
+            return None
+        return self._pages.get(name)
+
+    def render_all(self):
+        """
+        Renders every chapter, so none is rendered while a reader waits.
+        """
+        for name in self._chapters:
+            self.render(name)
+
+    def updated(self, chapters, mtime):
+        """
+        Returns a new ChapterIndex for chapters (a new version of this
+        index's book), with every chapter already rendered. Assets whose
+        content is the same as this index's are carried over, so only the
+        chapters that changed get a new ETag and Last-Modified.
+        """
+        index = ChapterIndex(chapters, mtime, self._namespace, self._page)
+        index.render_all()
+        for new, old in ((index._assets, self._assets),
+                         (index._pages, self._pages)):
+            for name, asset in list(new.items()):
+                previous = old.get(name)
+                if previous is not None and previous.body == asset.body:
+                    new[name] = previous
+        return index
+
+    def __getstate__(self):
+        # Only what's already been rendered is kept, not the book itself
+        # (which might be a LazyBook), so set_book() after unpickling.
+        state = dict(self.__dict__)
+        del state['_lock']
+        del state['_chapters']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._chapters = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return sorted(self._chapters)
+
+    def __len__(self):
+        return len(self._chapters)
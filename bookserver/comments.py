@@ -0,0 +1,293 @@
+"""
+Comments left through the local backend, kept as an append-only log for
+each block and user rather than by rewriting the user's comment tag.
+
+Adding a comment appends it to the log and deleting one appends a tombstone,
+so each costs the same however much the user has written. Every so often,
+in the background, the log is compacted: its entries are folded into a
+snapshot of the user's comments, which is packed into the "<user>/comment"
+tag just as packComments in js/bookreader.js would pack it, so everything
+that reads the tags carries on working. Until then, those reading a tag
+through the API see it with the logged comments merged in (see
+CommentLog.merge()).
+
+Given a bookserver.annotations.AnnotationStore, the log also writes each
+comment to it as it's added or deleted, so comments outlive the server.
+"""
+import threading
+import traceback
+from email.utils import formatdate
+
+from bookserver.compat import string_types
+from bookserver.heatmap import COMMENT_SEPARATOR, MISSING, is_comment_path
+from bookserver.store import ABOUT_TAG
+
+
+ADD = 'add'
+DELETE = 'delete'
+
+# Stands in for the date of comments whose date isn't known (what
+# Date(0).toUTCString() returns in a browser).
+UNKNOWN_DATE = u'Thu, 01 Jan 1970 00:00:00 GMT'
+
+
+def format_timestamp(seconds=None):
+    """
+    Returns the time (now, by default) as Date.toUTCString() formats it in
+    js/bookreader.js.
+    """
+    return formatdate(seconds, usegmt=True)
+
+
+def comment_path(author):
+    return author + '/comment'
+
+
+def pack_comments(comments):
+    """
+    Returns a list of (timestamp, text) pairs packed into one string, just
+    as packComments in js/bookreader.js does.
+    """
+    packed = [timestamp + u'\n' + text for timestamp, text in comments]
+    if len(packed) == 1:
+        return packed[0] + COMMENT_SEPARATOR
+    return COMMENT_SEPARATOR.join(packed)
+
+
+def unpack_comments(value):
+    """
+    Returns the list of (timestamp, text) pairs packed into the value of a
+    comment tag, just as extractComments in js/bookreader.js unpacks them.
+    """
+    if value is MISSING:
+        return []
+    if not isinstance(value, string_types):
+        return [(UNKNOWN_DATE, u'Unreadable comment.')]
+    if COMMENT_SEPARATOR not in value:
+        return [(UNKNOWN_DATE, value)]
+    # Each comment starts with a 29 character date and a newline.
+    return [(comment[:29], comment[30:])
+            for comment in value.split(COMMENT_SEPARATOR)
+            if len(comment) > 31]
+
+
+class Log(object):
+    """
+    One user's comments on one block: the snapshot taken when the log was
+    last compacted, the entries appended since and the tag value the
+    snapshot was packed into (or read from).
+    """
+
+    __slots__ = ('snapshot', 'entries', 'value')
+
+    def __init__(self, value):
+        self.snapshot = unpack_comments(value)
+        self.entries = []
+        self.value = value
+
+    def comments(self):
+        """
+        Returns the list of (timestamp, text) pairs the log holds, oldest
+        first.
+        """
+        comments = list(self.snapshot)
+        for operation, timestamp, text in self.entries:
+            if operation == ADD:
+                comments.append((timestamp, text))
+            elif (timestamp, text) in comments:
+                comments.remove((timestamp, text))
+        return comments
+
+
+class CommentLog(object):
+    """
+    Logs the comments users add to and delete from the objects in store (a
+    TagStore), compacting them into the users' comment tags. When started,
+    compacts every interval seconds in a background thread. If given, the
+    comments are also kept in annotations (an AnnotationStore).
+    """
+
+    def __init__(self, store, annotations=None, interval=1.0):
+        self.store = store
+        self.annotations = annotations
+        self.interval = interval
+        self._logs = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def value(self, about, author):
+        """
+        Returns the value of the author's comment tag on the object with the
+        given about value (or MISSING).
+        """
+        object_id = self.store.object_id(about)
+        if object_id is None:
+            return MISSING
+        return self.store.get_many(
+            object_id, [comment_path(author)]).get(comment_path(author),
+                                                   MISSING)
+
+    def log(self, about, author):
+        """
+        Returns the Log of the author's comments on a block. If the tag has
+        been written since the log was last compacted (e.g. by a client
+        rewriting the whole thing) the snapshot is taken from the tag.
+        Call with the lock held.
+        """
+        key = (about, author)
+        value = self.value(about, author)
+        log = self._logs.get(key)
+        if log is None:
+            log = self._logs[key] = Log(value)
+        elif log.value is not value:
+            log.snapshot = unpack_comments(value)
+            log.value = value
+        return log
+
+    def add(self, about, author, text):
+        """
+        Adds a comment by author to the block with the given about value.
+        Returns its timestamp and its id in annotations (or None).
+        """
+        if not is_comment_path(comment_path(author)):
+            raise ValueError('Not a username: %r' % (author,))
+        if not isinstance(text, string_types):
+            raise ValueError('Not a comment: %r' % (text,))
+        timestamp = format_timestamp()
+        with self._lock:
+            self.log(about, author).entries.append((ADD, timestamp, text))
+            self._dirty.add((about, author))
+        if self.annotations is None:
+            return timestamp, None
+        return timestamp, self.annotations.add(about, author, timestamp, text)
+
+    def delete(self, about, author, timestamp, text, comment_id=None):
+        """
+        Deletes one of the author's comments on a block with the given
+        timestamp and text (and, from annotations, the one with the given
+        id).
+        """
+        with self._lock:
+            self.log(about, author).entries.append((DELETE, timestamp, text))
+            self._dirty.add((about, author))
+        if self.annotations is not None and comment_id is not None:
+            self.annotations.delete(comment_id)
+
+    def replaced(self, about, author):
+        """
+        Records that the author's comment tag on a block has been rewritten
+        as a whole (by a client that packs the comments itself).
+        """
+        if self.annotations is None:
+            return
+        with self._lock:
+            comments = self.log(about, author).comments()
+        self.annotations.replace(about, author, comments)
+
+    def load(self):
+        """
+        Packs the comments kept in annotations into the comment tags in the
+        store.
+        """
+        if self.annotations is None:
+            return
+        with self._lock:
+            for about, author, comments in self.annotations.grouped():
+                object_id = self.store.object_id(about, create=True)
+                self.store.set(object_id, comment_path(author),
+                               pack_comments(comments))
+
+    def comments(self, about, author):
+        """
+        Returns the list of (timestamp, text) pairs for the author's comments
+        on a block, oldest first.
+        """
+        with self._lock:
+            return self.log(about, author).comments()
+
+    def merge(self, tags, paths=('*',)):
+        """
+        Returns tags (a dictionary of some of the tags on an object,
+        including its about value) with those of the comment tags among
+        paths that have comments logged since the last compaction brought
+        up to date.
+        """
+        about = tags.get(ABOUT_TAG)
+        # Checked without the lock, so reading the many objects without new
+        # comments doesn't wait for those adding them.
+        keys = [key for key in list(self._dirty) if key[0] == about and
+                ('*' in paths or comment_path(key[1]) in paths)]
+        if not keys:
+            return tags
+        tags = dict(tags)
+        with self._lock:
+            for about, author in keys:
+                comments = self.log(about, author).comments()
+                if comments:
+                    tags[comment_path(author)] = pack_comments(comments)
+                else:
+                    tags.pop(comment_path(author), None)
+        return tags
+
+    def fold(self, about, author):
+        """
+        Folds the log of the author's comments on a block into its snapshot,
+        if it has new entries, and packs the snapshot into the author's
+        comment tag (removing the tag if there are no comments left). Call
+        with the lock held.
+        """
+        if (about, author) not in self._dirty:
+            return
+        log = self.log(about, author)
+        log.snapshot = log.comments()
+        log.entries = []
+        object_id = self.store.object_id(about, create=True)
+        if log.snapshot:
+            log.value = pack_comments(log.snapshot)
+            self.store.set(object_id, comment_path(author), log.value)
+        else:
+            log.value = MISSING
+            self.store.delete(object_id, comment_path(author))
+        # Only once the tag's written, as merge() checks the dirty set
+        # without the lock.
+        self._dirty.discard((about, author))
+
+    def flush(self, about, author):
+        """
+        Compacts the log of the author's comments on a block (e.g. before
+        the tag is written as a whole).
+        """
+        with self._lock:
+            self.fold(about, author)
+
+    def compact(self):
+        """
+        Compacts every log with new entries.
+        """
+        with self._lock:
+            for about, author in list(self._dirty):
+                self.fold(about, author)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.compact()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        """
+        Starts compacting in a background thread, unless that's already
+        happening.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name='comments')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,40 @@
+"""
+Imports that differ between Python 2 and Python 3.
+"""
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from http.server import SimpleHTTPRequestHandler
+except ImportError:  # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+try:
+    from urllib.parse import unquote, urlsplit, parse_qs
+except ImportError:  # Python 2
+    from urllib import unquote
+    from urlparse import urlsplit, parse_qs
+
+try:
+    from http.client import HTTPConnection
+except ImportError:  # Python 2
+    from httplib import HTTPConnection
+
+try:
+    text_type = unicode
+    string_types = (str, unicode)
+    number_types = (int, long, float)
+except NameError:  # Python 3
+    text_type = str
+    string_types = (str,)
+    number_types = (int, float)
+
+if bytes is str:  # Python 2
+    def byte_at(data, index):
+        return ord(data[index])
+else:
+    from operator import getitem as byte_at
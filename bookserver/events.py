@@ -0,0 +1,161 @@
+"""
+Telling readers about changes to the comments on the chapter they're reading
+as they happen, with server-sent events.
+
+Each reader keeps one connection open to the local backend for the chapter
+they're reading (see EventSource in js/bookreader.js). The request handler
+sends the response headers and hands the connection over to an EventHub,
+which holds every such connection in a single thread: it writes each event
+to the connections listening to the event's chapter and, when there's
+nothing to say for a while, a comment to every connection, so those that
+have gone away are noticed. No worker is tied up by a reader waiting for
+something to happen.
+
+The connections are non-blocking, and one that can't take the whole of a
+message straight away is closed (the browser reconnects), so a reader who
+isn't keeping up can't hold up the events for everyone else.
+"""
+import json
+import socket
+import threading
+import time
+
+from bookserver.compat import queue
+
+
+# Sent first, telling browsers how many milliseconds to wait before
+# reconnecting if the connection is lost.
+PREAMBLE = b'retry: 3000\n\n'
+
+# Sent when there's been nothing else to send for a while.
+HEARTBEAT = b': keep-alive\n\n'
+
+# Put on the queue of events to stop the hub.
+STOP = object()
+
+
+def format_event(event, data):
+    """
+    Returns an event of the given type with data (encoded as JSON) in the
+    text/event-stream format.
+    """
+    return ('event: %s\ndata: %s\n\n' % (event, json.dumps(data))).encode(
+        'utf-8')
+
+
+class EventHub(object):
+    """
+    Sends events to the connections listening to each chapter. At most
+    max_streams connections are held at once, and a heartbeat is sent on
+    each of them after heartbeat seconds without an event.
+    """
+
+    def __init__(self, heartbeat=15.0, max_streams=1024):
+        self.heartbeat = heartbeat
+        self.max_streams = max_streams
+        self._streams = {}
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(streams) for streams in self._streams.values())
+
+    def full(self):
+        return len(self) >= self.max_streams
+
+    def subscribe(self, chapter, connection):
+        """
+        Starts sending the events about chapter (identified by its about
+        value) to connection, a socket that's had the response headers
+        written to it. The hub closes it when it's done with it.
+        """
+        connection.setblocking(False)
+        if not self.send(connection, PREAMBLE):
+            return
+        with self._lock:
+            self._streams.setdefault(chapter, set()).add(connection)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run,
+                                                name='events')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def publish(self, chapter, event, data):
+        """
+        Sends an event of the given type with data (anything that can be
+        encoded as JSON) to the connections listening to chapter.
+        """
+        if chapter in self._streams:
+            self._events.put((chapter, format_event(event, data)))
+
+    def send(self, connection, message):
+        """
+        Writes a message to a connection, closing it and returning False if
+        that fails or only part of the message would fit in the
+        connection's buffer.
+        """
+        try:
+            if connection.send(message) == len(message):
+                return True
+        except (socket.error, socket.timeout):
+            pass
+        try:
+            connection.close()
+        except socket.error:
+            pass
+        return False
+
+    def broadcast(self, chapter, message):
+        """
+        Writes a message to the connections listening to chapter (or every
+        connection, if chapter is None), dropping any that have gone away.
+        """
+        with self._lock:
+            if chapter is None:
+                targets = [(name, set(streams))
+                           for name, streams in self._streams.items()]
+            else:
+                targets = [(chapter, set(self._streams.get(chapter, ())))]
+        for name, streams in targets:
+            gone = set(connection for connection in streams
+                       if not self.send(connection, message))
+            if gone:
+                with self._lock:
+                    remaining = self._streams.get(name, set()) - gone
+                    if remaining:
+                        self._streams[name] = remaining
+                    else:
+                        self._streams.pop(name, None)
+
+    def run(self):
+        beat = time.time() + self.heartbeat
+        while True:
+            try:
+                item = self._events.get(timeout=max(0, beat - time.time()))
+            except queue.Empty:
+                item = None
+            if item is STOP:
+                break
+            if item is not None:
+                self.broadcast(*item)
+            if time.time() >= beat:
+                self.broadcast(None, HEARTBEAT)
+                beat = time.time() + self.heartbeat
+        with self._lock:
+            streams, self._streams = self._streams, {}
+            self._thread = None
+        for connections in streams.values():
+            for connection in connections:
+                connection.close()
+
+    def stop(self):
+        """
+        Closes every connection (once the events already published have
+        been sent).
+        """
+        with self._lock:
+            running = self._thread is not None
+        if running:
+            self._events.put(STOP)
@@ -0,0 +1,473 @@
+"""
+The request handler used to serve the application.
+"""
+import os
+import re
+import select
+import time
+from email.utils import parsedate_tz, mktime_tz
+from io import BytesIO
+
+from bookserver.api import decode
+from bookserver.assets import AssetCache
+from bookserver.compat import (SimpleHTTPRequestHandler, parse_qs, unquote,
+                               urlsplit)
+
+
+# The backend.js served when there's no local Fluidinfo backend.
+NO_BACKEND_SCRIPT = b'/* Using Fluidinfo. */\n'
+
+# Matches a Range header asking for a single range of bytes.
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileSlice(object):
+    """
+    A response body that is a part of a file on disk, sent straight from
+    the file to the socket.
+    """
+
+    def __init__(self, f, offset, length):
+        self.file = f
+        self.offset = offset
+        self.length = length
+
+    def close(self):
+        self.file.close()
+
+
+class BookRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files from the current directory, like SimpleHTTPRequestHandler,
+    but from an in-memory cache, compressed where the browser accepts it
+    and with support for conditional requests (so browsers that already
+    have a file get a "304 Not Modified") and range requests (so audio can
+    be seeked without downloading it all again).
+    """
+
+    # Shared by every request. Replace with a differently sized AssetCache to
+    # change how much memory is used.
+    assets = AssetCache()
+
+    # Keep connections open between requests so a page load doesn't pay
+    # for a new connection for every script, stylesheet and image.
+    protocol_version = 'HTTP/1.1'
+    # Seconds a kept-alive connection may sit idle before it's closed.
+    timeout = 5
+    # Requests served on one connection before it's closed.
+    max_requests = 100
+    # Seconds between checks, while a kept-alive connection is idle, that no
+    # other connection is waiting for its worker.
+    idle_interval = 0.1
+
+    # Files ending with these (those the server makes for itself and
+    # annotation databases) are never served.
+    private_suffixes = ('.idx', '.snapshot', '.tmp', '.db', '.db-journal')
+
+    # A bookserver.api.FluidinfoAPI to serve under backend_prefix, or None
+    # if the application should use Fluidinfo itself.
+    backend = None
+    backend_prefix = '/fluidinfo/'
+
+    # A bookserver.chapters.ChapterIndex to serve under chapters_prefix, or
+    # None if the book's chapters should only come from Fluidinfo.
+    chapters = None
+    chapters_prefix = '/chapters/'
+    # The application's page showing a chapter is served under read_prefix.
+    read_prefix = '/read/'
+
+    # A bookserver.catalog.Catalog of every book to serve under
+    # books_prefix, or None.
+    catalog = None
+    books_prefix = '/books/'
+
+    def setup(self):
+        SimpleHTTPRequestHandler.setup(self)
+        self.requests_handled = 0
+
+    def handle_one_request(self):
+        if self.requests_handled and not self.wait_for_request():
+            self.close_connection = True
+            return
+        self.requests_handled += 1
+        SimpleHTTPRequestHandler.handle_one_request(self)
+
+    def wait_for_request(self):
+        """
+        Waits for the next request on a kept-alive connection. Returns False
+        if the connection should be closed instead, either because it has
+        been idle for timeout seconds or because other connections are
+        waiting for a worker.
+        """
+        busy = getattr(self.server, 'is_busy', None)
+        deadline = time.time() + self.timeout
+        while not self.is_buffered():
+            remaining = deadline - time.time()
+            if remaining <= 0 or (busy and busy()):
+                return False
+            ready = select.select([self.connection], [], [],
+                                  min(remaining, self.idle_interval))[0]
+            if ready:
+                return True
+        return True
+
+    def is_buffered(self):
+        """
+        Returns True if some of the next request (e.g. one that was
+        pipelined) has already been read into rfile's buffer.
+        """
+        buffer = getattr(self.rfile, '_rbuf', None)
+        if buffer is not None:  # Python 2
+            return bool(buffer.getvalue())
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def end_headers(self):
+        """
+        Says whether the connection will stay open before ending the headers.
+        Connections are closed once they've served max_requests or if other
+        connections are waiting for a worker (idle connections are closed
+        for the same reason by wait_for_request).
+        """
+        if not self.close_connection:
+            busy = getattr(self.server, 'is_busy', None)
+            if self.requests_handled >= self.max_requests or (busy and
+                                                              busy()):
+                self.send_header('Connection', 'close')
+            elif self.request_version == 'HTTP/1.0':
+                self.send_header('Connection', 'keep-alive')
+        SimpleHTTPRequestHandler.end_headers(self)
+
+    def do_GET(self):
+        """
+        Serve a GET request.
+        """
+        if self.handle_backend():
+            return
+        body = self.send_head()
+        if body is None:
+            return
+        try:
+            if isinstance(body, FileSlice):
+                self.send_file(body)
+            else:
+                self.copyfile(body, self.wfile)
+        finally:
+            body.close()
+
+    def do_HEAD(self):
+        """
+        Serve a HEAD request.
+        """
+        if not self.handle_backend():
+            SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def do_PUT(self):
+        """
+        Only the local Fluidinfo backend accepts changes.
+        """
+        if not self.handle_backend():
+            self.send_error(405, 'Method not allowed')
+
+    do_POST = do_PUT
+    do_DELETE = do_PUT
+
+    def handle_backend(self):
+        """
+        If the request is for the local Fluidinfo backend, handles it and
+        returns True. Also answers requests for /backend.js, which tells
+        js/bookreader.js where to find the backend (if there is one).
+        """
+        parts = urlsplit(self.path)
+        if parts.path == '/backend.js':
+            if self.backend is None:
+                script = NO_BACKEND_SCRIPT
+            else:
+                script = ('var localFluidinfo = "%s";\n' %
+                          self.backend_prefix).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/javascript')
+            self.send_header('Content-Length', str(len(script)))
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(script)
+            return True
+        if (self.backend is None or
+                not parts.path.startswith(self.backend_prefix)):
+            return False
+        if (parts.path == self.backend_prefix + 'events' and
+                self.command == 'GET'):
+            self.send_events(parse_qs(parts.query))
+            return True
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        response = self.backend.handle(
+            self.command, parts.path[len(self.backend_prefix):],
+            parse_qs(parts.query, keep_blank_values=True), body,
+            self.headers.get('Authorization'))
+        self.send_response(response.status)
+        for name, value in response.headers:
+            self.send_header(name, value)
+        if response.status != 204:
+            self.send_header('Content-Length', str(len(response.body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(response.body)
+        return True
+
+    def send_events(self, args):
+        """
+        Starts the backend's stream of events about the chapter in the
+        chapter argument, then hands the connection over to the backend's
+        EventHub to send the events, so no worker waits for them.
+        """
+        chapter = args.get('chapter', [None])[0]
+        detach = getattr(self.server, 'detach', None)
+        if chapter is None or detach is None:
+            self.send_error(400, 'Bad request')
+            return
+        if self.backend.events.full():
+            self.send_error(503, 'Too many readers listening')
+            return
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.flush()
+        detach(self.request)
+        self.backend.events.subscribe(decode(chapter), self.connection)
+
+    def send_head(self):
+        """
+        Sends the response headers and returns an object containing the
+        response body (or None if there isn't one): either a file-like object
+        or, for files too big to cache, a FileSlice.
+        """
+        request_path = urlsplit(self.path).path
+        if (self.catalog is not None and
+                request_path.startswith(self.books_prefix)):
+            return self.send_book(request_path[len(self.books_prefix):])
+        if self.chapters is not None:
+            for prefix, lookup in ((self.chapters_prefix, self.chapters.get),
+                                   (self.read_prefix, self.chapters.page)):
+                if request_path.startswith(prefix):
+                    asset = lookup(unquote(request_path[len(prefix):]))
+                    if asset is None:
+                        self.send_error(404, 'No such chapter')
+                        return None
+                    return self.send_asset(asset, asset.path)
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = self.path.split('?', 1)
+            if not parts[0].endswith('/'):
+                # Redirect to the canonical URL.
+                parts[0] += '/'
+                self.send_response(301)
+                self.send_header('Location', '?'.join(parts))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            index = os.path.join(path, 'index.html')
+            if not os.path.isfile(index):
+                return SimpleHTTPRequestHandler.send_head(self)
+            path = index
+        if path.endswith(self.private_suffixes):
+            self.send_error(404, 'File not found')
+            return None
+        try:
+            asset = self.assets.get(path)
+        except (IOError, OSError):
+            self.send_error(404, 'File not found')
+            return None
+        return self.send_asset(asset, path)
+
+    def send_book(self, path):
+        """
+        Sends the catalog of books (for an empty path) or one of a book's
+        chapters (for a path such as "barefoot/chapters/prologue"), as for
+        send_head().
+        """
+        if not path:
+            return self.send_asset(self.catalog.listing,
+                                   self.catalog.listing.path)
+        parts = path.split('/')
+        if len(parts) != 3 or parts[1] != 'chapters':
+            self.send_error(404, 'File not found')
+            return None
+        index = self.catalog.get(unquote(parts[0]))
+        if index is None:
+            self.send_error(404, 'No such book')
+            return None
+        asset = index.get(unquote(parts[2]))
+        if asset is None:
+            self.send_error(404, 'No such chapter')
+            return None
+        return self.send_asset(asset, asset.path)
+
+    def send_asset(self, asset, path):
+        """
+        Sends the response headers for an Asset and returns the body, as for
+        send_head(). The path is used to open the file when the asset's body
+        isn't in memory and to decide the Content-Type.
+        """
+        byte_range = self.headers.get('Range')
+        if byte_range is None:
+            coding, body = asset.negotiate(
+                self.headers.get('Accept-Encoding'))
+        else:
+            # Ranges are only served from the uncompressed file.
+            coding, body = None, asset.body
+        etag = asset.variant_etag(coding)
+        if self.not_modified(asset, etag):
+            self.send_response(304)
+            self.send_validators(asset, etag)
+            self.end_headers()
+            return None
+        f = None
+        if body is None:
+            # Open the file before any headers go out, in case it's gone.
+            try:
+                f = open(path, 'rb')
+            except (IOError, OSError):
+                self.send_error(404, 'File not found')
+                return None
+        size = asset.size if body is None else len(body)
+        start, end = 0, size - 1
+        parsed = None
+        if byte_range is not None and self.if_range(asset, etag):
+            parsed = self.parse_range(byte_range, size)
+        if parsed is False:
+            if f is not None:
+                f.close()
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.send_validators(asset, etag)
+            self.end_headers()
+            return None
+        if parsed is None:
+            self.send_response(200)
+        else:
+            start, end = parsed
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, size))
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if coding is not None:
+            self.send_header('Content-Encoding', coding)
+        self.send_validators(asset, etag)
+        self.end_headers()
+        if f is not None:
+            return FileSlice(f, start, end - start + 1)
+        return BytesIO(body[start:end + 1])
+
+    def send_validators(self, asset, etag):
+        """
+        Sends the headers a browser uses to revalidate its cached copy.
+        """
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        if asset.variants or asset.pending:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def not_modified(self, asset, etag):
+        """
+        Returns True if the request's If-None-Match or If-Modified-Since
+        header shows the client already has the current version of asset.
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # If-Modified-Since is ignored when If-None-Match is present.
+            # Weak comparison, as the RFC requires for If-None-Match.
+            tags = [tag.strip().replace('W/', '', 1)
+                    for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            since = parse_http_date(if_modified_since)
+            if since is None:
+                return False
+            return int(asset.mtime) <= since <= time.time()
+        return False
+
+    def if_range(self, asset, etag):
+        """
+        Returns True if a Range header should be honoured: there's no
+        If-Range header or it matches the current version of asset.
+        """
+        validator = self.headers.get('If-Range')
+        if validator is None:
+            return True
+        validator = validator.strip()
+        if validator.startswith('"'):
+            return validator == etag
+        return parse_http_date(validator) == int(asset.mtime)
+
+    def parse_range(self, header, size):
+        """
+        Returns the (start, end) byte positions, inclusive, requested by the
+        Range header. Returns None if the header should be ignored (it's
+        malformed or asks for several ranges) and False if the range can't be
+        satisfied.
+        """
+        match = RANGE_RE.match(header.strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if size == 0:
+            return False
+        if not first:
+            if not last:
+                return None
+            # A suffix range: the last N bytes.
+            length = int(last)
+            if length == 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(first)
+        if start >= size:
+            return False
+        end = int(last) if last else size - 1
+        if end < start:
+            return None
+        return start, min(end, size - 1)
+
+    def send_file(self, body):
+        """
+        Copies the FileSlice body to the socket, using sendfile() so the
+        data never passes through Python where the platform allows it.
+        """
+        self.wfile.flush()
+        sendfile = getattr(self.connection, 'sendfile', None)
+        if sendfile is not None:
+            sendfile(body.file, body.offset, body.length)
+            return
+        # Python 2.
+        body.file.seek(body.offset)
+        remaining = body.length
+        while remaining > 0:
+            chunk = body.file.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+
+def parse_http_date(value):
+    """
+    Returns the HTTP date in value as seconds since the epoch, or None if it
+    isn't a valid date.
+    """
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
@@ -0,0 +1,112 @@
+"""
+A running tally, chapter by chapter, of how many readers have commented on
+each block of the book and how many comments they've left.
+
+Readers keep their comments on a block in a tag of their own, such as
+"ntoll/comment", holding every comment packed into one string by
+packComments in js/bookreader.js. The tally is adjusted whenever one of
+those tags changes, so reading a chapter's counts never looks at the tags.
+"""
+import re
+
+from bookserver.book import NAMESPACE
+from bookserver.compat import string_types
+
+
+# Matches the paths of the tags readers keep their comments in (one per
+# user, so one per participant).
+COMMENT_PATH_RE = re.compile(r'^[A-Za-z0-9_]+/comment$')
+
+# Separates the comments packed into a comment tag's value.
+COMMENT_SEPARATOR = u'\n\u00b6\n'
+
+# Stands in for the value of a tag that isn't there.
+MISSING = object()
+
+
+def is_comment_path(path):
+    return COMMENT_PATH_RE.match(path) is not None
+
+
+def chapter_of(value):
+    """
+    Returns the value of a block's parent tag if it can name a chapter (it's
+    a string), otherwise MISSING, so blocks whose parent is some other kind
+    of value aren't counted in any chapter.
+    """
+    if isinstance(value, string_types):
+        return value
+    return MISSING
+
+
+def count_comments(value):
+    """
+    Returns the number of comments packed into the value of a comment tag,
+    counted just as extractComments in js/bookreader.js unpacks them.
+    """
+    if value is MISSING:
+        return 0
+    if (not isinstance(value, string_types) or
+            COMMENT_SEPARATOR not in value):
+        # Shown as a single (possibly unreadable) comment.
+        return 1
+    # Each comment starts with a 29 character date and a newline.
+    return sum(1 for comment in value.split(COMMENT_SEPARATOR)
+               if len(comment) > 31)
+
+
+class Heatmap(object):
+    """
+    Maps each chapter's about value to a dictionary of its blocks' about
+    values and their [participants, comments] counts. The owner must call
+    tag_changed() whenever a tag changes and serialise access.
+    """
+
+    def __init__(self, about_tag, namespace=NAMESPACE):
+        self.about_tag = about_tag
+        self.parent_tag = namespace + '/parent'
+        self._chapters = {}
+
+    def tag_changed(self, tags, path, old, new):
+        """
+        Updates the counts for an object whose tag at path has changed from
+        old to new (either may be MISSING). The tags are the object's tags
+        after the change.
+        """
+        about = tags.get(self.about_tag)
+        if about is None:
+            return
+        if path == self.parent_tag:
+            old, new = chapter_of(old), chapter_of(new)
+            if old is not MISSING:
+                self._chapters.get(old, {}).pop(about, None)
+                if not self._chapters.get(old, True):
+                    del self._chapters[old]
+            if new is not MISSING:
+                # Rare, so simply count from scratch.
+                comments = [value for name, value in tags.items()
+                            if is_comment_path(name)]
+                self._chapters.setdefault(new, {})[about] = [
+                    len(comments), sum(count_comments(value)
+                                       for value in comments)]
+        elif (is_comment_path(path) and
+              chapter_of(tags.get(self.parent_tag)) is not MISSING):
+            counts = self._chapters[tags[self.parent_tag]][about]
+            counts[0] += (new is not MISSING) - (old is not MISSING)
+            counts[1] += count_comments(new) - count_comments(old)
+
+    def counts(self, chapter, about):
+        """
+        Returns a tuple of the number of participants and of comments for
+        one block of a chapter.
+        """
+        return tuple(self._chapters.get(chapter, {}).get(about, (0, 0)))
+
+    def chapter(self, chapter):
+        """
+        Returns a new dictionary mapping the about value of each block in
+        the chapter to a tuple of (participants, comments).
+        """
+        blocks = self._chapters.get(chapter, {})
+        return dict((about, tuple(counts))
+                    for about, counts in blocks.items())
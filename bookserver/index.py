@@ -0,0 +1,166 @@
+"""
+Secondary indexes on tag values, so queries don't have to look at every
+object in the store.
+
+For each tag path the index records which objects have the tag, which
+objects have each distinct value (for "=" and "!="), which objects have each
+string in a set (for "contains") and a sorted list of the numeric values
+(for "<", "<=", ">" and ">=").
+"""
+from bisect import bisect_left, bisect_right, insort
+
+from bookserver.compat import string_types
+from bookserver.query import is_number, node_path
+
+
+EMPTY = frozenset()
+
+# Sorts after every object id, for finding the end of a run of equal values
+# in the sorted lists of numbers.
+LAST_ID = u'\uffff'
+
+
+def value_key(value):
+    """
+    Returns the key under which a value is indexed for equality, or None for
+    sets of strings. Values of different types never match even if Python
+    considers them equal (e.g. True and 1).
+    """
+    if isinstance(value, bool):
+        return ('bool', value)
+    if is_number(value):
+        return ('number', value)
+    if isinstance(value, string_types):
+        return ('string', value)
+    if value is None:
+        return ('null', None)
+    return None
+
+
+def discard(sets, key, object_id):
+    """
+    Removes object_id from the set sets[key], dropping the set once it's
+    empty.
+    """
+    ids = sets.get(key)
+    if ids is not None:
+        ids.discard(object_id)
+        if not ids:
+            del sets[key]
+
+
+class TagIndex(object):
+    """
+    Indexes the values of every tag. The owner must call add() and remove()
+    whenever a tag value changes.
+    """
+
+    def __init__(self):
+        self._has = {}
+        self._values = {}
+        self._members = {}
+        self._numbers = {}
+
+    def add(self, object_id, path, value):
+        """
+        Records that the tag at path on the object has value.
+        """
+        self._has.setdefault(path, set()).add(object_id)
+        key = value_key(value)
+        if key is not None:
+            values = self._values.setdefault(path, {})
+            values.setdefault(key, set()).add(object_id)
+        else:
+            members = self._members.setdefault(path, {})
+            for item in value:
+                members.setdefault(item, set()).add(object_id)
+        if is_number(value):
+            insort(self._numbers.setdefault(path, []), (value, object_id))
+
+    def remove(self, object_id, path, value):
+        """
+        Forgets that the tag at path on the object has value.
+        """
+        discard(self._has, path, object_id)
+        key = value_key(value)
+        if key is not None:
+            discard(self._values.get(path, {}), key, object_id)
+        else:
+            members = self._members.get(path, {})
+            for item in value:
+                discard(members, item, object_id)
+        if is_number(value):
+            numbers = self._numbers[path]
+            del numbers[bisect_left(numbers, (value, object_id))]
+
+    def has(self, path):
+        """
+        Returns the (read only) set of the objects with a tag at path.
+        """
+        return self._has.get(path, EMPTY)
+
+    def equal(self, path, value):
+        """
+        Returns the (read only) set of the objects whose tag at path has
+        value.
+        """
+        return self._values.get(path, {}).get(value_key(value), EMPTY)
+
+    def between(self, path, op, value):
+        """
+        Returns the (start, end) slice of the sorted numbers for path that
+        satisfy "<number> op value", where op is <, <=, > or >=.
+        """
+        numbers = self._numbers.get(path, [])
+        if op == '<':
+            return 0, bisect_left(numbers, (value,))
+        if op == '<=':
+            return 0, bisect_right(numbers, (value, LAST_ID))
+        if op == '>':
+            return bisect_right(numbers, (value, LAST_ID)), len(numbers)
+        return bisect_left(numbers, (value,)), len(numbers)
+
+    def estimate(self, node):
+        """
+        Returns the number of objects a leaf node of a parse tree could
+        match, without finding them. This is exact except for "matches",
+        where it's the number of objects with the tag.
+        """
+        kind, path = node[0], node_path(node)
+        if kind == 'contains':
+            return len(self._members.get(path, {}).get(node[2], EMPTY))
+        if kind == 'compare':
+            op, value = node[1], node[3]
+            if op == '=':
+                return len(self.equal(path, value))
+            if op == '!=':
+                return len(self.has(path)) - len(self.equal(path, value))
+            if not is_number(value):
+                return 0
+            start, end = self.between(path, op, value)
+            return end - start
+        return len(self.has(path))
+
+    def lookup(self, node):
+        """
+        Returns a new set of the ids of the objects matching a leaf node of a
+        parse tree, or None for "matches", which the index can't answer (the
+        objects in has(path) must be tested one by one instead).
+        """
+        kind, path = node[0], node_path(node)
+        if kind == 'has':
+            return set(self.has(path))
+        if kind == 'contains':
+            return set(self._members.get(path, {}).get(node[2], EMPTY))
+        if kind == 'compare':
+            op, value = node[1], node[3]
+            if op == '=':
+                return set(self.equal(path, value))
+            if op == '!=':
+                return set(self.has(path)) - self.equal(path, value)
+            if not is_number(value):
+                return set()
+            start, end = self.between(path, op, value)
+            numbers = self._numbers.get(path, [])
+            return set(object_id for _, object_id in numbers[start:end])
+        return None
@@ -0,0 +1,254 @@
+"""
+Reading single chapters (or blocks) of a book file without parsing the rest
+of it.
+
+A companion index file (the book's path followed by ".idx", e.g.
+data/barefoot.json.idx) records each chapter's title, position and parent
+(the book's about value) and the byte offsets of the chapter and of each of
+its blocks in the book file.
+LazyBook only reads and decodes the slices of the book file it's asked
+for, so the cost of opening a book doesn't grow with its length.
+
+The index is rebuilt whenever the book file's size or modification time no
+longer match those recorded in it. LazyBook checks them again each time it
+reads a slice, so a book file that's changed while it's open is indexed
+again rather than read at stale offsets.
+"""
+import io
+import json
+import os
+import re
+import threading
+
+from bookserver.book import DEFAULT_BOOK, chapter_name
+
+
+# Bump when the layout of the index changes, so old indexes are rebuilt.
+INDEX_VERSION = 2
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+decoder = json.JSONDecoder()
+
+
+def skip(text, position, expected=None):
+    """
+    Returns the position of the next non-whitespace character in text,
+    after checking it's the expected character (if given). Raises
+    ValueError if there isn't one, e.g. because the file is truncated.
+    """
+    position = WHITESPACE_RE.match(text, position).end()
+    if position >= len(text):
+        raise ValueError('Unexpected end of file at %d' % position)
+    if expected is not None and text[position:position + 1] != expected:
+        raise ValueError('Expected %r at %d' % (expected, position))
+    return position
+
+
+def scan_array(text, position):
+    """
+    Yields the (start, end) positions of each value in the JSON array that
+    starts at position in text.
+    """
+    position = skip(text, position, '[') + 1
+    if text[skip(text, position)] == ']':
+        return
+    while True:
+        start = skip(text, position)
+        position = decoder.raw_decode(text, start)[1]
+        yield start, position
+        position = skip(text, position)
+        if text[position] == ']':
+            return
+        position = skip(text, position, ',') + 1
+
+
+def scan_object(text, position):
+    """
+    Yields (key, start, end) for each member of the JSON object that starts
+    at position in text, where start and end are the positions of the
+    member's value.
+    """
+    position = skip(text, position, '{') + 1
+    if text[skip(text, position)] == '}':
+        return
+    while True:
+        key, position = decoder.raw_decode(text, skip(text, position, '"'))
+        start = skip(text, skip(text, position, ':') + 1)
+        position = decoder.raw_decode(text, start)[1]
+        yield key, start, position
+        position = skip(text, position)
+        if text[position] == '}':
+            return
+        position = skip(text, position, ',') + 1
+
+
+def build_index(data):
+    """
+    Returns the index (a list of chapters) for the book file whose content
+    is data (bytes).
+    """
+    # Decoding as Latin-1 keeps one character per byte, so positions in the
+    # text are offsets in the file. Values are decoded properly, from their
+    # bytes, when they're needed.
+    text = data.decode('latin-1')
+    value = lambda start, end: json.loads(data[start:end].decode('utf-8'))
+    chapters = []
+    for chapter_start, chapter_end in scan_array(text, 0):
+        chapter = {'start': chapter_start, 'end': chapter_end, 'blocks': []}
+        for key, start, end in scan_object(text, chapter_start):
+            if key in ('about', 'title', 'position', 'parent'):
+                chapter[key] = value(start, end)
+            elif key == 'blocks':
+                for block_start, block_end in scan_array(text, start):
+                    block = {'start': block_start, 'end': block_end}
+                    for name, start, end in scan_object(text, block_start):
+                        if name in ('about', 'position'):
+                            block[name] = value(start, end)
+                    chapter['blocks'].append(block)
+        chapters.append(chapter)
+    chapters.sort(key=lambda chapter: chapter['position'])
+    return chapters
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def load_index(path, f):
+    """
+    Returns the index for the book file at path, open as f, from its index
+    file if that's up to date. Otherwise the index is built and saved, if
+    possible, for next time.
+    """
+    stat = os.fstat(f.fileno())
+    source = {'size': stat.st_size, 'mtime': stat.st_mtime,
+              'version': INDEX_VERSION}
+    try:
+        with io.open(index_path(path), encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        if index['source'] == source:
+            return index['chapters']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    f.seek(0)
+    chapters = build_index(f.read())
+    try:
+        with open(index_path(path), 'wb') as index_file:
+            index_file.write(json.dumps(
+                {'source': source, 'chapters': chapters},
+                separators=(',', ':')).encode('utf-8'))
+    except (IOError, OSError):
+        # A read-only data directory just means rebuilding it every time.
+        pass
+    return chapters
+
+
+class LazyBook(object):
+    """
+    A book whose chapters are only read from the book file when asked for.
+    Behaves as a read-only dictionary mapping chapters' short names (e.g.
+    "prologue") to chapters, ordered by position, as returned by
+    bookserver.book.load_book.
+    """
+
+    def __init__(self, path=DEFAULT_BOOK):
+        self.path = path
+        self._lock = threading.Lock()
+        with open(path, 'rb') as f:
+            self.read_index(f)
+
+    def read_index(self, f):
+        """
+        Reads the index of the book file, open as f, recording the file's
+        size and modification time. Call with the lock held (or from
+        __init__).
+        """
+        stat = os.fstat(f.fileno())
+        chapters = load_index(self.path, f)
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self._chapters = chapters
+        self._entries = {
+            'chapters': dict((chapter_name(chapter['about']), chapter)
+                             for chapter in chapters),
+            'blocks': dict((block['about'], block) for chapter in chapters
+                           for block in chapter['blocks']),
+        }
+
+    def read(self, kind, key):
+        """
+        Returns the chapter (if kind is "chapters") or block (if it's
+        "blocks") with the given key, freshly read from the book file, or
+        None if there isn't one. If the file's size or modification time
+        have changed since the index was read, it's read again first.
+        """
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            with self._lock:
+                if (stat.st_mtime, stat.st_size) != (self.mtime, self.size):
+                    self.read_index(f)
+                entry = self._entries[kind].get(key)
+            if entry is None:
+                return None
+            f.seek(entry['start'])
+            return json.loads(f.read(entry['end'] - entry['start'])
+                              .decode('utf-8'))
+
+    def get(self, name, default=None):
+        """
+        Returns the named chapter, freshly read from the book file.
+        """
+        chapter = self.read('chapters', name)
+        return default if chapter is None else chapter
+
+    def __getitem__(self, name):
+        chapter = self.get(name)
+        if chapter is None:
+            raise KeyError(name)
+        return chapter
+
+    def block(self, about):
+        """
+        Returns the block with the given about value, or None if there isn't
+        one.
+        """
+        return self.read('blocks', about)
+
+    def contents(self):
+        """
+        Returns a list of (name, title) for every chapter, in order.
+        """
+        return [(chapter_name(chapter['about']), chapter['title'])
+                for chapter in self._chapters]
+
+    def about(self):
+        """
+        Returns the book's about value (its chapters' parent, e.g.
+        "book:barefoot into cyberspace (becky hogge)"), or None if it doesn't
+        have one.
+        """
+        for chapter in self._chapters:
+            if chapter.get('parent'):
+                return chapter['parent']
+        return None
+
+    def count_blocks(self):
+        return len(self._entries['blocks'])
+
+    def keys(self):
+        return [chapter_name(chapter['about']) for chapter in self._chapters]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return name in self._entries['chapters']
+
+    def __len__(self):
+        return len(self._chapters)
+
+    def close(self):
+        # The book file is only open while it's being read, so there's
+        # nothing to do.
+        pass
@@ -0,0 +1,197 @@
+"""
+A parser for the Fluidinfo query language, e.g.:
+
+    beckyhogge/parent = "barefootintocyberspace:prologue"
+    has ntoll/comment and beckyhogge/position < 10
+
+Queries are parsed into trees of tuples:
+
+    ('has', path)
+    ('compare', op, path, value)   # op is one of = != < <= > >=
+    ('contains', path, value)
+    ('matches', path, text)
+    ('and', left, right)
+    ('or', left, right)
+    ('except', left, right)
+"""
+import re
+
+from bookserver.compat import number_types, string_types
+
+
+class QueryError(ValueError):
+    """
+    Raised when a query can't be parsed.
+    """
+
+
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d+)?(?![\w/:.-]))
+      | (?P<op><=|>=|!=|=|<|>)
+      | (?P<paren>[()])
+      | (?P<word>[\w:.\-]+(?:/[\w:.\-]+)*)
+    )''', re.VERBOSE | re.UNICODE)
+
+KEYWORDS = ('has', 'contains', 'matches', 'and', 'or', 'except')
+
+
+def tokenize(query):
+    """
+    Returns a list of (kind, value) tuples for the tokens in query.
+    """
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = TOKEN_RE.match(query, position)
+        if match is None:
+            raise QueryError('Unexpected character at %d in %r' %
+                             (position, query))
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'word' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+class Parser(object):
+    """
+    A recursive descent parser. Operator precedence, loosest first, is "or",
+    "and" then "except".
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self, kind=None):
+        token = self.peek()
+        if token[0] is None or (kind is not None and token[0] != kind):
+            raise QueryError('Expected %s in %r' % (kind or 'more',
+                                                    self.query))
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError('Empty query')
+        tree = self.parse_or()
+        if self.position != len(self.tokens):
+            raise QueryError('Unexpected %r in %r' % (self.peek()[1],
+                                                      self.query))
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.peek() == ('keyword', 'or'):
+            self.next()
+            tree = ('or', tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_except()
+        while self.peek() == ('keyword', 'and'):
+            self.next()
+            tree = ('and', tree, self.parse_except())
+        return tree
+
+    def parse_except(self):
+        tree = self.parse_term()
+        while self.peek() == ('keyword', 'except'):
+            self.next()
+            tree = ('except', tree, self.parse_term())
+        return tree
+
+    def parse_term(self):
+        kind, value = self.peek()
+        if (kind, value) == ('paren', '('):
+            self.next()
+            tree = self.parse_or()
+            self.next('paren')
+            return tree
+        if (kind, value) == ('keyword', 'has'):
+            self.next()
+            return ('has', self.next('word')[1])
+        path = self.next('word')[1]
+        kind, value = self.next()
+        if kind == 'op':
+            literal = self.next()
+            if literal[0] not in ('string', 'number'):
+                raise QueryError('Expected a value in %r' % self.query)
+            return ('compare', value, path, literal[1])
+        if (kind, value) == ('keyword', 'contains'):
+            return ('contains', path, self.next('string')[1])
+        if (kind, value) == ('keyword', 'matches'):
+            return ('matches', path, self.next('string')[1])
+        raise QueryError('Unexpected %r in %r' % (value, self.query))
+
+
+def parse(query):
+    """
+    Returns the parse tree for query. Raises QueryError if it's invalid.
+    """
+    return Parser(query).parse()
+
+
+def node_path(node):
+    """
+    Returns the tag path a leaf node of a parse tree tests.
+    """
+    return node[2] if node[0] == 'compare' else node[1]
+
+
+def is_number(value):
+    """
+    Returns True if value is a number (booleans aren't numbers here).
+    """
+    return isinstance(value, number_types) and not isinstance(value, bool)
+
+
+COMPARISONS = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def test(node, value):
+    """
+    Returns True if a tag value satisfies the leaf node of a parse tree
+    (anything other than "and", "or" and "except").
+    """
+    kind = node[0]
+    if kind == 'has':
+        return True
+    if kind == 'compare':
+        op, expected = node[1], node[3]
+        if op in ('=', '!='):
+            if is_number(expected):
+                equal = is_number(value) and value == expected
+            else:
+                equal = value == expected
+            return equal == (op == '=')
+        return (is_number(value) and is_number(expected) and
+                COMPARISONS[op](value, expected))
+    if kind == 'contains':
+        return isinstance(value, list) and node[2] in value
+    if kind == 'matches':
+        if not isinstance(value, string_types):
+            return False
+        words = re.findall(r'\w+', value.lower(), re.UNICODE)
+        return node[2].lower() in words
+    raise QueryError('Unknown query node %r' % (kind,))
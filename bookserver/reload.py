@@ -0,0 +1,141 @@
+"""
+Picking up changes to the book files while the server is running.
+
+A Watcher checks the modification times and sizes of some files (and the
+book files in some directories) every so often and calls a function with
+the paths of any that changed. A BookReloader is such a function: it builds
+everything served from the book anew, in the watcher's thread, and only
+then swaps it in for the old version, so requests are always served from a
+complete index.
+"""
+import os
+import threading
+import traceback
+
+from bookserver.book import chapter_name
+from bookserver.catalog import BOOK_EXTENSION
+
+
+def file_stats(paths):
+    """
+    Returns a dictionary mapping each file in paths, and each book file in
+    the directories in paths, to its (modification time, size).
+    """
+    stats = {}
+    for path in paths:
+        path = os.path.normpath(path)
+        if os.path.isdir(path):
+            names = [os.path.join(path, name)
+                     for name in sorted(os.listdir(path))
+                     if name.endswith(BOOK_EXTENSION)]
+        else:
+            names = [path]
+        for name in names:
+            try:
+                stat = os.stat(name)
+            except OSError:
+                continue
+            stats[name] = (stat.st_mtime, stat.st_size)
+    return stats
+
+
+class Watcher(object):
+    """
+    Calls callback with the set of paths (normalised) that have been
+    added, changed or removed each time check() finds any. When started,
+    checks every interval seconds in a background thread.
+
+    If callback raises an exception it's reported and the same changes are
+    passed to it again next time, so a file caught half written is picked
+    up once it's complete.
+    """
+
+    def __init__(self, paths, callback, interval=1.0):
+        self.paths = paths
+        self.callback = callback
+        self.interval = interval
+        self._stats = file_stats(paths)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Looks for changes, passing any to the callback. Returns the set of
+        changed paths.
+        """
+        stats = file_stats(self.paths)
+        changed = set(name for name in set(stats) | set(self._stats)
+                      if stats.get(name) != self._stats.get(name))
+        if changed:
+            try:
+                self.callback(changed)
+            except Exception:
+                traceback.print_exc()
+                return changed
+            self._stats = stats
+        return changed
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """
+        Starts checking in a background thread, unless that's already
+        happening in this process.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name='watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class BookReloader(object):
+    """
+    Keeps what handler (a BookRequestHandler class) serves up to date with
+    the book file at path. When the file changes, load(path) reads the new
+    version of the book (e.g. LazyBook or bookserver.blocks.load_blocks),
+    which is rendered into a new ChapterIndex before it replaces the old
+    one. If given, the blocks that changed are updated in store (a
+    TagStore), and the blocks that were removed are removed from it. Any
+    change also makes the handler's catalog scan again.
+    """
+
+    def __init__(self, handler, path, book, load, store=None):
+        self.handler = handler
+        self.path = os.path.normpath(path)
+        self.book = book
+        self.load = load
+        self.store = store
+
+    def __call__(self, changed):
+        if self.path in changed:
+            self.reload_book()
+        if self.handler.catalog is not None:
+            self.handler.catalog.scan()
+
+    def reload_book(self):
+        book = self.load(self.path)
+        mtime = os.path.getmtime(self.path)
+        chapters = self.handler.chapters.updated(book, mtime)
+        if self.store is not None:
+            contents = [book[name] for name in book]
+            self.store.load_book([
+                chapter for chapter in contents
+                if chapter != self.book.get(chapter_name(chapter['about']))])
+            # Blocks that are no longer in the book go from the store, so
+            # they stop turning up in queries.
+            blocks = set(block['about'] for chapter in contents
+                         for block in chapter['blocks'])
+            for name in self.book:
+                for block in self.book[name]['blocks']:
+                    if block['about'] not in blocks:
+                        self.store.remove(block['about'])
+        # Requests already under way finish with the old version.
+        self.handler.chapters = chapters
+        self.book = book
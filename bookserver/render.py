@@ -0,0 +1,84 @@
+"""
+Renders a chapter's blocks into the same markup getChapter in
+js/bookreader.js builds with Mustache, so the browser can insert a whole
+chapter at once, and renders whole pages (index.html with a chapter already
+in place) so a link to a chapter shows its text without waiting for any
+Javascript.
+"""
+import json
+import re
+
+from bookserver.book import NAMESPACE, chapter_name
+
+
+BLOCK_TEMPLATE = (
+    u'<div style="margin-bottom: 18px;" class="span11 offset2 textBlock">'
+    u'{html}</div><div class="span3"><a href="annotate" class="tagLink" '
+    u'target="{about}" data-references="{references}"><img '
+    u'src="images/tags.png" alt="tag" style="opacity: 0.6; filter: '
+    u'alpha(opacity=0.6); vertical-align: middle"/></a><span '
+    u'style="margin-bottom: 4px; color: #999;" id="{count_id}" '
+    u'class="participantCount"><small style="color: #999;">&nbsp;</small>'
+    u'</span></div>\n')
+
+
+def escape(text):
+    """
+    Returns text escaped for use in HTML, including attribute values.
+    """
+    return (text.replace(u'&', u'&amp;').replace(u'<', u'&lt;')
+            .replace(u'>', u'&gt;').replace(u'"', u'&quot;'))
+
+
+def count_id(about):
+    """
+    Returns the id of the element showing a block's participant count, as
+    countId in js/bookreader.js does.
+    """
+    return u'count-' + re.sub(r'[^A-Za-z0-9_-]', u'-', about)
+
+
+def render_block(tags, namespace=NAMESPACE):
+    """
+    Returns the markup for a block, given its tag values (see
+    bookserver.book.block_tags). The block's HTML is included as it is.
+    """
+    about = tags['fluiddb/about']
+    references = tags.get(namespace + '/references', [])
+    return BLOCK_TEMPLATE.format(
+        html=tags[namespace + '/html'], about=escape(about),
+        references=escape(json.dumps(references)), count_id=count_id(about))
+
+
+def render_chapter(document, namespace=NAMESPACE):
+    """
+    Returns the markup for every block of a chapter, given the chapter's
+    document (see bookserver.chapters.chapter_document).
+    """
+    return u''.join(render_block(tags, namespace)
+                    for tags in document['blocks'])
+
+
+def render_page(template, chapter, markup, root='../'):
+    """
+    Returns the application's page (template is the content of index.html)
+    showing the chapter, with its markup already in place, rather than the
+    about page. A <base> element set to root (the application's URL relative
+    to the page's) keeps the page's relative URLs working. js/bookreader.js
+    finds the chapter's name in the data-chapter attribute and attaches its
+    events.
+    """
+    name = escape(chapter_name(chapter['about']))
+    page = template.replace(
+        u'<head>', u'<head>\n        <base href="%s"/>' % escape(root), 1)
+    page = page.replace(
+        u'<div class="row" id="aboutContainer">',
+        u'<div class="row" id="aboutContainer" style="display: none;">', 1)
+    page = page.replace(
+        u'<div id="chapter" style="display: none;" class="row"></div>',
+        u'<div id="chapter" class="row" data-chapter="%s">%s</div>' % (
+            name, markup), 1)
+    return re.sub(u'<title>(.*?)</title>',
+                  lambda match: u'<title>%s - %s</title>' % (
+                      escape(chapter['title']), match.group(1)),
+                  page, count=1)
@@ -0,0 +1,299 @@
+"""
+HTTP servers capable of handling many readers at once.
+"""
+from __future__ import print_function
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from bookserver.compat import HTTPServer, queue
+
+
+# The response sent to clients that arrive when every connection slot is
+# taken.
+BUSY_RESPONSE = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                 b'Content-Type: text/plain\r\n'
+                 b'Content-Length: 12\r\n'
+                 b'Retry-After: 1\r\n'
+                 b'Connection: close\r\n\r\n'
+                 b'Server busy\n')
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    An HTTP server that hands each connection to a fixed pool of worker
+    threads so one slow client can't hold up everyone else.
+
+    At most max_connections connections are accepted at any one time (both
+    those being served and those waiting for a free worker). Any more are
+    turned away with a 503 response rather than queueing without bound.
+
+    A handler may detach() its connection to keep it open once the handler
+    returns (e.g. to hand it to a bookserver.events.EventHub). Detached
+    connections no longer count against max_connections.
+    """
+
+    # Don't let slow or stalled clients queue up in the kernel either.
+    request_queue_size = 128
+
+    def __init__(self, address, handler, workers=8, max_connections=64,
+                 bind_and_activate=True):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        if max_connections < workers:
+            raise ValueError('max_connections must be at least workers')
+        HTTPServer.__init__(self, address, handler, bind_and_activate)
+        self.workers = workers
+        self.max_connections = max_connections
+        self._requests = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._threads = []
+        self._detached = set()
+
+    def start_workers(self):
+        """
+        Start the pool of worker threads. This happens when the first
+        connection arrives so that servers can be made before forking.
+        """
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name='worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """
+        Queue the connection for a worker, or refuse it if the server is
+        already at capacity.
+        """
+        if not self._threads:
+            self.start_workers()
+        if not self._slots.acquire(False):
+            self.refuse_request(request)
+            return
+        self._requests.put((request, client_address))
+
+    def is_busy(self):
+        """
+        Returns True if there are connections waiting for a free worker.
+        """
+        return not self._requests.empty()
+
+    def detach(self, request):
+        """
+        Leaves the connection open when its handler returns. Whoever called
+        this is then responsible for closing it.
+        """
+        self._detached.add(request)
+
+    def refuse_request(self, request):
+        """
+        Tell the client the server is too busy and close the connection.
+        """
+        try:
+            request.sendall(BUSY_RESPONSE)
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self):
+        """
+        The loop run by each worker thread.
+        """
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if request in self._detached:
+                    self._detached.discard(request)
+                else:
+                    self.shutdown_request(request)
+                self._slots.release()
+
+    def server_close(self):
+        """
+        Stop the workers once they've finished with their current request.
+        """
+        HTTPServer.server_close(self)
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join(1)
+        self._threads = []
+
+
+class PreforkSupervisor(object):
+    """
+    Runs several copies of a server in child processes so requests are
+    spread across every core rather than sharing one interpreter.
+
+    Where the platform supports SO_REUSEPORT each child binds its own
+    listening socket to the same address and the kernel balances new
+    connections between them. Otherwise the children accept from a single
+    socket opened by the supervisor.
+
+    Children that die are replaced. SIGTERM or SIGINT stops the children
+    (letting them finish their current requests) and then the supervisor.
+    """
+
+    # How long to wait for children to exit before killing them.
+    shutdown_timeout = 10
+    # Children that die sooner than this after starting are assumed to be
+    # crashing on startup, so wait a little before replacing them.
+    min_uptime = 1
+
+    def __init__(self, server_factory, processes):
+        """
+        The server_factory is called in each child to make an (unbound)
+        server, e.g. PooledHTTPServer(address, handler,
+        bind_and_activate=False).
+        """
+        if processes < 1:
+            raise ValueError('processes must be at least 1')
+        self.server_factory = server_factory
+        self.processes = processes
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        self.children = {}
+        self.running = False
+        probe = server_factory()
+        self.socket = socket.socket(probe.address_family, probe.socket_type)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(probe.server_address)
+        # The socket is held open (but, if SO_REUSEPORT is used, never
+        # listened on) so the port is reserved while children come and go.
+        self.server_address = self.socket.getsockname()
+        if not self.reuse_port:
+            self.socket.listen(probe.request_queue_size)
+        probe.socket.close()
+
+    def serve_forever(self, poll_interval=0.2):
+        """
+        Start the children and keep them running until told to stop.
+        """
+        self.running = True
+        previous = {}
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous[signum] = signal.signal(signum, self._stop)
+        try:
+            for i in range(self.processes):
+                self.spawn()
+            while self.running:
+                self.reap(restart=True)
+                time.sleep(poll_interval)
+        finally:
+            self.stop_children()
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            self.server_close()
+
+    def server_close(self):
+        """
+        Release the listening socket.
+        """
+        self.socket.close()
+
+    def _stop(self, signum, frame):
+        self.running = False
+
+    def spawn(self):
+        """
+        Fork a new child process running the server.
+        """
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return pid
+        status = 1
+        try:
+            status = self.run_child()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    def run_child(self):
+        """
+        Serve requests in a child process until told to stop.
+        """
+        def stop(signum, frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        if not self.running:
+            # The supervisor's handler caught a signal before ours was set.
+            return 0
+        httpd = self.server_factory()
+        if self.reuse_port:
+            httpd.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT,
+                                    1)
+            httpd.server_address = self.server_address
+            httpd.server_bind()
+            httpd.server_activate()
+            self.socket.close()
+        else:
+            httpd.socket.close()
+            httpd.socket = self.socket
+        try:
+            httpd.serve_forever()
+        except SystemExit:
+            pass
+        finally:
+            httpd.server_close()
+        return 0
+
+    def reap(self, restart=False):
+        """
+        Collect any children that have exited, replacing them if restart is
+        True.
+        """
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            if restart and self.running:
+                print('Worker %d exited (status %d), restarting' %
+                      (pid, status), file=sys.stderr)
+                if time.time() - started < self.min_uptime:
+                    time.sleep(self.min_uptime)
+                self.spawn()
+
+    def stop_children(self):
+        """
+        Ask every child to stop and wait for them, killing any that take
+        longer than shutdown_timeout.
+        """
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.pop(pid, None)
+        deadline = time.time() + self.shutdown_timeout
+        while self.children and time.time() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            self.children.pop(pid, None)
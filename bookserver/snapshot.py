@@ -0,0 +1,116 @@
+"""
+Keeping what the server builds from the book (the chapters rendered so far
+and, with --backend, the tagged objects and their indexes) in a file, so
+the next start can load it rather than build it all again.
+
+Snapshots are kept next to the book file (e.g.
+data/barefoot.json.server.snapshot) and are only used if their key
+matches: a hash of the content of the files they were built from, the
+options they were built with, SNAPSHOT_VERSION and the version of Python.
+Being based on content alone, the key is the same for a copy of the files.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+# Bump when anything held in a snapshot changes shape, so old snapshots are
+# rebuilt.
+SNAPSHOT_VERSION = 3
+
+
+def source_key(paths, *options):
+    """
+    Returns the key of a snapshot built from the files at paths (any that
+    don't exist count as empty) with the given options.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((SNAPSHOT_VERSION, sys.version_info[:2],
+                        options)).encode('utf-8'))
+    for path in paths:
+        digest.update(b'\0')
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+        except (IOError, OSError):
+            pass
+    return digest.hexdigest()
+
+
+def snapshot_path(path, name):
+    return '%s.%s.snapshot' % (path, name)
+
+
+def load_snapshot(path, name, key):
+    """
+    Returns the state in the named snapshot for the book file at path if it
+    has the given key, otherwise None.
+    """
+    try:
+        with open(snapshot_path(path, name), 'rb') as f:
+            # The key comes first so a stale snapshot isn't read any further.
+            if pickle.load(f) != key:
+                return None
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, IndexError, KeyError, TypeError,
+            ValueError):
+        return None
+
+
+def save_snapshot(path, name, key, state):
+    """
+    Saves state, with key, as the named snapshot for the book file at path.
+    The snapshot is replaced in one go so no one reads a partly written one.
+    Returns False if it can't be saved (e.g. the directory is read-only).
+    """
+    target = snapshot_path(path, name)
+    try:
+        handle, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(target)), suffix='.tmp')
+    except (IOError, OSError):
+        return False
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, target)
+    except (IOError, OSError):
+        return False
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return True
+
+
+class Timings(object):
+    """
+    Records how long each phase of starting up takes.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+    def report(self):
+        """
+        Returns a line describing the time taken, in milliseconds, overall
+        and by each phase.
+        """
+        return 'Ready in %.1f ms (%s)' % (
+            (time.time() - self.started) * 1000,
+            ', '.join('%s %.1f ms' % (name, seconds * 1000)
+                      for name, seconds in self.phases))
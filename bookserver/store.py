@@ -0,0 +1,295 @@
+"""
+An in-process stand-in for Fluidinfo's storage: objects, optionally with a
+unique about value, holding tag values.
+
+Queries are answered from the secondary indexes in bookserver.index. The
+planner in TagStore.evaluate() starts from whichever side of an "and" is
+expected to match fewest objects and only tests the other side against
+those, so e.g. finding a chapter's blocks takes time proportional to the
+number of blocks rather than the number of objects in the store.
+"""
+import threading
+import uuid
+
+from bookserver import query as fdbquery
+from bookserver.book import BLOCK_TAGS, NAMESPACE, block_tags
+from bookserver.compat import number_types, string_types
+from bookserver.heatmap import MISSING, Heatmap, is_comment_path
+from bookserver.index import TagIndex
+
+
+ABOUT_TAG = 'fluiddb/about'
+
+
+def is_primitive(value):
+    """
+    Returns True if value can be stored as a Fluidinfo "primitive" value:
+    null, a boolean, a number, a string or a set (list) of strings.
+    """
+    if value is None or isinstance(value, (bool,) + number_types +
+                                   string_types):
+        return True
+    if isinstance(value, list):
+        return all(isinstance(item, string_types) for item in value)
+    return False
+
+
+class TagStore(object):
+    """
+    Holds every object and its tags in memory. Safe to use from several
+    threads at once.
+
+    The namespace is the one the book's tags are in (see load_book()). The
+    heatmap attribute keeps count of the comments on the book's blocks.
+    Each of the listeners is called, as heatmap.tag_changed() is, whenever
+    a tag changes (with the lock held).
+    """
+
+    def __init__(self, namespace=NAMESPACE):
+        self.namespace = namespace
+        self._objects = {}
+        self._abouts = {}
+        self.index = TagIndex()
+        self.heatmap = Heatmap(ABOUT_TAG, namespace)
+        self.listeners = []
+        self.lock = threading.RLock()
+
+    def object_id(self, about, create=False):
+        """
+        Returns the id of the object with the given about value. If there
+        isn't one it's created when create is True, otherwise None is
+        returned.
+        """
+        with self.lock:
+            object_id = self._abouts.get(about)
+            if object_id is None and create:
+                object_id = self.create(about)
+            return object_id
+
+    def create(self, about=None):
+        """
+        Creates a new object and returns its id.
+        """
+        with self.lock:
+            if about is not None and about in self._abouts:
+                return self._abouts[about]
+            object_id = str(uuid.uuid4())
+            self._objects[object_id] = {}
+            if about is not None:
+                self._objects[object_id][ABOUT_TAG] = about
+                self._abouts[about] = object_id
+                self.index.add(object_id, ABOUT_TAG, about)
+            return object_id
+
+    def exists(self, object_id):
+        return object_id in self._objects
+
+    def tag_paths(self, object_id):
+        """
+        Returns the paths of the tags on an object. Raises KeyError if the
+        object doesn't exist.
+        """
+        with self.lock:
+            return sorted(self._objects[object_id])
+
+    def get(self, object_id, path):
+        """
+        Returns the value of a tag on an object. Raises KeyError if the
+        object or the tag doesn't exist.
+        """
+        with self.lock:
+            return self._objects[object_id][path]
+
+    def get_many(self, object_id, paths):
+        """
+        Returns a dictionary of the values of those paths that are present
+        on the object. A path of "*" selects every tag.
+        """
+        with self.lock:
+            tags = self._objects[object_id]
+            if '*' in paths:
+                return dict(tags)
+            return dict((path, tags[path]) for path in paths
+                        if path in tags)
+
+    def set(self, object_id, path, value):
+        """
+        Sets the value of a tag on an object. Raises KeyError if the object
+        doesn't exist and ValueError if the value or tag isn't allowed.
+        """
+        if path == ABOUT_TAG:
+            raise ValueError('The about tag can not be changed')
+        if not is_primitive(value):
+            raise ValueError('Not a primitive value: %r' % (value,))
+        with self.lock:
+            tags = self._objects[object_id]
+            old = tags.get(path, MISSING)
+            if old is not MISSING:
+                self.index.remove(object_id, path, old)
+            tags[path] = value
+            self.index.add(object_id, path, value)
+            self.heatmap.tag_changed(tags, path, old, value)
+            for listener in self.listeners:
+                listener(tags, path, old, value)
+
+    def delete(self, object_id, path):
+        """
+        Removes a tag from an object. Returns False if it wasn't there.
+        """
+        if path == ABOUT_TAG:
+            raise ValueError('The about tag can not be removed')
+        with self.lock:
+            tags = self._objects.get(object_id, {})
+            if path not in tags:
+                return False
+            old = tags.pop(path)
+            self.index.remove(object_id, path, old)
+            self.heatmap.tag_changed(tags, path, old, MISSING)
+            for listener in self.listeners:
+                listener(tags, path, old, MISSING)
+            return True
+
+    def remove(self, about):
+        """
+        Removes the object with the given about value, and every tag on it.
+        Returns False if there isn't one.
+        """
+        with self.lock:
+            object_id = self._abouts.get(about)
+            if object_id is None:
+                return False
+            for path in self.tag_paths(object_id):
+                if path != ABOUT_TAG:
+                    self.delete(object_id, path)
+            self.index.remove(object_id, ABOUT_TAG, about)
+            del self._abouts[about]
+            del self._objects[object_id]
+            return True
+
+    def query(self, query):
+        """
+        Returns the set of ids of the objects matching query (a string in
+        the Fluidinfo query language, or a tree from fdbquery.parse()).
+        Raises fdbquery.QueryError if the query is invalid.
+        """
+        if isinstance(query, tuple):
+            tree = query
+        else:
+            tree = fdbquery.parse(query)
+        with self.lock:
+            return self.evaluate(tree)
+
+    def evaluate(self, tree):
+        """
+        Returns the set of ids of the objects matching a parsed query.
+        """
+        kind = tree[0]
+        if kind == 'and':
+            first, second = sorted(tree[1:], key=self.estimate)
+            return self.filter(second, self.evaluate(first))
+        if kind == 'or':
+            return self.evaluate(tree[1]) | self.evaluate(tree[2])
+        if kind == 'except':
+            matches = self.evaluate(tree[1])
+            return matches - self.filter(tree[2], matches)
+        matches = self.index.lookup(tree)
+        if matches is None:
+            matches = self.filter(tree, self.index.has(
+                fdbquery.node_path(tree)))
+        return matches
+
+    def filter(self, tree, ids):
+        """
+        Returns the subset of ids that match a parsed query. Leaf nodes are
+        tested against each object unless the index would find fewer
+        objects.
+        """
+        kind = tree[0]
+        if not ids:
+            return set()
+        if kind == 'and':
+            first, second = sorted(tree[1:], key=self.estimate)
+            return self.filter(second, self.filter(first, ids))
+        if kind == 'or':
+            matches = self.filter(tree[1], ids)
+            return matches | self.filter(tree[2], ids - matches)
+        if kind == 'except':
+            matches = self.filter(tree[1], ids)
+            return matches - self.filter(tree[2], matches)
+        if kind != 'matches' and self.index.estimate(tree) < len(ids):
+            return self.index.lookup(tree) & ids
+        path = fdbquery.node_path(tree)
+        return set(object_id for object_id in ids
+                   if path in self._objects[object_id] and
+                   fdbquery.test(tree, self._objects[object_id][path]))
+
+    def estimate(self, tree):
+        """
+        Returns an upper bound on the number of objects matching a parsed
+        query, worked out from the sizes of the indexes.
+        """
+        kind = tree[0]
+        if kind == 'and':
+            return min(self.estimate(tree[1]), self.estimate(tree[2]))
+        if kind == 'or':
+            return self.estimate(tree[1]) + self.estimate(tree[2])
+        if kind == 'except':
+            return self.estimate(tree[1])
+        return self.index.estimate(tree)
+
+    def participant_counts(self, object_ids):
+        """
+        Returns a dictionary mapping the about value of each object (that
+        has one) to the number of users who have commented on it.
+        """
+        counts = {}
+        with self.lock:
+            for object_id in object_ids:
+                tags = self._objects.get(object_id, {})
+                if ABOUT_TAG in tags:
+                    counts[tags[ABOUT_TAG]] = sum(
+                        1 for path in tags if is_comment_path(path))
+        return counts
+
+    def chapter_heatmap(self, chapter):
+        """
+        Returns a dictionary mapping the about value of each block in the
+        chapter (identified by its about value) to a tuple of the number of
+        users who have commented on it and the number of comments.
+        """
+        with self.lock:
+            return self.heatmap.chapter(chapter)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        del state['listeners']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.listeners = []
+        self.lock = threading.RLock()
+
+    def load_book(self, chapters):
+        """
+        Tags an object for every block in the book (as returned by
+        bookserver.book.load_book) just as the book is tagged in Fluidinfo.
+        Blocks already in the store lose any of the book's tags they no
+        longer have (e.g. references that have been taken out).
+        """
+        with self.lock:
+            for chapter in chapters:
+                for block in chapter['blocks']:
+                    object_id = self.object_id(block['about'], create=True)
+                    tags = block_tags(block, self.namespace)
+                    for path, value in tags.items():
+                        if path != ABOUT_TAG:
+                            self.set(object_id, path, value)
+                    for name in BLOCK_TAGS:
+                        path = self.namespace + '/' + name
+                        if path not in tags:
+                            self.delete(object_id, path)
+
+    def __len__(self):
+        return len(self._objects)
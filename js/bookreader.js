@@ -22,6 +22,25 @@ var bookreader = function() {
     // Used to hold the list of comments on the block object that has focus
     var myComments = [];
 
+    // The number of comments fetched at a time from the local backend
+    var commentPageSize = 20;
+
+    // The cursor for the next page of comments in the annotations modal, or
+    // null if there are no more (local backend only)
+    var nextCommentsCursor = null;
+
+    // Set while a page of comments is being fetched
+    var fetchingComments = false;
+
+    // The comments already fetched from the local backend for each block,
+    // by about value. Each is an object with the comments (by id), the
+    // cursor for the next page and the watermark to ask for changes since.
+    var commentCache = {};
+
+    // The stream of changes to the comments on the chapter being read, from
+    // the local backend
+    var chapterEvents = null;
+
     // Used to match tag paths
     var commentMatcher = new RegExp("^\\w+\\/"+commentTag+"$");
 
@@ -130,16 +149,29 @@ var bookreader = function() {
     var previousLink = $("#previousLink");
     var nextLink = $("#nextLink");
 
+    /*
+    Returns the options for a new Fluidinfo session. If the page was served
+    along with a local Fluidinfo backend (see scripts/runserver.py) then
+    backend.js will have said where to find it.
+    */
+    var sessionOptions = function(options) {
+        if(typeof(localFluidinfo) === "string") {
+            options.instance = document.location.protocol + "//" +
+                document.location.host + localFluidinfo;
+        }
+        return options;
+    };
+
     // The session to be used to connect to Fluidinfo (defaults to anonymous).
-    var session = fluidinfo({});
+    var session = fluidinfo(sessionOptions({}));
     // Check for local storage of prior session.
     var username = $.jStorage.get("u", false);
     var password = $.jStorage.get("p", false);
     if(username && password) {
-        session = fluidinfo({
+        session = fluidinfo(sessionOptions({
             username: username,
             password: password
-        });
+        }));
         loginInfo.hide();
         $("#username").html(escape(username));
         userInfo.fadeIn();
@@ -176,7 +208,7 @@ var bookreader = function() {
             loginFormError.hide();
         };
         var onError = function(result){
-            session = fluidinfo({});
+            session = fluidinfo(sessionOptions({}));
             submitLoginForm.button("reset");
             submitLoginForm.button("toggle");
             fluidinfoUsername = undefined;
@@ -188,10 +220,10 @@ var bookreader = function() {
             loginFormError.html("<p><strong>Try again!</strong> The username and password you supplied don't work.</p>");
             loginFormError.show();
         };
-        session = fluidinfo({
+        session = fluidinfo(sessionOptions({
             username: username,
             password: password
-        });
+        }));
         session.api.get({
             path: ["users", username],
             onSuccess: onSuccess,
@@ -204,7 +236,7 @@ var bookreader = function() {
     Logs the user out.
     */
     var logout = function() {
-        session = fluidinfo({});
+        session = fluidinfo(sessionOptions({}));
         $.jStorage.flush();
         userInfo.hide();
         loginInfo.fadeIn();
@@ -305,6 +337,26 @@ var bookreader = function() {
         }
     };
 
+    /*
+    Returns the id of the element showing the participant count for the block
+    identified by the passed in about value.
+    */
+    var countId = function(about) {
+        return "count-" + about.replace(/[^\w-]/g, "-");
+    };
+
+    /*
+    Shows the number of participants commenting on the block identified by the
+    passed in about value.
+    */
+    var showParticipantCount = function(about, counter) {
+        if(counter>0) {
+            $("#"+countId(about)).html(counter).fadeIn("fast");
+        } else {
+            $("#"+countId(about)).html("");
+        }
+    };
+
     /*
     Updates the participant counter for the object identified by the passed in
     about value.
@@ -324,16 +376,128 @@ var bookreader = function() {
                     }
                 }
                 // update UI
-                if(counter>0) {
-                    $("#"+result.data["id"]).html(counter).fadeIn("fast");
-                } else {
-                    $("#"+result.data["id"]).html("");
-                }
+                showParticipantCount(about, counter);
             }
         };
         session.api.get(participantOptions);
     }
 
+    /*
+    Updates the participant counters for every block in the chapter identified
+    by the passed in about value. The local backend (see scripts/runserver.py)
+    counts them all in one request, otherwise each block is asked for in turn.
+    */
+    var countChapterComments = function(chapterName, abouts) {
+        var eachBlock = function() {
+            var i;
+            for(i=0; i<abouts.length; i++) {
+                countParticipantComments(abouts[i]);
+            }
+        };
+        if(typeof(localFluidinfo) !== "string") {
+            eachBlock();
+            return;
+        }
+        $.ajax({
+            url: localFluidinfo + "counts",
+            data: {chapter: chapterName},
+            dataType: "json",
+            cache: false,
+            success: function(data) {
+                var i;
+                for(i=0; i<abouts.length; i++) {
+                    showParticipantCount(abouts[i], data.counts[abouts[i]] || 0);
+                }
+            },
+            error: eachBlock
+        });
+    };
+
+    /*
+    Listens for changes to the comments on the chapter identified by the
+    passed in about value, as they're pushed by the local backend (see
+    scripts/runserver.py), instead of the chapter it was listening to.
+    Participant counts and the open annotations modal are updated in place.
+    */
+    var listenToChapter = function(chapterName) {
+        if(typeof(localFluidinfo) !== "string" ||
+                typeof(EventSource) === "undefined") {
+            return;
+        }
+        if(chapterEvents) {
+            chapterEvents.close();
+        }
+        chapterEvents = new EventSource(localFluidinfo + "events?chapter=" +
+            encodeURIComponent(chapterName));
+        chapterEvents.addEventListener("count", function(e) {
+            var data = JSON.parse(e.data);
+            showParticipantCount(data.about, data.participants);
+        });
+        chapterEvents.addEventListener("comment", function(e) {
+            showPushedComment(JSON.parse(e.data));
+        });
+    };
+
+    /*
+    Attaches events and popovers to the passed in rendered block of text
+    identified by the passed in about value.
+    */
+    var initBlock = function(renderedBlock, about, references) {
+        // Tag image fadeTo
+        renderedBlock.find("img").hover(function(){
+            $(this).fadeTo('fast', 1.0);
+        },
+        function(){
+            $(this).fadeTo('fast', 0.6);
+        });
+        // Click event handler for tagging
+        var tagLink = renderedBlock.find(".tagLink");
+        tagLink.attr("target", about);
+        tagLink.click(showAnnotations);
+        // Popovers for references
+        if(references !== undefined) {
+            var j;
+            for(j=0; j<references.length; j++) {
+                popupInit(references[j], renderedBlock);
+            }
+        }
+    };
+
+    /*
+    Shows the chapter (already in the DOM) with the passed in name along with
+    its participant counts and navigation buttons.
+    */
+    var displayChapter = function(chapterHash, abouts) {
+        // Listen first, so no change made while counting is missed.
+        listenToChapter("barefootintocyberspace:" + chapterHash);
+        countChapterComments("barefootintocyberspace:" + chapterHash, abouts);
+        // ensure the chapter is visible (it already is if the server sent
+        // the page with it in place)
+        if(!chapter.is(":visible")) {
+            contentBlocks.hide();
+            chapter.fadeIn("fast");
+        }
+        // show the nav buttons
+        showNavButtons(chapterHash);
+        $("#bottomNav").fadeIn("fast");
+    };
+
+    /*
+    Attaches events to the rendered markup of the chapter with the passed in
+    name (as served by scripts/runserver.py) and shows it.
+    */
+    var hydrateChapter = function(chapterHash) {
+        var abouts = [];
+        chapter.find(".tagLink").each(function() {
+            var tagLink = $(this);
+            var about = tagLink.attr("target");
+            var renderedBlock = tagLink.parent().prev().add(tagLink.parent());
+            initBlock(renderedBlock, about, tagLink.data("references"));
+            abouts.push(about);
+        });
+        displayChapter(chapterHash, abouts);
+    };
+
     /*
     Given a click event, will get and display the selected chapter.
     */
@@ -343,52 +507,38 @@ var bookreader = function() {
         showWorking();
         var chapterHash = e.target.hash.replace("#", "");
         var chapterName = "barefootintocyberspace:" + chapterHash;
-        var onSuccess = function(result) {
-            // order the results
-            var orderedBlocks = result.data.sort(function(a, b){
-                return a["beckyhogge/position"] - b["beckyhogge/position"];
-            });
+        if(e.preventDefault) {
+            // Pages showing a chapter (at read/<chapter>) have a base URL, so
+            // following the link would leave the page.
+            e.preventDefault();
+            document.location.hash = "#" + chapterHash;
+        }
+        var showRenderedChapter = function(markup) {
+            // add the whole chapter to the DOM in one go
+            chapter.html(markup);
+            hydrateChapter(chapterHash);
+        };
+        var showChapter = function(orderedBlocks) {
             // add them to the DOM
             chapter.empty();
             var i;
+            var abouts = [];
             var template = '<div style="margin-bottom: 18px;" class="span11 offset2 textBlock">{{{block}}}</div><div class="span3"><a href="annotate" class="tagLink"><img src="images/tags.png" alt="tag" style="opacity: 0.6; filter: alpha(opacity=0.6); vertical-align: middle"/></a><span style="margin-bottom: 4px; color: #999;" id="{{id}}" class="participantCount"><small style="color: #999;">&nbsp;</small></span></div>';
             for(i=0; i<orderedBlocks.length; i++){
                 block = orderedBlocks[i];
-                var id = block["id"];
+                var id = countId(block["fluiddb/about"]);
                 var renderedBlock = $(Mustache.to_html(template, {block: block["beckyhogge/html"], id: id}));
                 chapter.append(renderedBlock);
-
-                /**
-                Attach events and popovers
-                **/
-
-                // Tag image fadeTo
-                renderedBlock.find("img").hover(function(){
-                    $(this).fadeTo('fast', 1.0);
-                },
-                function(){
-                    $(this).fadeTo('fast', 0.6);
-                });
-                // Click event handler for tagging
-                var tagLink = renderedBlock.find(".tagLink");
-                tagLink.attr("target", block["fluiddb/about"]);
-                tagLink.click(showAnnotations);
-                // Popovers for references
-                var references = block["beckyhogge/references"];
-                if(references !== undefined) {
-                    var j;
-                    for(j=0; j<references.length; j++) {
-                        popupInit(references[j], renderedBlock);
-                    }
-                }
-                countParticipantComments(block["fluiddb/about"]);
+                initBlock(renderedBlock, block["fluiddb/about"], block["beckyhogge/references"]);
+                abouts.push(block["fluiddb/about"]);
             }
-            // ensure the chapter is visible
-            contentBlocks.hide();
-            chapter.fadeIn("fast");
-            // show the nav buttons
-            showNavButtons(chapterHash);
-            $("#bottomNav").fadeIn("fast");
+            displayChapter(chapterHash, abouts);
+        };
+        var onSuccess = function(result) {
+            // order the results
+            showChapter(result.data.sort(function(a, b){
+                return a["beckyhogge/position"] - b["beckyhogge/position"];
+            }));
         };
         var options = {
             select: ["beckyhogge/html", "beckyhogge/position", "beckyhogge/references", "fluiddb/about"],
@@ -396,7 +546,16 @@ var bookreader = function() {
             onSuccess: onSuccess,
             onError: onError
         };
-        session.query(options);
+        // scripts/runserver.py serves each chapter already rendered. If
+        // it's not there, ask Fluidinfo.
+        $.ajax({
+            url: "chapters/" + chapterHash + ".html",
+            dataType: "html",
+            success: showRenderedChapter,
+            error: function() {
+                session.query(options);
+            }
+        });
     };
 
     /*
@@ -628,6 +787,10 @@ var bookreader = function() {
         deleteAnchor.click(function(e){
             deleteAnchor.attr("disabled", "disabled");
             revisedCommentList = $.grep(myComments, function(val){
+                if(annotation.commentId !== undefined) {
+                    // Several comments can share a timestamp.
+                    return val.commentId !== annotation.commentId;
+                }
                 return val.timestamp.valueOf() != annotation.timestamp.valueOf();
             });
             var cleanUpDelete = function() {
@@ -641,7 +804,26 @@ var bookreader = function() {
                     });
                 }
             }
-            if(revisedCommentList.length > 0){
+            if(typeof(localFluidinfo) === "string") {
+                // The local backend only needs to know which comment.
+                session.api.del({
+                    path: ["comments", annotation.about],
+                    args: {id: annotation.commentId},
+                    onSuccess: function(result){
+                        myComments = revisedCommentList;
+                        if(commentCache[annotation.about]) {
+                            delete commentCache[annotation.about].comments[
+                                annotation.commentId];
+                        }
+                        cleanUpDelete();
+                        countParticipantComments(annotation.about);
+                    },
+                    onError: function(result){
+                        deleteAnchor.removeAttr("disabled");
+                        onAnnotateError(result);
+                    }
+                });
+            } else if(revisedCommentList.length > 0){
                 var options = {
                     commentList: revisedCommentList,
                     author: annotation.author,
@@ -711,6 +893,176 @@ var bookreader = function() {
         }
     };
 
+    /*
+    Returns an annotation object for a comment on the block identified by the
+    passed in about value, as returned by the local backend.
+    */
+    var commentAnnotation = function(comment, about) {
+        return {
+            commentId: comment.id,
+            author: comment.author,
+            timestamp: new Date(comment.timestamp),
+            val: comment.text,
+            about: about
+        };
+    };
+
+    /*
+    Shows the passed in annotations in the annotations modal, after any that
+    are already there.
+    */
+    var appendAnnotations = function(annotationList) {
+        var i;
+        for(i=0; i<annotationList.length; i++){
+            if(annotationList[i].author === session.username) {
+                myComments.push(annotationList[i]);
+            }
+            commentTagValues.append(createAnnotation(annotationList[i]));
+        }
+        if(commentTagValues[0].childElementCount > 0) {
+            commentTagValues.fadeIn("fast");
+        } else if(session.username){
+            nothingTaggedLoggedIn.fadeIn("fast");
+        } else {
+            nothingTaggedAnonymous.fadeIn("fast");
+        }
+    };
+
+    /*
+    Fetches the page of comments on the block identified by the passed in
+    about value that follows the passed in cursor (or the first page, newest
+    first) from the local backend (see scripts/runserver.py), remembers them
+    and adds them to the annotations modal.
+    */
+    var showCommentPage = function(about, cursor) {
+        var args = {limit: commentPageSize};
+        if(cursor) {
+            args.cursor = cursor;
+        }
+        fetchingComments = true;
+        session.api.get({
+            path: ["comments", about],
+            args: args,
+            onSuccess: function(result){
+                fetchingComments = false;
+                var cached = commentCache[about];
+                if(!cursor) {
+                    cached.watermark = result.data.watermark;
+                }
+                cached.cursor = result.data.cursor;
+                var newComments = [];
+                var i;
+                for(i=0; i<result.data.comments.length; i++){
+                    var annotation = commentAnnotation(
+                        result.data.comments[i], about);
+                    if(cached.comments[annotation.commentId] === undefined) {
+                        cached.comments[annotation.commentId] = annotation;
+                        newComments.push(annotation);
+                    }
+                }
+                if($("#parentObject").attr("value") !== about) {
+                    // The modal has since been opened for another block.
+                    return;
+                }
+                nextCommentsCursor = cached.cursor;
+                fetchingCommentTags.hide();
+                appendAnnotations(newComments);
+            },
+            onError: function(result){
+                fetchingComments = false;
+                onAnnotateError(result);
+            }
+        });
+    };
+
+    /*
+    Fetches the changes to the comments on the block identified by the passed
+    in about value since they were last fetched from the local backend,
+    merges them into those remembered and shows the result in the
+    annotations modal.
+    */
+    var syncComments = function(about) {
+        var cached = commentCache[about];
+        session.api.get({
+            path: ["comments", about],
+            args: {since: cached.watermark},
+            onSuccess: function(result){
+                var i;
+                for(i=0; i<result.data.deleted.length; i++){
+                    delete cached.comments[result.data.deleted[i]];
+                }
+                for(i=0; i<result.data.added.length; i++){
+                    var annotation = commentAnnotation(result.data.added[i],
+                        about);
+                    cached.comments[annotation.commentId] = annotation;
+                }
+                cached.watermark = result.data.watermark;
+                if($("#parentObject").attr("value") !== about) {
+                    return;
+                }
+                var annotationList = [];
+                var commentId;
+                for(commentId in cached.comments){
+                    annotationList.push(cached.comments[commentId]);
+                }
+                annotationList.sort(function(a, b){
+                    return (b.timestamp.valueOf() - a.timestamp.valueOf()) ||
+                        (b.commentId - a.commentId);
+                });
+                nextCommentsCursor = cached.cursor;
+                fetchingCommentTags.hide();
+                appendAnnotations(annotationList);
+            },
+            onError: onAnnotateError
+        });
+    };
+
+    /*
+    Adds a comment pushed by the local backend to those remembered for its
+    block and, if the annotations modal is showing that block, to the top of
+    the modal.
+    */
+    var showPushedComment = function(comment) {
+        if(comment.author === session.username) {
+            // Already shown by addAnnotation.
+            return;
+        }
+        var cached = commentCache[comment.about];
+        // (A first page still on its way will include the comment.)
+        if(cached && cached.watermark !== null) {
+            if(cached.comments[comment.id] !== undefined) {
+                return;
+            }
+            cached.comments[comment.id] = commentAnnotation(comment,
+                comment.about);
+        }
+        if(!annotations.is(":visible") ||
+                $("#parentObject").attr("value") !== comment.about ||
+                fetchingCommentTags.is(":visible")) {
+            return;
+        }
+        var newAnnotation = createAnnotation(commentAnnotation(comment,
+            comment.about));
+        commentTagValues.prepend(newAnnotation);
+        newAnnotation.fadeIn("fast");
+        commentTagValues.show();
+        nothingTaggedLoggedIn.hide();
+        nothingTaggedAnonymous.hide();
+    };
+
+    /*
+    Fetches the next page of comments when the comments in the annotations
+    modal are scrolled to (nearly) the bottom.
+    */
+    var scrollComments = function(){
+        var list = commentTagValues[0];
+        if(nextCommentsCursor && !fetchingComments &&
+                list.scrollTop + list.clientHeight >= list.scrollHeight - 50) {
+            showCommentPage($("#parentObject").attr("value"),
+                nextCommentsCursor);
+        }
+    };
+
     /*
     Handles the annotation of a block.
     */
@@ -727,6 +1079,25 @@ var bookreader = function() {
         var aboutBlock = e.currentTarget.target;
         $("#parentObject").attr("value", aboutBlock);
         annotations.modal("show");
+        if(typeof(localFluidinfo) === "string") {
+            // The local backend hands out the comments a page at a time, so
+            // the first can be shown straight away, and after that only what
+            // has changed.
+            myComments = [];
+            nextCommentsCursor = null;
+            var cached = commentCache[aboutBlock];
+            if(cached && cached.watermark !== null) {
+                syncComments(aboutBlock);
+            } else {
+                commentCache[aboutBlock] = {
+                    comments: {},
+                    cursor: null,
+                    watermark: null
+                };
+                showCommentPage(aboutBlock, null);
+            }
+            return false;
+        }
         var onSuccess = function(result){
             var commentTags = ['fluiddb/about'];
             var i;
@@ -798,23 +1169,45 @@ var bookreader = function() {
             val: commentValue,
             about: parentBlockValue
         };
+        var showNewComment = function(result){
+            // add to the list of annotations
+            var newAnnotation = createAnnotation(newCommentObject);
+            commentTagValues.prepend(newAnnotation);
+            newAnnotation.fadeIn("fast");
+            // Update the UI to a new good state.
+            commentTagValues.show();
+            nothingTaggedLoggedIn.hide();
+            resetAnnotationForm();
+            newCommentForm.hide();
+            annotateButton.show();
+        };
+        if(typeof(localFluidinfo) === "string") {
+            // The local backend adds the comment to the user's others, so
+            // they don't all have to be sent again.
+            session.api.post({
+                path: ["comments", parentBlockValue],
+                data: {text: commentValue},
+                onSuccess: function(result){
+                    newCommentObject.timestamp = new Date(result.data.timestamp);
+                    newCommentObject.commentId = result.data.id;
+                    myComments.push(newCommentObject);
+                    if(commentCache[parentBlockValue]) {
+                        commentCache[parentBlockValue].comments[
+                            result.data.id] = newCommentObject;
+                    }
+                    showNewComment(result);
+                    countParticipantComments(parentBlockValue);
+                },
+                onError: onAnnotateError
+            });
+            return false;
+        }
         myComments.push(newCommentObject);
         var options = {
             commentList: myComments,
             author: session.username,
             about: parentBlockValue,
-            onSuccess: function(result){
-                // add to the list of annotations
-                var newAnnotation = createAnnotation(newCommentObject);
-                commentTagValues.prepend(newAnnotation);
-                newAnnotation.fadeIn("fast");
-                // Update the UI to a new good state.
-                commentTagValues.show();
-                nothingTaggedLoggedIn.hide();
-                resetAnnotationForm();
-                newCommentForm.hide();
-                annotateButton.show();
-            },
+            onSuccess: showNewComment,
             onError: onAnnotateError
         }
         saveComments(options);
@@ -866,6 +1259,7 @@ var bookreader = function() {
             annotateButton.fadeIn(50);
         });
         newCommentForm.unbind("submit").submit(addAnnotation);
+        commentTagValues.scroll(scrollComments);
         examplePopover.popover({
             placement: "below",
             html: true,
@@ -890,15 +1284,24 @@ var bookreader = function() {
         });
 
         var hash = document.location.hash;
-        if(hash) {
+        // Pages at read/<chapter> arrive with the chapter already rendered.
+        var renderedChapter = chapter.attr("data-chapter");
+        var hashName = hash.replace("#", "");
+        // A hash naming the chapter that's already there needn't fetch it.
+        if(hash && hashName !== renderedChapter) {
             var i;
-            var hashName = hash.replace("#", "");
             for(i=0; i<chapterList.length; i++){
                 if(hashName === chapterList[i]){
                     getChapter({target: {hash: hash}});
                     return;
                 }
             }
+        }
+        if(renderedChapter) {
+            hydrateChapter(renderedChapter);
+            return;
+        }
+        if(hash) {
             switch(hash){
                 case "#about":
                     showAbout();
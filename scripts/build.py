@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+Builds the application as a static site that can be served by any web server
+or CDN (annotations are still stored in Fluidinfo).
+
+Usage: ./scripts/build.py [output directory]
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from bookserver.build import SiteBuilder
+
+
+parser = argparse.ArgumentParser(description='Build the bookreader as a '
+                                             'static site.')
+parser.add_argument('output', nargs='?', default='build',
+                    help='the directory to build into (default "build")')
+args = parser.parse_args()
+
+manifest = SiteBuilder(ROOT, args.output).build()
+print('Built the site in %s (%d fingerprinted assets)' % (args.output,
+                                                          len(manifest)))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Converts a book file between JSON and the compact binary form (see
+bookserver/binary.py). The direction is decided by the source's content.
+
+Usage: ./scripts/convert.py source target [--compress]
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from bookserver.binary import MAGIC, dump_book, load_binary_book
+from bookserver.book import load_book
+from bookserver.compat import text_type
+
+
+parser = argparse.ArgumentParser(description='Convert a book file between '
+                                             'JSON and the binary form.')
+parser.add_argument('source', help='the book file to read')
+parser.add_argument('target', help='the book file to write')
+parser.add_argument('--compress', action='store_true',
+                    help='compress each chapter\'s HTML (binary form only)')
+args = parser.parse_args()
+
+with open(args.source, 'rb') as f:
+    binary = f.read(len(MAGIC)) == MAGIC
+if binary:
+    chapters = load_binary_book(args.source)
+    with io.open(args.target, 'w', encoding='utf-8') as f:
+        f.write(text_type(json.dumps(chapters, indent=2, sort_keys=True,
+                                     ensure_ascii=False)))
+else:
+    dump_book(load_book(args.source), args.target, args.compress)
+print('Wrote %s (%d bytes, from %d)' % (args.target,
+                                        os.path.getsize(args.target),
+                                        os.path.getsize(args.source)))
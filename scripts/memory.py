@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Compares the memory used by holding many copies of the book as lists of
+dictionaries (as returned by bookserver.book.load_book) with holding them
+in a bookserver.blocks.BlockStore. Each measurement is made in a fresh
+process, and reports the memory still held once the books are loaded and
+everything made along the way has been freed: as counted by tracemalloc,
+or (where that isn't available, e.g. Python 2) the growth in the process's
+resident set size after a garbage collection, which also includes memory
+the allocator has kept hold of. The size of the books' HTML is shown for
+comparison.
+
+Usage: ./scripts/memory.py [--books N]
+"""
+from __future__ import print_function
+import argparse
+import gc
+import os
+import subprocess
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from bookserver.blocks import BlockStore
+from bookserver.book import load_book
+
+
+REPRESENTATIONS = ('dicts', 'blocks')
+
+
+def rss():
+    """
+    Returns the resident set size of this process, in kilobytes.
+    """
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def copy_of_book(number):
+    """
+    Returns a copy of the book whose about values are its own, as another
+    book's would be.
+    """
+    prefix = 'barefootintocyberspace'
+    chapters = load_book()
+    for chapter in chapters:
+        chapter['about'] = chapter['about'].replace(prefix, prefix + number)
+        for block in chapter['blocks']:
+            block['about'] = block['about'].replace(prefix, prefix + number)
+            block['parent'] = block['parent'].replace(prefix, prefix + number)
+    return chapters
+
+
+def retained():
+    """
+    Returns the number of kilobytes this process is holding: those Python
+    has allocated if they're being traced, otherwise the resident set size.
+    """
+    gc.collect()
+    if tracemalloc is not None:
+        return tracemalloc.get_traced_memory()[0] // 1024
+    return rss()
+
+
+def html_size(chapters):
+    """
+    Returns the number of bytes of HTML (encoded as UTF-8) in a book.
+    """
+    return sum(len(block['html'].encode('utf-8')) for chapter in chapters
+               for block in chapter['blocks'])
+
+
+def measure(representation, books):
+    """
+    Loads the books in the representation and prints how many kilobytes
+    they take up once everything else made while loading them is freed.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    before = retained()
+    if representation == 'dicts':
+        held = [copy_of_book(str(number)) for number in range(books)]
+    else:
+        held = BlockStore()
+        for number in range(books):
+            held.add_book(copy_of_book(str(number)))
+    print(retained() - before)
+    return held
+
+
+parser = argparse.ArgumentParser(description='Compare the memory used by '
+                                             'the representations of books.')
+parser.add_argument('--books', type=int, default=50,
+                    help='number of copies of the book to load (default 50)')
+parser.add_argument('--representation', choices=REPRESENTATIONS,
+                    help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+if args.representation:
+    measure(args.representation, args.books)
+    sys.exit()
+
+chapters = load_book()
+html = html_size(chapters) * args.books // 1024
+print('%d books of %d blocks, measured %s' % (
+    args.books, sum(len(chapter['blocks']) for chapter in chapters),
+    'with tracemalloc' if tracemalloc else 'by resident set size'))
+print('%-8s %8d KB  (%d KB a book)' % ('html', html, html // args.books))
+for representation in REPRESENTATIONS:
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--books',
+        str(args.books), '--representation', representation])
+    kilobytes = int(output)
+    print('%-8s %8d KB  (%d KB a book)' % (representation, kilobytes,
+                                           kilobytes // args.books))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Imports comments packed into Fluidinfo comment tags into an annotation
+database (see bookserver/annotations.py).
+
+The sources are responses from Fluidinfo's /values endpoint, with the
+objects' about values and the comment tags to import, e.g. saved from:
+
+    /values?query=has beckyhogge/parent&tag=fluiddb/about&tag=ntoll/comment
+
+Usage: ./scripts/migrate.py database source [source ...]
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from bookserver.annotations import AnnotationStore, import_values
+
+
+parser = argparse.ArgumentParser(description='Import packed comments into '
+                                             'an annotation database.')
+parser.add_argument('database', help='the SQLite database to import into')
+parser.add_argument('sources', nargs='+',
+                    help='files holding responses from /values')
+args = parser.parse_args()
+
+annotations = AnnotationStore(args.database)
+for source in args.sources:
+    with io.open(source, encoding='utf-8') as f:
+        count = import_values(annotations, json.load(f))
+    print('Imported %d comments from %s' % (count, source))
+print('%s holds %d comments' % (args.database, len(annotations)))
+annotations.close()
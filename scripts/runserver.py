@@ -1,19 +1,196 @@
 #!/usr/bin/env python
 """
 A very simple HTTP server.
+
+Usage: ./scripts/runserver.py [port] [--workers N] [--max-connections N]
+                              [--processes N] [--cache-size MB]
+                              [--keep-alive SECONDS] [--max-books N]
+                              [--reload] [--no-snapshot] [--backend]
+                              [--annotations PATH]
 """
+from __future__ import print_function
+import argparse
+import io
+import os
 import sys
-from BaseHTTPServer import HTTPServer
-from SimpleHTTPServer import SimpleHTTPRequestHandler
 
-if sys.argv[1:]:
-    port = int(sys.argv[1])
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from bookserver.annotations import AnnotationStore
+from bookserver.api import FluidinfoAPI
+from bookserver.assets import AssetCache
+from bookserver.blocks import load_blocks
+from bookserver.book import DEFAULT_BOOK
+from bookserver.catalog import DATA_DIRECTORY, Catalog
+from bookserver.chapters import ChapterIndex
+from bookserver.handler import BookRequestHandler
+from bookserver.offsets import LazyBook
+from bookserver.reload import BookReloader, Watcher
+from bookserver.server import PooledHTTPServer, PreforkSupervisor
+from bookserver.snapshot import (Timings, load_snapshot, save_snapshot,
+                                 source_key)
+from bookserver.store import TagStore
+
+
+parser = argparse.ArgumentParser(description='Serve the bookreader locally.')
+parser.add_argument('port', nargs='?', type=int, default=8080,
+                    help='the port to listen on (default 8080)')
+parser.add_argument('--workers', type=int, default=16,
+                    help='number of threads serving requests (default 16)')
+parser.add_argument('--max-connections', type=int, default=64,
+                    help='connections accepted at once before answering '
+                         '503 (default 64, per process)')
+parser.add_argument('--processes', type=int, default=1,
+                    help='number of server processes to fork (default 1)')
+parser.add_argument('--cache-size', type=int, default=32,
+                    help='megabytes of files to keep in memory (default 32)')
+parser.add_argument('--keep-alive', type=float, default=5,
+                    help='seconds an idle connection is kept open '
+                         '(default 5)')
+parser.add_argument('--max-books', type=int, default=16,
+                    help='books from the data directory to keep in memory '
+                         '(default 16)')
+parser.add_argument('--reload', action='store_true',
+                    help='watch the book files and serve new versions as '
+                         'soon as they change')
+parser.add_argument('--no-snapshot', dest='snapshot', action='store_false',
+                    help='build everything from the book files rather than '
+                         'loading (and saving) a snapshot')
+parser.add_argument('--backend', action='store_true',
+                    help='serve a local stand-in for Fluidinfo, holding '
+                         'the book and annotations in memory')
+parser.add_argument('--annotations', metavar='PATH',
+                    help='with --backend, keep annotations in the SQLite '
+                         'database at PATH so they outlive the server')
+args = parser.parse_args()
+if args.backend and args.processes > 1:
+    parser.error('--backend keeps its data in memory so it can only be '
+                 'used with a single process')
+if args.annotations and not args.backend:
+    parser.error('--annotations can only be used with --backend')
+
+timings = Timings()
+if args.backend:
+    # The backend needs every block up front, so they're held in columns
+    # rather than as dictionaries.
+    load = load_blocks
+else:
+    # Chapters are read from the book file (and rendered) when first asked
+    # for.
+    load = LazyBook
+mtime = os.path.getmtime(DEFAULT_BOOK)
+page = None
+if os.path.isfile('index.html'):
+    # Used for the pages that show a chapter straight away, at /read/<name>.
+    with io.open('index.html', encoding='utf-8') as f:
+        page = f.read()
+    mtime = max(mtime, os.path.getmtime('index.html'))
+state = None
+snapshot = 'backend' if args.backend else 'server'
+if args.snapshot:
+    with timings.phase('hash'):
+        # Only the content counts, so a checkout or copy of an unchanged
+        # book still uses the snapshot.
+        key = source_key([DEFAULT_BOOK, 'index.html'])
+    with timings.phase('load snapshot'):
+        state = load_snapshot(DEFAULT_BOOK, snapshot, key)
+if state is None:
+    with timings.phase('read book'):
+        book = load(DEFAULT_BOOK)
+    chapters = ChapterIndex(book, mtime, page=page)
+    store = None
+    if args.backend:
+        with timings.phase('tag'):
+            store = TagStore()
+            store.load_book(book.chapters())
+else:
+    chapters, store = state['chapters'], state['store']
+    with timings.phase('read book'):
+        book = state['book'] if args.backend else load(DEFAULT_BOOK)
+    # Chapters the snapshot didn't have are rendered when first asked for.
+    chapters.set_book(book)
+if args.reload:
+    # This means nothing needs to be read from a book file that's in the
+    # middle of being changed.
+    with timings.phase('render'):
+        chapters.render_all()
+BookRequestHandler.chapters = chapters
+if store is not None:
+    annotations = None
+    if args.annotations:
+        annotations = AnnotationStore(args.annotations)
+    BookRequestHandler.backend = FluidinfoAPI(store, annotations=annotations)
+    # Comments added through the backend are packed into their tags in the
+    # background.
+    BookRequestHandler.backend.comments.start()
+with timings.phase('catalog'):
+    # Every book in the data directory, under /books/.
+    BookRequestHandler.catalog = Catalog(DATA_DIRECTORY, args.max_books)
+watcher = None
+if args.reload:
+    watcher = Watcher([DEFAULT_BOOK, DATA_DIRECTORY], BookReloader(
+        BookRequestHandler, DEFAULT_BOOK, book, load, store))
+BookRequestHandler.timeout = args.keep_alive
+BookRequestHandler.assets = AssetCache(args.cache_size * 1024 * 1024)
+with timings.phase('assets'):
+    # Read and compress the application's files up front (and, with
+    # --processes, before forking so the children share them).
+    BookRequestHandler.assets.preload(os.getcwd(),
+                                      BookRequestHandler.private_suffixes)
+
+
+def save():
+    save_snapshot(DEFAULT_BOOK, snapshot, key, {
+        'book': book if args.backend else None,
+        'chapters': BookRequestHandler.chapters,
+        'store': store,
+    })
+
+
+if args.snapshot and state is None:
+    with timings.phase('save snapshot'):
+        save()
+if store is not None:
+    # After the snapshot is saved, so it only ever holds the book.
+    with timings.phase('annotations'):
+        BookRequestHandler.backend.comments.load()
+
+address = ('localhost', args.port)
+
+
+main_pid = os.getpid()
+
+
+def make_server(bind_and_activate=True):
+    if watcher is not None and (args.processes == 1 or
+                                os.getpid() != main_pid):
+        # With --processes, each child watches for itself.
+        watcher.start()
+    return PooledHTTPServer(address, BookRequestHandler,
+                            workers=args.workers,
+                            max_connections=args.max_connections,
+                            bind_and_activate=bind_and_activate)
+
+
+if args.processes > 1:
+    httpd = PreforkSupervisor(lambda: make_server(False), args.processes)
+    sa = httpd.server_address
 else:
-    port = 8080
-
-address = ('localhost', port)
-httpd = HTTPServer(address, SimpleHTTPRequestHandler)
-sa = httpd.socket.getsockname()
-print 'Now visit http://%s:%d' % sa
-print 'Press CTRL-C to stop this server'
-httpd.serve_forever()
+    httpd = make_server()
+    sa = httpd.socket.getsockname()
+print(timings.report())
+print('Now visit http://%s:%d' % sa)
+print('Press CTRL-C to stop this server')
+try:
+    httpd.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    httpd.server_close()
+    if (args.snapshot and store is None and
+            source_key([DEFAULT_BOOK, 'index.html']) == key):
+        # Saved again with the chapters rendered since it started, unless
+        # the book has changed in the meantime. The backend's snapshot
+        # isn't, as its store now holds annotations too.
+        save()
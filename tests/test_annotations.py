@@ -0,0 +1,137 @@
+"""
+Tests for the SQLite annotation store in bookserver.annotations.
+"""
+import unittest
+
+from bookserver.annotations import (AnnotationStore, import_values,
+                                    timestamp_seconds)
+from bookserver.comments import CommentLog, pack_comments
+from bookserver.store import TagStore
+
+
+FIRST = u'Wed, 08 Feb 2012 15:26:51 GMT'
+SECOND = u'Thu, 09 Feb 2012 09:00:00 GMT'
+
+
+class TestAnnotationStore(unittest.TestCase):
+    """
+    Ensures comments are found by block and by author, newest first, using
+    the indexes.
+    """
+
+    def setUp(self):
+        self.annotations = AnnotationStore()
+        self.annotations.add('book:one:1', 'ntoll', FIRST, u'Hi')
+        self.annotations.add('book:one:1', 'becky', SECOND, u'Hello')
+        self.annotations.add('book:one:2', 'ntoll', SECOND, u'Bye')
+
+    def plan(self, where):
+        return ' '.join(str(row[-1]) for row in
+                        self.annotations._connection.execute(
+                            'EXPLAIN QUERY PLAN SELECT * FROM comments '
+                            'WHERE ' + where + ' ORDER BY created DESC',
+                            ('x',)))
+
+    def testBlock(self):
+        comments = self.annotations.block_comments('book:one:1')
+        self.assertEqual([u'Hello', u'Hi'],
+                         [comment['text'] for comment in comments])
+        self.assertEqual(1328714811, comments[1]['created'])
+        self.assertTrue('comments_about' in self.plan('about = ?'))
+
+    def testAuthor(self):
+        comments = self.annotations.author_comments('ntoll')
+        self.assertEqual([u'Bye', u'Hi'],
+                         [comment['text'] for comment in comments])
+        self.assertTrue('comments_author' in self.plan('author = ?'))
+
+    def testDelete(self):
+        # Only the comment with the id goes, not others from the same second.
+        comment_id = self.annotations.add('book:one:1', 'ntoll', FIRST,
+                                          u'Again')
+        self.assertEqual(u'Again',
+                         self.annotations.comment(comment_id)['text'])
+        self.assertTrue(self.annotations.delete(comment_id))
+        self.assertFalse(self.annotations.delete(comment_id))
+        self.assertEqual(None, self.annotations.comment(comment_id))
+        self.assertEqual(3, len(self.annotations))
+
+    def testChanges(self):
+        watermark = self.annotations.watermark()
+        self.assertEqual(([], []), self.annotations.block_changes(
+            'book:one:1', watermark))
+        self.annotations.add('book:one:1', 'ntoll', SECOND, u'Again')
+        self.annotations.delete(1)
+        self.annotations.delete(self.annotations.add('book:one:1', 'becky',
+                                                     FIRST, u'Gone'))
+        self.annotations.add('book:one:2', 'becky', FIRST, u'Elsewhere')
+        added, deleted = self.annotations.block_changes('book:one:1',
+                                                        watermark)
+        self.assertEqual([u'Again'], [comment['text'] for comment in added])
+        self.assertEqual([1, 6], deleted)
+        self.assertEqual(watermark + 5, self.annotations.watermark())
+        self.assertTrue('changes_about' in ' '.join(
+            str(row[-1]) for row in self.annotations._connection.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM changes WHERE about = ? '
+                'AND sequence > ?', ('x', 0))))
+
+    def testImport(self):
+        count = import_values(self.annotations, {'results': {'id': {
+            'a': {'fluiddb/about': {'value': 'book:one:1'},
+                  'ntoll/comment': {'value': pack_comments([
+                      (FIRST, u'One'), (SECOND, u'Two')])}},
+            'b': {'fluiddb/about': {'value': 'book:one:3'},
+                  'becky/comment': {'value': u'Undated'},
+                  'becky/rating': {'value': 5}},
+            'c': {'ntoll/comment': {'value': u'No about value'}},
+        }}})
+        self.assertEqual(3, count)
+        # Hello is as new as Two, but was added first.
+        self.assertEqual([u'Two', u'Hello', u'One'], [
+            comment['text'] for comment in
+            self.annotations.block_comments('book:one:1')
+            if comment['author'] == 'ntoll' or comment['text'] == u'Hello'])
+        self.assertEqual(0, self.annotations.block_comments(
+            'book:one:3')[0]['created'])
+        self.assertEqual(0, timestamp_seconds(u'Not a date'))
+
+
+class TestCommentLog(unittest.TestCase):
+    """
+    Ensures comments written through a CommentLog are kept in the database
+    and put back in the tags when the server starts again.
+    """
+
+    def testDurable(self):
+        annotations = AnnotationStore()
+        store = TagStore()
+        object_id = store.create('book:one:1')
+        log = CommentLog(store, annotations)
+        timestamp, comment_id = log.add('book:one:1', 'ntoll', u'Hi')
+        bye, bye_id = log.add('book:one:2', 'becky', u'Bye')
+        log.delete('book:one:2', 'becky', bye, u'Bye', bye_id)
+        self.assertEqual(1, len(annotations))
+        store = TagStore()
+        CommentLog(store, annotations).load()
+        object_id = store.object_id('book:one:1')
+        self.assertEqual(pack_comments([(timestamp, u'Hi')]),
+                         store.get(object_id, 'ntoll/comment'))
+        self.assertEqual(None, store.object_id('book:one:2'))
+
+    def testReplaced(self):
+        annotations = AnnotationStore()
+        store = TagStore()
+        object_id = store.create('book:one:1')
+        log = CommentLog(store, annotations)
+        log.add('book:one:1', 'ntoll', u'Hi')
+        log.compact()
+        store.set(object_id, 'ntoll/comment', pack_comments([
+            (FIRST, u'Rewritten')]))
+        log.replaced('book:one:1', 'ntoll')
+        self.assertEqual([u'Rewritten'], [
+            comment['text'] for comment in annotations.author_comments(
+                'ntoll')])
+
+
+if __name__ == '__main__':
+    unittest.main()
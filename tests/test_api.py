@@ -0,0 +1,326 @@
+"""
+Tests for the local Fluidinfo backend in bookserver.api and bookserver.store.
+"""
+import base64
+import json
+import unittest
+
+from bookserver.api import FluidinfoAPI
+from bookserver.book import load_book
+from bookserver.store import TagStore
+
+
+def basic_auth(username, password):
+    token = base64.b64encode(('%s:%s' % (username, password)).encode('utf-8'))
+    return 'Basic ' + token.decode('ascii')
+
+
+class APITestCase(unittest.TestCase):
+    """
+    Provides a backend holding the book that ships with the application.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chapters = load_book()
+
+    def setUp(self):
+        self.store = TagStore()
+        self.store.load_book(self.chapters)
+        self.api = FluidinfoAPI(self.store)
+
+    def call(self, method, path, args=None, body=None, user=None):
+        """
+        Returns the (status, decoded JSON body, headers) of a request.
+        """
+        authorization = user and basic_auth(user, 'secret')
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+        response = self.api.handle(method, path, args or {}, body or b'',
+                                   authorization)
+        data = json.loads(response.body.decode('utf-8')) if response.body \
+            else None
+        return response.status, data, dict(response.headers)
+
+
+class TestStore(APITestCase):
+    """
+    Ensures the store holds the book as it is tagged in Fluidinfo.
+    """
+
+    def testBlocks(self):
+        count = sum(len(chapter['blocks']) for chapter in self.chapters)
+        self.assertEqual(count, len(self.store))
+        object_id = self.store.object_id('barefootintocyberspace:prologue:2')
+        self.assertEqual(2, self.store.get(object_id, 'beckyhogge/position'))
+        self.assertEqual(1, len(self.store.get(object_id,
+                                               'beckyhogge/references')))
+
+    def testQuery(self):
+        ids = self.store.query('beckyhogge/parent = '
+                               '"barefootintocyberspace:prologue" and '
+                               'beckyhogge/position <= 3')
+        abouts = sorted(self.store.get(i, 'fluiddb/about') for i in ids)
+        self.assertEqual(['barefootintocyberspace:prologue:%d' % i
+                          for i in (1, 2, 3)], abouts)
+
+    def testBadValues(self):
+        object_id = self.store.create()
+        self.assertRaises(ValueError, self.store.set, object_id, 'a/b', {})
+        self.assertRaises(ValueError, self.store.set, object_id, 'a/b', [1])
+        self.assertRaises(ValueError, self.store.set, object_id,
+                          'fluiddb/about', 'x')
+
+
+class TestAPI(APITestCase):
+    """
+    Ensures the requests made by js/bookreader.js get the answers Fluidinfo
+    would give.
+    """
+
+    about = 'barefootintocyberspace:prologue:2'
+
+    def testChapterQuery(self):
+        """
+        The query made by getChapter.
+        """
+        tags = ['beckyhogge/html', 'beckyhogge/position',
+                'beckyhogge/references', 'fluiddb/about']
+        status, data, headers = self.call('GET', 'values', {
+            'query': ['beckyhogge/parent ="barefootintocyberspace:prologue"'],
+            'tag': tags})
+        self.assertEqual(200, status)
+        results = data['results']['id']
+        self.assertEqual(8, len(results))
+        for values in results.values():
+            self.assertTrue(values['fluiddb/about']['value'].startswith(
+                'barefootintocyberspace:prologue:'))
+            self.assertTrue('beckyhogge/html' in values)
+
+    def testAbout(self):
+        """
+        The request made by countParticipantComments.
+        """
+        status, data, headers = self.call('GET', 'about/' + self.about)
+        self.assertEqual(200, status)
+        self.assertEqual(self.store.object_id(self.about), data['id'])
+        self.assertTrue('beckyhogge/html' in data['tagPaths'])
+        status = self.call('GET', 'about/nothing')[0]
+        self.assertEqual(404, status)
+
+    def testTagAndDelete(self):
+        """
+        Writing and removing a comment, as saveComments and createAnnotation
+        do.
+        """
+        path = 'about/%s/ntoll/comment' % self.about
+        status = self.call('PUT', path, body='A comment', user='ntoll')[0]
+        self.assertEqual(204, status)
+        status, data, headers = self.call('GET', path)
+        self.assertEqual('A comment', data)
+        self.assertEqual('application/vnd.fluiddb.value+json',
+                         headers['Content-Type'])
+        tag_paths = self.call('GET', 'about/' + self.about)[1]['tagPaths']
+        self.assertTrue('ntoll/comment' in tag_paths)
+        self.assertEqual(204, self.call('DELETE', path, user='ntoll')[0])
+        self.assertEqual(404, self.call('GET', path)[0])
+        self.assertEqual(404, self.call('DELETE', path, user='ntoll')[0])
+
+    def testValuesPut(self):
+        """
+        Tagging via the /values endpoint.
+        """
+        body = {'queries': [['fluiddb/about = "%s"' % self.about,
+                             {'ntoll/comment': {'value': 'Hello'}}]]}
+        self.assertEqual(204, self.call('PUT', 'values', body=body,
+                                        user='ntoll')[0])
+        status, data, headers = self.call('GET', 'values', {
+            'query': ['has ntoll/comment'], 'tag': ['*']})
+        values = list(data['results']['id'].values())
+        self.assertEqual(1, len(values))
+        self.assertEqual('Hello', values[0]['ntoll/comment']['value'])
+        self.assertEqual(self.about, values[0]['fluiddb/about']['value'])
+
+    def testPermissions(self):
+        """
+        Only the owner of a namespace may write to it.
+        """
+        path = 'about/%s/ntoll/comment' % self.about
+        self.assertEqual(401, self.call('PUT', path, body='x')[0])
+        self.assertEqual(403, self.call('PUT', path, body='x',
+                                        user='bob')[0])
+        path = 'about/%s/beckyhogge/html' % self.about
+        self.assertEqual(403, self.call('DELETE', path, user='ntoll')[0])
+
+    def testUsers(self):
+        """
+        Logging in checks passwords when the backend knows its users.
+        """
+        self.assertEqual(200, self.call('GET', 'users/ntoll',
+                                        user='ntoll')[0])
+        self.api.users = {'ntoll': 'secret'}
+        self.assertEqual(200, self.call('GET', 'users/ntoll',
+                                        user='ntoll')[0])
+        self.assertEqual(401, self.call('GET', 'users/bob', user='bob')[0])
+        self.assertEqual(404, self.call('GET', 'users/bob')[0])
+
+    def testCounts(self):
+        """
+        The participant counts for a whole chapter, in one request.
+        """
+        for user in ('ntoll', 'bob'):
+            path = 'about/%s/%s/comment' % (self.about, user)
+            self.call('PUT', path, body='Hi', user=user)
+        self.call('PUT', 'about/%s/bob/rating' % self.about, body=5,
+                  user='bob')
+        status, data, headers = self.call('GET', 'counts', {
+            'chapter': ['barefootintocyberspace:prologue']})
+        self.assertEqual(200, status)
+        counts = data['counts']
+        self.assertEqual(8, len(counts))
+        self.assertEqual(2, counts[self.about])
+        self.assertEqual(0, counts['barefootintocyberspace:prologue:1'])
+        status, data, headers = self.call('GET', 'counts', {
+            'about': [self.about, 'nothing']})
+        self.assertEqual({self.about: 2}, data['counts'])
+        self.assertEqual(400, self.call('GET', 'counts')[0])
+        self.assertEqual(405, self.call('PUT', 'counts', {
+            'about': [self.about]}, user='ntoll')[0])
+
+    def testHeatmap(self):
+        path = 'about/%s/ntoll/comment' % self.about
+        self.call('PUT', path, body='Hi', user='ntoll')
+        status, data, headers = self.call('GET', 'heatmap', {
+            'chapter': ['barefootintocyberspace:prologue']})
+        self.assertEqual(200, status)
+        self.assertEqual(8, len(data['blocks']))
+        self.assertEqual({'participants': 1, 'comments': 1},
+                         data['blocks'][self.about])
+        self.assertEqual(400, self.call('GET', 'heatmap')[0])
+
+    def testComments(self):
+        path = 'comments/' + self.about
+        status, data, headers = self.call('POST', path, body={'text': 'Hi'},
+                                          user='ntoll')
+        self.assertEqual(201, status)
+        self.assertEqual('ntoll', data['author'])
+        self.assertEqual(29, len(data['timestamp']))
+        self.assertEqual(401, self.call('POST', path, body={'text': 'Hi'})[0])
+        # Reading the tag sees the comment, packed as bookreader.js would.
+        status, value, headers = self.call(
+            'GET', 'about/%s/ntoll/comment' % self.about)
+        self.assertEqual(data['timestamp'] + u'\nHi\n\u00b6\n', value)
+        self.assertEqual(None, self.store.get_many(
+            self.store.object_id(self.about), ['ntoll/comment']).get(
+                'ntoll/comment'))
+        # Counted once the log's compacted, in the background.
+        self.api.comments.compact()
+        status, counts, headers = self.call('GET', 'heatmap', {
+            'chapter': ['barefootintocyberspace:prologue']})
+        self.assertEqual({'participants': 1, 'comments': 1},
+                         counts['blocks'][self.about])
+        # Deleting one comment leaves others from the same second.
+        again = self.call('POST', path, body={'text': 'Hi'},
+                          user='ntoll')[1]
+        self.assertEqual(204, self.call('DELETE', path, {
+            'id': [str(data['id'])]}, user='ntoll')[0])
+        status, value, headers = self.call(
+            'GET', 'about/%s/ntoll/comment' % self.about)
+        self.assertEqual(again['timestamp'] + u'\nHi\n\u00b6\n', value)
+        self.assertEqual(404, self.call('DELETE', path, {
+            'id': [str(again['id'])]}, user='becky')[0])
+        self.assertEqual(404, self.call('DELETE', 'comments/elsewhere', {
+            'id': [str(again['id'])]}, user='ntoll')[0])
+        self.assertEqual(204, self.call('DELETE', path, {
+            'id': [str(again['id'])]}, user='ntoll')[0])
+        self.assertEqual(404, self.call(
+            'GET', 'about/%s/ntoll/comment' % self.about)[0])
+        self.assertEqual(400, self.call('DELETE', path, user='ntoll')[0])
+        self.assertEqual(405, self.call('PUT', path, user='ntoll')[0])
+
+    def testCommentsMerged(self):
+        path = 'about/%s/ntoll/comment' % self.about
+        timestamp = self.call('POST', 'comments/' + self.about,
+                              body={'text': 'Hi'}, user='ntoll')[1][
+                                  'timestamp']
+        packed = timestamp + u'\nHi\n\u00b6\n'
+        # Every way of reading the tag sees the comment before the log's
+        # compacted.
+        data = self.call('GET', 'about/' + self.about)[1]
+        self.assertTrue('ntoll/comment' in data['tagPaths'])
+        data = self.call('GET', 'values', {
+            'query': ['fluiddb/about = "%s"' % self.about],
+            'tag': ['ntoll/comment']})[1]
+        self.assertEqual([{'ntoll/comment': {'value': packed}}],
+                         list(data['results']['id'].values()))
+        # A client rewriting the whole tag replaces what it read.
+        rewritten = packed + timestamp + u'\nBye'
+        self.call('PUT', path, body=rewritten, user='ntoll')
+        self.api.comments.compact()
+        self.assertEqual(rewritten, self.call('GET', path)[1])
+
+    def testCommentPages(self):
+        path = 'comments/' + self.about
+        for number in range(5):
+            self.call('POST', path, body={'text': 'Comment %d' % number},
+                      user='ntoll')
+        # Comments left by rewriting the whole tag are listed too.
+        self.call('PUT', 'about/%s/becky/comment' % self.about,
+                  body=u'Fri, 10 Feb 2012 10:00:00 GMT\nOld\n\u00b6\n',
+                  user='becky')
+        pages, cursor = [], None
+        while True:
+            args = {'limit': ['2']}
+            if cursor:
+                args['cursor'] = [cursor]
+            status, data, headers = self.call('GET', path, args)
+            self.assertEqual(200, status)
+            pages.append([comment['text'] for comment in data['comments']])
+            cursor = data['cursor']
+            if cursor is None:
+                break
+        self.assertEqual([['Comment 4', 'Comment 3'],
+                          ['Comment 2', 'Comment 1'],
+                          ['Comment 0', 'Old']], pages)
+        status, data, headers = self.call('GET', path)
+        self.assertEqual(6, len(data['comments']))
+        self.assertEqual({'id': 6, 'author': 'becky', 'text': 'Old',
+                          'timestamp': 'Fri, 10 Feb 2012 10:00:00 GMT'},
+                         data['comments'][-1])
+        self.assertEqual(400, self.call('GET', path, {'limit': ['0']})[0])
+        self.assertEqual(400, self.call('GET', path, {'cursor': ['x']})[0])
+
+    def testCommentChanges(self):
+        path = 'comments/' + self.about
+        self.call('POST', path, body={'text': 'First'}, user='ntoll')
+        status, data, headers = self.call('GET', path)
+        watermark = data['watermark']
+        first = data['comments'][0]
+        status, data, headers = self.call('GET', path, {
+            'since': [str(watermark)]})
+        self.assertEqual({'added': [], 'deleted': [],
+                          'watermark': watermark}, data)
+        self.call('POST', path, body={'text': 'Second'}, user='becky')
+        self.call('DELETE', path, {'id': [str(first['id'])]}, user='ntoll')
+        # Changes to other blocks aren't included.
+        self.call('POST', 'comments/elsewhere', body={'text': 'Hi'},
+                  user='becky')
+        status, data, headers = self.call('GET', path, {
+            'since': [str(watermark)]})
+        self.assertEqual(['Second'], [c['text'] for c in data['added']])
+        self.assertEqual([first['id']], data['deleted'])
+        self.assertEqual(watermark + 3, data['watermark'])
+        self.assertEqual(400, self.call('GET', path, {'since': ['x']})[0])
+
+    def testBadRequests(self):
+        status, data, headers = self.call('GET', 'values', {
+            'query': ['has'], 'tag': ['a/b']})
+        self.assertEqual(400, status)
+        self.assertEqual('TParseError', headers['X-FluidDB-Error-Class'])
+        self.assertEqual(400, self.call('GET', 'values', {
+            'query': ['has a/b']})[0])
+        self.assertEqual(404, self.call('GET', 'nowhere')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
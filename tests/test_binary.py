@@ -0,0 +1,75 @@
+"""
+Tests for the binary form of book files in bookserver.binary.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from bookserver.binary import (MAGIC, BinaryBook, BookWriter, dump_book,
+                               encode_varint, load_binary_book)
+from bookserver.book import load_book
+
+
+class TestVarint(unittest.TestCase):
+    """
+    Ensures numbers are encoded in as few bytes as they need.
+    """
+
+    def testEncode(self):
+        for value, expected in ((0, b'\x00'), (127, b'\x7f'),
+                                (128, b'\x80\x01'), (300, b'\xac\x02')):
+            out = bytearray()
+            encode_varint(value, out)
+            self.assertEqual(expected, bytes(out))
+        self.assertRaises(ValueError, encode_varint, -1, bytearray())
+
+
+class TestBinaryBook(unittest.TestCase):
+    """
+    Ensures the book survives being converted to the binary form and back.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chapters = load_book()
+
+    def testRoundTrip(self):
+        for compress in (False, True):
+            data = BookWriter(compress).encode(self.chapters)
+            self.assertEqual(self.chapters, BinaryBook(data).to_list())
+
+    def testSmaller(self):
+        with open(os.path.join(os.path.dirname(__file__), os.pardir, 'data',
+                               'barefoot.json'), 'rb') as f:
+            size = len(f.read())
+        plain = BookWriter().encode(self.chapters)
+        compressed = BookWriter(True).encode(self.chapters)
+        self.assertTrue(len(compressed) < len(plain) < size)
+
+    def testBlockHtml(self):
+        block = self.chapters[1]['blocks'][0]
+        for compress in (False, True):
+            book = BinaryBook(BookWriter(compress).encode(self.chapters))
+            html = book.block_html(block['about'])
+            self.assertTrue(isinstance(html, memoryview))
+            self.assertEqual(block['html'].encode('utf-8'), html.tobytes())
+            self.assertEqual(block['html'], book.blocks[block['about']].html)
+
+    def testNotBinary(self):
+        self.assertRaises(ValueError, BinaryBook, b'[{"about": "x"}]')
+
+    def testTruncated(self):
+        data = BookWriter().encode(self.chapters)
+        for length in (len(MAGIC), len(MAGIC) + 1, len(data) // 2,
+                       len(data) - 1):
+            self.assertRaises(ValueError, BinaryBook, data[:length])
+
+    def testFile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'book.bin')
+            dump_book(list(reversed(self.chapters)), path, True)
+            self.assertEqual(self.chapters, load_binary_book(path))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,57 @@
+"""
+Tests for the column-based BlockStore in bookserver.blocks.
+"""
+import unittest
+
+from bookserver.blocks import BlockStore, load_blocks
+from bookserver.book import load_book
+from bookserver.chapters import ChapterIndex
+
+
+class TestBlockStore(unittest.TestCase):
+    """
+    Ensures blocks come out of the store just as they went in.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chapters = load_book()
+        cls.store = load_blocks()
+
+    def testChapters(self):
+        chapters = list(self.store.chapters())
+        self.assertEqual(len(self.chapters), len(chapters))
+        for expected, chapter in zip(self.chapters, chapters):
+            blocks = sorted(expected['blocks'],
+                            key=lambda block: block['position'])
+            self.assertEqual(dict(expected, blocks=blocks), chapter)
+        self.assertEqual(chapters[1], self.store['prologue'])
+        self.assertEqual(None, self.store.get('missing'))
+        self.assertEqual('title', list(self.store)[0])
+        self.assertEqual(len(self.chapters), len(self.store))
+
+    def testBlocks(self):
+        self.assertEqual(sum(len(chapter['blocks'])
+                             for chapter in self.chapters),
+                         self.store.count_blocks())
+        for block in self.chapters[5]['blocks']:
+            self.assertEqual(block, self.store.block(block['about']))
+            self.assertEqual(block['html'], self.store.html(block['about']))
+        self.assertEqual(None, self.store.block('nowhere'))
+
+    def testInterned(self):
+        store = BlockStore()
+        store.add_book(load_book())
+        store.add_book(load_book())
+        first = self.chapters[1]['blocks'][0]['about']
+        blocks = [chapter['blocks'][0] for chapter in store.chapters()
+                  if chapter['about'] == self.chapters[1]['about']]
+        self.assertEqual(2, len(blocks))
+        self.assertTrue(blocks[0]['about'] is blocks[1]['about'])
+        self.assertEqual(first, blocks[0]['about'])
+        self.assertEqual(len(self.chapters), len(store))
+
+    def testChapterIndex(self):
+        index = ChapterIndex(self.store, 1000000000)
+        self.assertTrue(index.get('prologue') is not None)
+        self.assertEqual(sorted(self.store.keys()), index.names())
@@ -0,0 +1,108 @@
+"""
+Tests for the static site builder in bookserver.build.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bookserver.build import SiteBuilder
+
+
+PAGE = u'''<html>
+    <head>
+        <title>Reader</title>
+        <link rel="stylesheet" href="js/style.css">
+        <script type="text/javascript" src="js/app.js"></script>
+        <script type="text/javascript" src="js/missing.js"></script>
+        <script type="text/javascript" src="backend.js"></script>
+        <script src="http://example.com/remote.js"></script>
+    </head>
+    <body>
+        <div class="row" id="aboutContainer"><a href="#intro">Go</a></div>
+        <div id="chapter" style="display: none;" class="row"></div>
+    </body>
+</html>
+'''
+
+BOOK = [{
+    'about': 'book:intro',
+    'title': 'Introduction',
+    'position': 1,
+    'blocks': [
+        {'about': 'book:intro:2', 'position': 2, 'parent': 'book:intro',
+         'html': '<p>Second</p>'},
+        {'about': 'book:intro:1', 'position': 1, 'parent': 'book:intro',
+         'html': '<p>First</p>'},
+    ],
+}]
+
+
+class TestSiteBuilder(unittest.TestCase):
+    """
+    Ensures the built site holds everything needed to read the book.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.output = os.path.join(tempfile.mkdtemp(), 'site')
+        self.create('index.html', PAGE.encode('utf-8'))
+        self.create('js/app.js', b'var app = 1;')
+        self.create('js/style.css', b'body {}')
+        self.create('images/tags.png', b'PNG')
+        self.create('book.json', json.dumps(BOOK).encode('utf-8'))
+        builder = SiteBuilder(self.root, self.output,
+                              os.path.join(self.root, 'book.json'))
+        self.manifest = builder.build()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(os.path.dirname(self.output))
+
+    def create(self, path, body):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(body)
+
+    def read(self, path):
+        with io.open(os.path.join(self.output, path), encoding='utf-8') as f:
+            return f.read()
+
+    def testFingerprints(self):
+        url = self.manifest['js/app.js']
+        self.assertTrue(url.startswith('js/app.') and url.endswith('.js'))
+        self.assertEqual(u'var app = 1;', self.read(url))
+        self.assertEqual(u'var app = 1;', self.read('js/app.js'))
+        index = self.read('index.html')
+        self.assertTrue('src="%s"' % url in index)
+        self.assertTrue('href="%s"' % self.manifest['js/style.css'] in index)
+        self.assertTrue('src="js/missing.js"' in index)
+        self.assertTrue('src="http://example.com/remote.js"' in index)
+        self.assertTrue('href="#intro"' in index)
+        self.assertEqual(set(['js/app.js', 'js/style.css', 'images/tags.png']),
+                         set(self.manifest))
+
+    def testChapters(self):
+        document = json.loads(self.read('chapters/intro.json'))
+        self.assertEqual(['book:intro:1', 'book:intro:2'],
+                         [block['fluiddb/about']
+                          for block in document['blocks']])
+        markup = self.read('chapters/intro.html')
+        self.assertTrue(markup.index('First') < markup.index('Second'))
+        self.assertTrue(self.manifest['images/tags.png'] in markup)
+        page = self.read('read/intro.html')
+        self.assertTrue('<base href="../"/>' in page)
+        self.assertTrue(markup in page)
+        self.assertTrue('Using Fluidinfo' in self.read('backend.js'))
+
+    def testHeaders(self):
+        headers = self.read('_headers')
+        self.assertTrue('/%s\n  Cache-Control: public, max-age=31536000, '
+                        'immutable\n' % self.manifest['js/app.js'] in headers)
+        self.assertTrue('/read/*\n  Cache-Control: no-cache\n' in headers)
+        self.assertEqual(self.manifest,
+                         json.loads(self.read('manifest.json')))
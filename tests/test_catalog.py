@@ -0,0 +1,158 @@
+"""
+Tests for the catalog of books in bookserver.catalog.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bookserver import catalog as catalog_module
+from bookserver.catalog import Catalog
+
+
+def book(prefix, title, chapters):
+    """
+    Returns a book with the named chapters, each with one block.
+    """
+    return [{
+        'about': '%s:%s' % (prefix, name),
+        'parent': 'book:' + title,
+        'title': name.title(),
+        'position': position,
+        'blocks': [{'about': '%s:%s:1' % (prefix, name), 'position': 1,
+                    'parent': '%s:%s' % (prefix, name),
+                    'html': '<p>%s</p>' % name}],
+    } for position, name in enumerate(chapters)]
+
+
+def write_book(directory, filename, chapters):
+    with open(os.path.join(directory, filename), 'wb') as f:
+        f.write(json.dumps(chapters).encode('utf-8'))
+
+
+class TestCatalog(unittest.TestCase):
+    """
+    Ensures every book is found and that only the most recently used books
+    are kept in memory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for number in range(4):
+            write_book(self.directory, 'book%d.json' % number,
+                       book('book%d' % number, 'Book %d' % number,
+                            ['one', 'two']))
+        write_book(self.directory, 'settings.json', {'not': 'a book'})
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as f:
+            f.write('Not a book either')
+        self.catalog = Catalog(self.directory, max_books=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testListing(self):
+        self.assertEqual(4, len(self.catalog))
+        self.assertTrue('book1' in self.catalog)
+        self.assertFalse('settings' in self.catalog)
+        books = json.loads(self.catalog.listing.body.decode('utf-8'))['books']
+        self.assertEqual(['book0', 'book1', 'book2', 'book3'],
+                         [entry['id'] for entry in books])
+        self.assertEqual({
+            'id': 'book0',
+            'about': 'book:Book 0',
+            'title': 'Book 0',
+            'chapters': [{'name': 'one', 'title': 'One'},
+                         {'name': 'two', 'title': 'Two'}],
+            'blocks': 2,
+        }, books[0])
+        # Nothing is loaded until it's asked for.
+        self.assertEqual([], self.catalog.loaded())
+
+    def testGet(self):
+        index = self.catalog.get('book2')
+        chapter = json.loads(index.get('two').body.decode('utf-8'))
+        self.assertEqual('book2:two', chapter['about'])
+        self.assertTrue(self.catalog.get('book2') is index)
+        self.assertEqual(None, self.catalog.get('settings'))
+        self.assertEqual(None, self.catalog.get('missing'))
+
+    def testChanged(self):
+        index = self.catalog.get('book1')
+        path = os.path.join(self.directory, 'book1.json')
+        write_book(self.directory, 'book1.json',
+                   book('book1', 'Book 1', ['one', 'two', 'three']))
+        os.utime(path, (1000000000, 1000000000))
+        # Loaded again without waiting for a scan.
+        changed = self.catalog.get('book1')
+        self.assertFalse(changed is index)
+        self.assertEqual(3, len(changed))
+        # Caught half written, the version already loaded is kept.
+        with open(path, 'r+b') as f:
+            f.truncate(40)
+        self.assertTrue(self.catalog.get('book1') is changed)
+
+    def testLoadedWithoutLock(self):
+        """
+        Books are read without holding the lock, so other books can be
+        served in the meantime.
+        """
+        free = []
+
+        def load(path):
+            free.append(self.catalog._lock.acquire(False))
+            if free[-1]:
+                self.catalog._lock.release()
+            return original(path)
+        original = catalog_module.LazyBook
+        catalog_module.LazyBook = load
+        try:
+            self.catalog.get('book1')
+        finally:
+            catalog_module.LazyBook = original
+        self.assertEqual([True], free)
+        self.assertEqual(['book1'], self.catalog.loaded())
+
+    def testEviction(self):
+        self.catalog.get('book0')
+        self.catalog.get('book1')
+        self.catalog.get('book0')
+        self.catalog.get('book2')
+        self.assertEqual(['book0', 'book2'], self.catalog.loaded())
+        self.catalog.get('book3')
+        self.assertEqual(['book2', 'book3'], self.catalog.loaded())
+
+    def testScan(self):
+        self.catalog.get('book0')
+        self.catalog.get('book1')
+        path = os.path.join(self.directory, 'book1.json')
+        write_book(self.directory, 'book1.json',
+                   book('book1', 'Book 1', ['one', 'two', 'three']))
+        os.utime(path, (1000000000, 1000000000))
+        # Caught half written, the old version is kept.
+        with open(os.path.join(self.directory, 'book0.json'), 'r+b') as f:
+            f.truncate(40)
+        os.utime(os.path.join(self.directory, 'book0.json'),
+                 (1000000000, 1000000000))
+        os.remove(os.path.join(self.directory, 'book3.json'))
+        self.catalog.scan()
+        self.assertEqual(['book0'], self.catalog.loaded())
+        self.assertFalse('book3' in self.catalog)
+        books = json.loads(self.catalog.listing.body.decode('utf-8'))['books']
+        self.assertEqual(['book0', 'book1', 'book2'],
+                         [entry['id'] for entry in books])
+        self.assertEqual(3, len(books[1]['chapters']))
+        self.assertEqual(3, len(self.catalog.get('book1')))
+
+    def testTruncated(self):
+        """
+        A book file cut short between values isn't a book, rather than an
+        error that stops the catalog being made.
+        """
+        data = json.dumps(book('book4', 'Book 4', ['one', 'two']))
+        with open(os.path.join(self.directory, 'book4.json'), 'wb') as f:
+            f.write(data[:-1].encode('utf-8'))
+        catalog = Catalog(self.directory, max_books=2)
+        self.assertEqual(4, len(catalog))
+        self.assertFalse('book4' in catalog)
+        self.assertEqual(None, catalog.get('book4'))
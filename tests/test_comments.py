@@ -0,0 +1,110 @@
+"""
+Tests for the log of comments in bookserver.comments.
+"""
+import unittest
+
+from bookserver.comments import (UNKNOWN_DATE, CommentLog, pack_comments,
+                                 unpack_comments)
+from bookserver.heatmap import MISSING, count_comments
+from bookserver.store import TagStore
+
+
+ABOUT = 'book:one:1'
+DATE = u'Wed, 08 Feb 2012 15:26:51 GMT'
+
+
+class TestPacking(unittest.TestCase):
+    """
+    Ensures comments are packed and unpacked as js/bookreader.js does.
+    """
+
+    def testPack(self):
+        self.assertEqual(DATE + u'\nHi\n\u00b6\n',
+                         pack_comments([(DATE, u'Hi')]))
+        packed = pack_comments([(DATE, u'Hi'), (DATE, u'Bye')])
+        self.assertEqual(DATE + u'\nHi\n\u00b6\n' + DATE + u'\nBye', packed)
+        self.assertEqual(2, count_comments(packed))
+
+    def testUnpack(self):
+        comments = [(DATE, u'Hi'), (DATE, u'Hello\nagain')]
+        self.assertEqual(comments, unpack_comments(pack_comments(comments)))
+        self.assertEqual([(DATE, u'Hi')],
+                         unpack_comments(pack_comments(comments[:1])))
+        self.assertEqual([(UNKNOWN_DATE, u'Hi')], unpack_comments(u'Hi'))
+        self.assertEqual([(UNKNOWN_DATE, u'Unreadable comment.')],
+                         unpack_comments(5))
+        self.assertEqual([], unpack_comments(MISSING))
+
+
+class TestCommentLog(unittest.TestCase):
+    """
+    Ensures comments are logged and then compacted into the users' comment
+    tags.
+    """
+
+    def setUp(self):
+        self.store = TagStore()
+        self.object_id = self.store.create(ABOUT)
+        self.log = CommentLog(self.store)
+
+    def tag(self, author='ntoll'):
+        return self.store.get_many(self.object_id, [author + '/comment']).get(
+            author + '/comment')
+
+    def testAdd(self):
+        first, comment_id = self.log.add(ABOUT, 'ntoll', u'Hi')
+        self.assertEqual(None, comment_id)
+        second = self.log.add(ABOUT, 'ntoll', u'Bye')[0]
+        # Nothing is written until the log is compacted.
+        self.assertEqual(None, self.tag())
+        self.assertEqual([(first, u'Hi'), (second, u'Bye')],
+                         self.log.comments(ABOUT, 'ntoll'))
+        self.log.compact()
+        self.assertEqual(pack_comments([(first, u'Hi'), (second, u'Bye')]),
+                         self.tag())
+        self.assertRaises(ValueError, self.log.add, ABOUT, 'no/one', u'Hi')
+
+    def testDelete(self):
+        self.store.set(self.object_id, 'ntoll/comment',
+                       pack_comments([(DATE, u'Hi')]))
+        timestamp = self.log.add(ABOUT, 'ntoll', u'Bye')[0]
+        self.log.add(ABOUT, 'ntoll', u'Bye')
+        self.log.delete(ABOUT, 'ntoll', DATE, u'Hi')
+        self.log.compact()
+        self.assertEqual(pack_comments([(timestamp, u'Bye')] * 2),
+                         self.tag())
+        # Only one of several identical comments goes.
+        self.log.delete(ABOUT, 'ntoll', timestamp, u'Bye')
+        self.log.compact()
+        self.assertEqual(pack_comments([(timestamp, u'Bye')]), self.tag())
+        self.log.delete(ABOUT, 'ntoll', timestamp, u'Bye')
+        self.log.compact()
+        self.assertEqual(None, self.tag())
+
+    def testMerge(self):
+        tags = {'fluiddb/about': ABOUT, 'becky/comment': u'Old'}
+        self.assertTrue(self.log.merge(tags) is tags)
+        timestamp = self.log.add(ABOUT, 'ntoll', u'Hi')[0]
+        merged = self.log.merge(tags)
+        self.assertEqual(pack_comments([(timestamp, u'Hi')]),
+                         merged['ntoll/comment'])
+        self.assertEqual(u'Old', merged['becky/comment'])
+        self.assertFalse('ntoll/comment' in self.log.merge(
+            tags, ['becky/comment']))
+        self.log.compact()
+        self.assertTrue(self.log.merge(tags) is tags)
+
+    def testRewritten(self):
+        self.log.add(ABOUT, 'ntoll', u'Hi')
+        self.log.compact()
+        # A client that still rewrites the whole tag.
+        self.store.set(self.object_id, 'ntoll/comment',
+                       pack_comments([(DATE, u'Replaced')]))
+        timestamp = self.log.add(ABOUT, 'ntoll', u'Bye')[0]
+        self.log.compact()
+        self.assertEqual(pack_comments([(DATE, u'Replaced'),
+                                        (timestamp, u'Bye')]), self.tag())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for sending server-sent events in bookserver.events.
+"""
+import socket
+import time
+import unittest
+
+from bookserver.events import HEARTBEAT, PREAMBLE, EventHub, format_event
+
+
+def read_until(connection, end):
+    """
+    Returns what's read from connection up to and including end.
+    """
+    received = b''
+    while not received.endswith(end):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        received += chunk
+    return received
+
+
+class TestEventHub(unittest.TestCase):
+    """
+    Ensures events reach the connections listening to their chapter, and
+    that connections that have gone away are dropped.
+    """
+
+    def setUp(self):
+        self.hub = EventHub(heartbeat=0.1)
+        self.pairs = []
+
+    def tearDown(self):
+        self.hub.stop()
+        for server, client in self.pairs:
+            client.close()
+
+    def listen(self, chapter):
+        server, client = socket.socketpair()
+        client.settimeout(5)
+        self.pairs.append((server, client))
+        self.hub.subscribe(chapter, server)
+        self.assertEqual(PREAMBLE, read_until(client, PREAMBLE))
+        return client
+
+    def testFormat(self):
+        self.assertEqual(b'event: count\ndata: {"about": "a"}\n\n',
+                         format_event('count', {'about': 'a'}))
+
+    def testPublish(self):
+        one = self.listen('book:one')
+        two = self.listen('book:two')
+        self.assertEqual(2, len(self.hub))
+        self.hub.publish('book:one', 'comment', {'text': 'Hi'})
+        self.hub.publish('book:three', 'comment', {'text': 'Nobody'})
+        event = format_event('comment', {'text': 'Hi'})
+        self.assertEqual(event, read_until(one, event))
+        # Only heartbeats reach the other chapter.
+        self.assertEqual(HEARTBEAT, read_until(two, HEARTBEAT))
+
+    def testGone(self):
+        self.listen('book:one')
+        self.listen('book:two')
+        self.pairs[0][1].close()
+        # Noticed at the next heartbeat.
+        for attempt in range(50):
+            if len(self.hub) == 1:
+                break
+            time.sleep(0.05)
+        self.assertEqual(['book:two'], list(self.hub._streams))
+
+    def testSlow(self):
+        self.listen('book:one')
+        two = self.listen('book:two')
+        # More than the first connection's buffer holds, as it isn't read.
+        self.hub.publish('book:one', 'comment', {'text': 'x' * 4000000})
+        event = format_event('comment', {'text': 'Hi'})
+        self.hub.publish('book:two', 'comment', {'text': 'Hi'})
+        self.assertEqual(event, read_until(two, event))
+        self.assertEqual(['book:two'], list(self.hub._streams))
+
+    def testFull(self):
+        self.hub.max_streams = 1
+        self.assertFalse(self.hub.full())
+        self.listen('book:one')
+        self.assertTrue(self.hub.full())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,805 @@
+"""
+Tests for the request handler in bookserver.handler and the cache it uses.
+"""
+import gzip
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from io import BytesIO
+
+from bookserver.api import FluidinfoAPI
+from bookserver.assets import Asset, AssetCache, compressor
+from bookserver.catalog import Catalog
+from bookserver.chapters import ChapterIndex
+from bookserver.compat import HTTPConnection
+from bookserver.handler import BookRequestHandler
+from bookserver.server import PooledHTTPServer
+from bookserver.store import TagStore
+
+
+class QuietHandler(BookRequestHandler):
+    """
+    Doesn't log every request to the console.
+    """
+
+    def log_message(self, *args):
+        pass
+
+
+def read_until(connection, end):
+    """
+    Returns what's read from a socket up to and including end.
+    """
+    received = b''
+    while not received.endswith(end):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        received += chunk
+    return received
+
+
+class HandlerTestCase(unittest.TestCase):
+    """
+    Runs a server in a thread, serving files from a temporary directory.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        os.chdir(self.root)
+        QuietHandler.assets = AssetCache(1024 * 1024)
+        QuietHandler.timeout = 5
+        QuietHandler.max_requests = 100
+        QuietHandler.backend = None
+        QuietHandler.chapters = None
+        QuietHandler.catalog = None
+        self.httpd = PooledHTTPServer(('localhost', 0), QuietHandler,
+                                      workers=2)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def write(self, name, content, mtime=None):
+        """
+        Writes content to a file in the served directory.
+        """
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def request(self, path, headers=None, method='GET', body=None):
+        """
+        Returns the response to a request as (status, headers, body).
+        """
+        host, port = self.httpd.socket.getsockname()
+        connection = HTTPConnection(host, port, timeout=5)
+        try:
+            connection.request(method, path, body, headers=headers or {})
+            response = connection.getresponse()
+            body = response.read()
+            headers = dict((k.lower(), v) for k, v in response.getheaders())
+            return response.status, headers, body
+        finally:
+            connection.close()
+
+
+class TestConditionalRequests(HandlerTestCase):
+    """
+    Ensures files are served with validators and revalidated with 304s.
+    """
+
+    def testValidators(self):
+        """
+        Files are sent with an ETag and Last-Modified header.
+        """
+        self.write('index.html', b'<html></html>', mtime=1000000000)
+        status, headers, body = self.request('/')
+        self.assertEqual(200, status)
+        self.assertEqual(b'<html></html>', body)
+        self.assertEqual('text/html', headers['content-type'])
+        self.assertEqual('13', headers['content-length'])
+        self.assertEqual(formatdate(1000000000, usegmt=True),
+                         headers['last-modified'])
+        self.assertTrue(headers['etag'].startswith('"'))
+
+    def testIfNoneMatch(self):
+        """
+        A matching ETag gets a 304 with no body.
+        """
+        self.write('app.js', b'var x = 1;')
+        etag = self.request('/app.js')[1]['etag']
+        status, headers, body = self.request('/app.js',
+                                             {'If-None-Match': etag})
+        self.assertEqual(304, status)
+        self.assertEqual(b'', body)
+        self.assertEqual(etag, headers['etag'])
+        status = self.request('/app.js', {'If-None-Match': '"other"'})[0]
+        self.assertEqual(200, status)
+
+    def testIfModifiedSince(self):
+        """
+        A date no earlier than the modification time gets a 304.
+        """
+        self.write('app.css', b'body {}', mtime=1000000000)
+        since = formatdate(1000000000, usegmt=True)
+        status = self.request('/app.css', {'If-Modified-Since': since})[0]
+        self.assertEqual(304, status)
+        earlier = formatdate(999999999, usegmt=True)
+        status = self.request('/app.css', {'If-Modified-Since': earlier})[0]
+        self.assertEqual(200, status)
+
+    def testChangedFile(self):
+        """
+        Editing a file invalidates the cached copy and its ETag.
+        """
+        self.write('data.json', b'[1]', mtime=1000000000)
+        etag = self.request('/data.json')[1]['etag']
+        self.write('data.json', b'[1, 2]', mtime=1000000001)
+        status, headers, body = self.request('/data.json',
+                                             {'If-None-Match': etag})
+        self.assertEqual(200, status)
+        self.assertEqual(b'[1, 2]', body)
+        self.assertNotEqual(etag, headers['etag'])
+
+    def testMissingFile(self):
+        """
+        Files that don't exist are a 404.
+        """
+        self.assertEqual(404, self.request('/missing.js')[0])
+
+    def testPrivateFile(self):
+        """
+        Files the server makes for itself, and annotation databases, are a
+        404 even though they're in the served directory.
+        """
+        os.mkdir(os.path.join(self.root, 'data'))
+        for name in ('data/annotations.db', 'data/book.json.server.snapshot',
+                     'data/book.json.idx'):
+            self.write(name, b'private')
+            self.assertEqual(404, self.request('/' + name)[0])
+        self.write('data/book.json', b'[]')
+        self.assertEqual(200, self.request('/data/book.json')[0])
+
+    def testHead(self):
+        """
+        HEAD requests get the headers but no body.
+        """
+        self.write('app.js', b'var x = 1;')
+        status, headers, body = self.request('/app.js', method='HEAD')
+        self.assertEqual(200, status)
+        self.assertEqual('10', headers['content-length'])
+        self.assertEqual(b'', body)
+
+
+class TestCompression(HandlerTestCase):
+    """
+    Ensures compressed copies are sent to browsers that accept them.
+    """
+
+    script = b'var bookreader = function() { return {}; };\n' * 20
+
+    def compressed(self, name, content):
+        """
+        Writes content to a file and reads it into the cache, compressed,
+        as runserver.py does before serving.
+        """
+        self.write(name, content)
+        QuietHandler.assets.preload(self.root)
+
+    def testGzip(self):
+        """
+        Browsers that accept gzip get the compressed file.
+        """
+        self.compressed('app.js', self.script)
+        status, headers, body = self.request('/app.js',
+                                             {'Accept-Encoding': 'gzip'})
+        self.assertEqual(200, status)
+        self.assertEqual('gzip', headers['content-encoding'])
+        self.assertEqual('Accept-Encoding', headers['vary'])
+        self.assertEqual(str(len(body)), headers['content-length'])
+        self.assertEqual(self.script,
+                         gzip.GzipFile(fileobj=BytesIO(body)).read())
+
+    def testIdentity(self):
+        """
+        Browsers that don't accept gzip get the file as it is, with a
+        different ETag.
+        """
+        self.compressed('app.js', self.script)
+        gzipped = self.request('/app.js', {'Accept-Encoding': 'gzip'})[1]
+        for accept in (None, 'gzip;q=0', 'deflate'):
+            headers = accept and {'Accept-Encoding': accept} or {}
+            status, plain, body = self.request('/app.js', headers)
+            self.assertEqual(self.script, body)
+            self.assertFalse('content-encoding' in plain)
+            self.assertEqual('Accept-Encoding', plain['vary'])
+            self.assertNotEqual(gzipped['etag'], plain['etag'])
+
+    def testNotModified(self):
+        """
+        Conditional requests match against the negotiated variant.
+        """
+        self.compressed('app.js', self.script)
+        etag = self.request('/app.js', {'Accept-Encoding': 'gzip'})[1]['etag']
+        status = self.request('/app.js', {'Accept-Encoding': 'gzip',
+                                          'If-None-Match': etag})[0]
+        self.assertEqual(304, status)
+        status = self.request('/app.js', {'If-None-Match': etag})[0]
+        self.assertEqual(200, status)
+
+    def testBackground(self):
+        """
+        A file that isn't in the cache is compressed in the background, and
+        sent compressed once that's done.
+        """
+        self.write('app.js', self.script)
+        status, headers, body = self.request('/app.js',
+                                             {'Accept-Encoding': 'gzip'})
+        self.assertEqual(200, status)
+        self.assertEqual('Accept-Encoding', headers['vary'])
+        QuietHandler.assets.wait()
+        headers = self.request('/app.js', {'Accept-Encoding': 'gzip'})[1]
+        self.assertEqual('gzip', headers['content-encoding'])
+
+    def testGenerated(self):
+        """
+        Content the server generates is compressed in the background too.
+        """
+        asset = Asset.from_bytes('a.json', b'[' + b'1,' * 500 + b'1]',
+                                 1000000000)
+        compressor.wait()
+        self.assertFalse(asset.pending)
+        self.assertTrue('gzip' in asset.variants)
+
+    def testIncompressible(self):
+        """
+        Images and tiny files are never compressed.
+        """
+        self.write('cover.png', b'\x89PNG' * 1000)
+        self.write('tiny.js', b'var x = 1;')
+        for path in ('/cover.png', '/tiny.js'):
+            headers = self.request(path, {'Accept-Encoding': 'gzip'})[1]
+            self.assertFalse('content-encoding' in headers)
+            self.assertFalse('vary' in headers)
+
+
+class TestRanges(HandlerTestCase):
+    """
+    Ensures parts of files can be requested, whether the file is cached or
+    sent from disk.
+    """
+
+    audio = bytes(bytearray(range(256))) * 8
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        # Only files up to 1KB are held in memory.
+        QuietHandler.assets = AssetCache(1024 * 1024, 1024)
+        self.write('small.ogg', self.audio[:1000])
+        self.write('large.ogg', self.audio)
+
+    def testFullFile(self):
+        """
+        Large files are sent whole when no range is asked for.
+        """
+        status, headers, body = self.request('/large.ogg')
+        self.assertEqual(200, status)
+        self.assertEqual(self.audio, body)
+        self.assertEqual('bytes', headers['accept-ranges'])
+        self.assertEqual(str(len(self.audio)), headers['content-length'])
+
+    def testRanges(self):
+        """
+        Byte ranges, open ended ranges and suffix ranges get a 206.
+        """
+        for name, data in (('small.ogg', self.audio[:1000]),
+                           ('large.ogg', self.audio)):
+            size = len(data)
+            for header, start, end in (('bytes=0-99', 0, 99),
+                                       ('bytes=500-', 500, size - 1),
+                                       ('bytes=-10', size - 10, size - 1),
+                                       ('bytes=900-99999', 900, size - 1)):
+                status, headers, body = self.request('/' + name,
+                                                     {'Range': header})
+                self.assertEqual(206, status)
+                self.assertEqual(data[start:end + 1], body)
+                self.assertEqual('bytes %d-%d/%d' % (start, end, size),
+                                 headers['content-range'])
+                self.assertEqual(str(end - start + 1),
+                                 headers['content-length'])
+
+    def testUnsatisfiable(self):
+        """
+        Ranges starting beyond the end of the file get a 416.
+        """
+        status, headers, body = self.request('/large.ogg',
+                                             {'Range': 'bytes=5000-'})
+        self.assertEqual(416, status)
+        self.assertEqual('bytes */2048', headers['content-range'])
+
+    def testIgnoredRanges(self):
+        """
+        Malformed or multiple ranges are ignored and the whole file sent.
+        """
+        for header in ('bytes=10-5', 'bytes=0-1,5-6', 'lines=1-2'):
+            status, headers, body = self.request('/large.ogg',
+                                                 {'Range': header})
+            self.assertEqual(200, status)
+            self.assertEqual(self.audio, body)
+
+    def testIfRange(self):
+        """
+        The range is only honoured if If-Range matches the current file.
+        """
+        etag = self.request('/large.ogg')[1]['etag']
+        status = self.request('/large.ogg', {'Range': 'bytes=0-9',
+                                             'If-Range': etag})[0]
+        self.assertEqual(206, status)
+        status, headers, body = self.request('/large.ogg',
+                                             {'Range': 'bytes=0-9',
+                                              'If-Range': '"stale"'})
+        self.assertEqual(200, status)
+        self.assertEqual(self.audio, body)
+
+    def testLargeFileNotModified(self):
+        """
+        Files sent from disk can still be revalidated.
+        """
+        etag = self.request('/large.ogg')[1]['etag']
+        status = self.request('/large.ogg', {'If-None-Match': etag})[0]
+        self.assertEqual(304, status)
+
+
+class TestKeepAlive(HandlerTestCase):
+    """
+    Ensures connections are reused for several requests.
+    """
+
+    def connect(self):
+        host, port = self.httpd.socket.getsockname()
+        return HTTPConnection(host, port, timeout=5)
+
+    def read_all(self, sock):
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def testPersistentConnection(self):
+        """
+        Several requests are answered on one connection.
+        """
+        self.write('a.js', b'var a;')
+        self.write('b.js', b'var b;')
+        connection = self.connect()
+        try:
+            for i in range(3):
+                for name, body in (('/a.js', b'var a;'), ('/b.js', b'var b;')):
+                    connection.request('GET', name)
+                    response = connection.getresponse()
+                    self.assertEqual(body, response.read())
+                    self.assertEqual(None, response.getheader('Connection'))
+                    sock = connection.sock
+                    self.assertNotEqual(None, sock)
+            # The same socket was used throughout.
+            self.assertTrue(sock is connection.sock)
+        finally:
+            connection.close()
+
+    def testMaxRequests(self):
+        """
+        The connection is closed after max_requests requests.
+        """
+        QuietHandler.max_requests = 2
+        self.write('a.js', b'var a;')
+        connection = self.connect()
+        try:
+            connection.request('GET', '/a.js')
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(None, response.getheader('Connection'))
+            connection.request('GET', '/a.js')
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual('close', response.getheader('Connection'))
+        finally:
+            connection.close()
+
+    def testPipelining(self):
+        """
+        Requests sent without waiting for a response are answered in order.
+        """
+        self.write('a.js', b'var a;')
+        self.write('b.js', b'var b;')
+        sock = socket.create_connection(self.httpd.socket.getsockname(), 5)
+        try:
+            sock.sendall(b'GET /a.js HTTP/1.1\r\nHost: x\r\n\r\n'
+                         b'HEAD /b.js HTTP/1.1\r\nHost: x\r\n\r\n'
+                         b'GET /b.js HTTP/1.1\r\nHost: x\r\n'
+                         b'Connection: close\r\n\r\n')
+            response = self.read_all(sock)
+        finally:
+            sock.close()
+        self.assertEqual(3, response.count(b'HTTP/1.1 '))
+        # The HEAD response has no body, so "var b;" appears only once.
+        self.assertEqual(1, response.count(b'var b;'))
+        self.assertTrue(response.find(b'var a;') < response.find(b'var b;'))
+        self.assertTrue(response.endswith(b'var b;'))
+
+    def testIdleTimeout(self):
+        """
+        Idle connections are closed after the timeout.
+        """
+        QuietHandler.timeout = 0.1
+        sock = socket.create_connection(self.httpd.socket.getsockname(), 5)
+        try:
+            start = time.time()
+            self.assertEqual(b'', self.read_all(sock))
+            self.assertTrue(time.time() - start < 4)
+        finally:
+            sock.close()
+
+    def testIdleConnectionsGiveWay(self):
+        """
+        Idle kept-alive connections are closed when another connection is
+        waiting for a worker rather than holding it until the timeout.
+        """
+        self.write('a.js', b'var a;')
+        idle = [self.connect() for i in range(self.httpd.workers)]
+        try:
+            for connection in idle:
+                connection.request('GET', '/a.js')
+                response = connection.getresponse()
+                self.assertEqual(b'var a;', response.read())
+                self.assertEqual(None, response.getheader('Connection'))
+            start = time.time()
+            status, headers, body = self.request('/a.js')
+            self.assertEqual(200, status)
+            self.assertEqual(b'var a;', body)
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            for connection in idle:
+                connection.close()
+
+    def testHTTP10(self):
+        """
+        HTTP/1.0 requests without keep-alive have the connection closed.
+        """
+        self.write('a.js', b'var a;')
+        sock = socket.create_connection(self.httpd.socket.getsockname(), 5)
+        try:
+            sock.sendall(b'GET /a.js HTTP/1.0\r\n\r\n')
+            response = self.read_all(sock)
+        finally:
+            sock.close()
+        self.assertTrue(response.endswith(b'var a;'))
+
+    def testRedirectFraming(self):
+        """
+        Directory redirects have an empty body so the connection can be
+        reused.
+        """
+        os.mkdir(os.path.join(self.root, 'js'))
+        status, headers, body = self.request('/js?x=1')
+        self.assertEqual(301, status)
+        self.assertEqual('/js/?x=1', headers['location'])
+        self.assertEqual('0', headers['content-length'])
+
+
+class TestBackend(HandlerTestCase):
+    """
+    Ensures the local Fluidinfo backend is served alongside the application.
+    """
+
+    def testNoBackend(self):
+        """
+        Without a backend the application is told to use Fluidinfo.
+        """
+        status, headers, body = self.request('/backend.js')
+        self.assertEqual(200, status)
+        self.assertFalse(b'localFluidinfo' in body)
+        self.assertEqual(404, self.request('/fluidinfo/values')[0])
+
+    def testBackend(self):
+        """
+        Requests under /fluidinfo/ go to the backend.
+        """
+        store = TagStore()
+        store.create('book:test')
+        QuietHandler.backend = FluidinfoAPI(store)
+        body = self.request('/backend.js')[2]
+        self.assertEqual(b'var localFluidinfo = "/fluidinfo/";\n', body)
+        path = '/fluidinfo/about/book%3Atest/ntoll/rating'
+        status = self.request(path, {'Authorization': 'Basic bnRvbGw6eA==',
+                                     'Content-Length': '1'}, 'PUT', b'5')[0]
+        self.assertEqual(204, status)
+        status, headers, body = self.request(path)
+        self.assertEqual(200, status)
+        self.assertEqual(b'5', body)
+        self.assertEqual('no-cache', headers['cache-control'])
+
+
+class TestEvents(HandlerTestCase):
+    """
+    Ensures readers are sent the changes to a chapter's comments, without
+    holding up a worker.
+    """
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        store = TagStore()
+        store.load_book([{'about': 'book:one', 'blocks': [
+            {'about': 'book:one:1', 'parent': 'book:one', 'position': 1,
+             'html': '<p>One</p>'}]}])
+        QuietHandler.backend = FluidinfoAPI(store)
+
+    def tearDown(self):
+        QuietHandler.backend.events.stop()
+        HandlerTestCase.tearDown(self)
+
+    def listen(self, chapter):
+        """
+        Returns a socket receiving the events about chapter, after reading
+        the response headers.
+        """
+        connection = socket.create_connection(self.httpd.socket.getsockname(),
+                                              5)
+        connection.sendall(('GET /fluidinfo/events?chapter=%s HTTP/1.1\r\n'
+                            'Host: localhost\r\n\r\n' % chapter).encode(
+                                'ascii'))
+        headers = read_until(connection, b'retry: 3000\n\n')
+        self.assertTrue(headers.startswith(b'HTTP/1.1 200'))
+        self.assertTrue(b'text/event-stream' in headers)
+        return connection
+
+    def testEvents(self):
+        # More readers than workers.
+        connections = [self.listen('book%3Aone') for i in range(3)]
+        try:
+            status = self.request('/fluidinfo/comments/book:one:1', {
+                'Authorization': 'Basic bnRvbGw6eA==',
+                'Content-Length': '14'}, 'POST', b'{"text": "Hi"}')[0]
+            self.assertEqual(201, status)
+            for connection in connections:
+                event = read_until(connection, b'}\n\n')
+                self.assertTrue(event.startswith(b'event: comment\n'))
+                self.assertTrue(b'"text": "Hi"' in event)
+            # The count changes once the comment is in the tags.
+            QuietHandler.backend.comments.compact()
+            event = read_until(connections[0], b'}\n\n')
+            self.assertTrue(event.startswith(b'event: count\n'))
+            self.assertTrue(b'"participants": 1' in event)
+        finally:
+            for connection in connections:
+                connection.close()
+
+    def testBadRequest(self):
+        self.assertEqual(400, self.request('/fluidinfo/events')[0])
+
+
+class TestChapters(HandlerTestCase):
+    """
+    Ensures each chapter is served, in order, from /chapters/<name>.
+    """
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        chapters = [{
+            'about': 'book:intro',
+            'title': 'Introduction',
+            'position': 1,
+            'blocks': [
+                {'about': 'book:intro:%d' % i, 'position': i,
+                 'parent': 'book:intro', 'html': '<p>Block %d</p>' % i}
+                for i in (3, 1, 2)
+            ],
+        }]
+        chapters[0]['blocks'][0]['references'] = {'b': 'second',
+                                                  'a': 'first'}
+        page = (u'<html><head><title>Reader</title></head><body>'
+                u'<div class="row" id="aboutContainer">About</div>'
+                u'<div id="chapter" style="display: none;" class="row"></div>'
+                u'</body></html>')
+        QuietHandler.chapters = ChapterIndex(chapters, 1000000000, page=page)
+
+    def testChapter(self):
+        status, headers, body = self.request('/chapters/intro')
+        self.assertEqual(200, status)
+        self.assertEqual('application/json', headers['content-type'])
+        chapter = json.loads(body.decode('utf-8'))
+        self.assertEqual('Introduction', chapter['title'])
+        blocks = chapter['blocks']
+        self.assertEqual([1, 2, 3], [block['beckyhogge/position']
+                                     for block in blocks])
+        self.assertEqual('book:intro:1', blocks[0]['fluiddb/about'])
+        self.assertEqual(['first', 'second'],
+                         blocks[2]['beckyhogge/references'])
+        status = self.request('/chapters/intro',
+                              {'If-None-Match': headers['etag']})[0]
+        self.assertEqual(304, status)
+
+    def testRenderedChapter(self):
+        status, headers, body = self.request('/chapters/intro.html')
+        self.assertEqual(200, status)
+        self.assertEqual('text/html', headers['content-type'])
+        markup = body.decode('utf-8')
+        self.assertEqual(3, markup.count('class="tagLink"'))
+        self.assertTrue(markup.index('Block 1') < markup.index('Block 2') <
+                        markup.index('Block 3'))
+        self.assertTrue('id="count-book-intro-1"' in markup)
+        self.assertTrue('target="book:intro:3" data-references="'
+                        '[&quot;first&quot;, &quot;second&quot;]"' in markup)
+        status = self.request('/chapters/intro.html',
+                              {'If-None-Match': headers['etag']})[0]
+        self.assertEqual(304, status)
+
+    def testPage(self):
+        """
+        Links to a chapter get the application's page with the chapter
+        already in place.
+        """
+        status, headers, body = self.request('/read/intro')
+        self.assertEqual(200, status)
+        self.assertEqual('text/html', headers['content-type'])
+        page = body.decode('utf-8')
+        self.assertTrue('<head>\n        <base href="../"/>' in page)
+        self.assertTrue('<title>Introduction - Reader</title>' in page)
+        self.assertTrue('id="aboutContainer" style="display: none;"' in page)
+        markup = self.request('/chapters/intro.html')[2].decode('utf-8')
+        self.assertTrue('<div id="chapter" class="row" data-chapter="intro">' +
+                        markup + '</div>' in page)
+
+    def testMissingChapter(self):
+        self.assertEqual(404, self.request('/chapters/outro')[0])
+        self.assertEqual(404, self.request('/read/outro')[0])
+        QuietHandler.chapters = None
+        self.assertEqual(404, self.request('/chapters/intro')[0])
+
+
+class TestBooks(HandlerTestCase):
+    """
+    Ensures every book in the catalog is listed at /books/ and its chapters
+    served from /books/<id>/chapters/<name>.
+    """
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        chapters = [{
+            'about': 'other:intro', 'parent': 'book:Other', 'position': 1,
+            'title': 'Introduction',
+            'blocks': [{'about': 'other:intro:1', 'parent': 'other:intro',
+                        'position': 1, 'html': '<p>Hello</p>'}],
+        }]
+        with open(os.path.join(self.directory, 'other.json'), 'wb') as f:
+            f.write(json.dumps(chapters).encode('utf-8'))
+        QuietHandler.catalog = Catalog(self.directory)
+
+    def tearDown(self):
+        HandlerTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def testListing(self):
+        status, headers, body = self.request('/books/')
+        self.assertEqual(200, status)
+        self.assertEqual('application/json', headers['content-type'])
+        books = json.loads(body.decode('utf-8'))['books']
+        self.assertEqual(['other'], [book['id'] for book in books])
+
+    def testChapter(self):
+        status, headers, body = self.request('/books/other/chapters/intro')
+        self.assertEqual(200, status)
+        self.assertEqual('Introduction',
+                         json.loads(body.decode('utf-8'))['title'])
+        status, headers, body = self.request(
+            '/books/other/chapters/intro.html')
+        self.assertEqual(200, status)
+        self.assertTrue(b'<p>Hello</p>' in body)
+
+    def testMissing(self):
+        self.assertEqual(404, self.request('/books/missing/chapters/intro')[0])
+        self.assertEqual(404, self.request('/books/other/chapters/outro')[0])
+        self.assertEqual(404, self.request('/books/other/intro')[0])
+
+
+class TestAssetCache(unittest.TestCase):
+    """
+    Ensures the cache stays within its size limit.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, size):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def testLeastRecentlyUsedEvicted(self):
+        """
+        The least recently used file is dropped when the cache is full.
+        """
+        cache = AssetCache(max_bytes=250, max_file_bytes=100)
+        a, b, c = [self.write(name, 100) for name in 'abc']
+        cache.get(a)
+        cache.get(b)
+        cache.get(a)
+        cache.get(c)
+        self.assertTrue(a in cache)
+        self.assertFalse(b in cache)
+        self.assertTrue(c in cache)
+        self.assertEqual(200, cache.size)
+
+    def testCompressedInBackground(self):
+        """
+        Files read into the cache are compressed later, and their compressed
+        copies count towards the size of the cache once they're made.
+        """
+        path = self.write('a.js', 400)
+        asset = Asset(path, b'x' * 400, os.stat(path), compress=False)
+        self.assertTrue(asset.pending)
+        self.assertEqual(({}, 400), (asset.variants, asset.memory))
+        cache = AssetCache(max_bytes=1000, max_file_bytes=500)
+        asset = cache.get(path)
+        cache.wait()
+        self.assertFalse(asset.pending)
+        self.assertTrue('gzip' in asset.variants)
+        self.assertEqual(asset.memory, cache.size)
+        self.assertTrue(asset.memory > 400)
+
+    def testLargeFilesNotCached(self):
+        """
+        Files over max_file_bytes aren't cached.
+        """
+        cache = AssetCache(max_bytes=250, max_file_bytes=100)
+        self.assertEqual(None, cache.get(self.write('big', 101)).body)
+        self.assertEqual(0, len(cache))
+
+    def testPreload(self):
+        """
+        Preloading reads every file that fits, skipping hidden ones.
+        """
+        cache = AssetCache(max_bytes=250, max_file_bytes=100)
+        a = self.write('a', 100)
+        hidden = self.write('.hidden', 10)
+        os.mkdir(os.path.join(self.root, 'sub'))
+        b = self.write(os.path.join('sub', 'b'), 100)
+        cache.preload(self.root)
+        self.assertTrue(a in cache)
+        self.assertTrue(b in cache)
+        self.assertFalse(hidden in cache)
+
+    def testPreloadExclude(self):
+        cache = AssetCache(max_bytes=250, max_file_bytes=100)
+        a = self.write('a.js', 10)
+        snapshot = self.write('a.snapshot', 10)
+        cache.preload(self.root, ('.idx', '.snapshot'))
+        self.assertTrue(a in cache)
+        self.assertFalse(snapshot in cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
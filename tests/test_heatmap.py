@@ -0,0 +1,95 @@
+"""
+Tests for the running tally of comments in bookserver.heatmap.
+"""
+import unittest
+
+from bookserver.book import load_book
+from bookserver.heatmap import MISSING, count_comments
+from bookserver.store import TagStore
+
+
+def packed(*comments):
+    """
+    Returns comments packed into one string, as packComments does.
+    """
+    date = 'Wed, 08 Feb 2012 15:26:51 GMT'
+    values = [date + '\n' + comment for comment in comments]
+    if len(values) == 1:
+        return values[0] + u'\n\u00b6\n'
+    return u'\n\u00b6\n'.join(values)
+
+
+class TestCountComments(unittest.TestCase):
+    """
+    Ensures comments are counted just as the application unpacks them.
+    """
+
+    def testCounts(self):
+        self.assertEqual(0, count_comments(MISSING))
+        self.assertEqual(1, count_comments('An old style comment'))
+        self.assertEqual(1, count_comments(5))
+        self.assertEqual(1, count_comments(packed('One')))
+        self.assertEqual(3, count_comments(packed('One', 'Two', 'Three')))
+
+
+class TestHeatmap(unittest.TestCase):
+    """
+    Ensures the store keeps each chapter's counts up to date as comments
+    are added, changed and removed.
+    """
+
+    chapter = 'barefootintocyberspace:prologue'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chapters = load_book()
+
+    def setUp(self):
+        self.store = TagStore()
+        self.store.load_book(self.chapters)
+
+    def block(self, position):
+        return self.store.object_id('%s:%d' % (self.chapter, position))
+
+    def counts(self, position):
+        heatmap = self.store.chapter_heatmap(self.chapter)
+        return heatmap['%s:%d' % (self.chapter, position)]
+
+    def testEmpty(self):
+        heatmap = self.store.chapter_heatmap(self.chapter)
+        self.assertEqual(8, len(heatmap))
+        self.assertEqual(set([(0, 0)]), set(heatmap.values()))
+        self.assertEqual({}, self.store.chapter_heatmap('nowhere'))
+
+    def testComments(self):
+        self.store.set(self.block(2), 'ntoll/comment', packed('Hi', 'Yo'))
+        self.store.set(self.block(2), 'bob/comment', packed('Hello'))
+        self.store.set(self.block(2), 'bob/rating', 5)
+        self.assertEqual((2, 3), self.counts(2))
+        self.store.set(self.block(2), 'ntoll/comment', packed('Hi'))
+        self.assertEqual((2, 2), self.counts(2))
+        self.store.delete(self.block(2), 'bob/comment')
+        self.assertEqual((1, 1), self.counts(2))
+        self.assertEqual((0, 0), self.counts(3))
+
+    def testMovedBlock(self):
+        self.store.set(self.block(2), 'ntoll/comment', packed('Hi', 'Yo'))
+        self.store.set(self.block(2), 'beckyhogge/parent', 'elsewhere')
+        self.assertEqual(7, len(self.store.chapter_heatmap(self.chapter)))
+        self.assertEqual({self.chapter + ':2': (1, 2)},
+                         self.store.chapter_heatmap('elsewhere'))
+        self.store.delete(self.block(2), 'beckyhogge/parent')
+        self.assertEqual({}, self.store.chapter_heatmap('elsewhere'))
+        self.store.set(self.block(2), 'ntoll/comment', packed('Hi'))
+        self.store.set(self.block(2), 'beckyhogge/parent', self.chapter)
+        self.assertEqual((1, 1), self.counts(2))
+
+    def testListParent(self):
+        # A set of strings is a valid value, but can't name a chapter.
+        self.store.set(self.block(2), 'beckyhogge/parent', [self.chapter])
+        self.assertEqual(7, len(self.store.chapter_heatmap(self.chapter)))
+        self.store.set(self.block(2), 'ntoll/comment', packed('Hi'))
+        self.assertEqual(set([self.block(2)]), self.store.query(
+            'has ntoll/comment'))
+        self.store.set(self.block(2), 'beckyhogge/parent', self.chapter)
+        self.assertEqual((1, 1), self.counts(2))
@@ -0,0 +1,158 @@
+"""
+Tests for the secondary indexes in bookserver.index and the query planner in
+bookserver.store.
+"""
+import unittest
+
+from bookserver import query as fdbquery
+from bookserver.book import load_book
+from bookserver.index import TagIndex
+from bookserver.store import TagStore
+
+
+QUERIES = [
+    'has beckyhogge/references',
+    'beckyhogge/parent = "barefootintocyberspace:prologue"',
+    'beckyhogge/parent != "barefootintocyberspace:prologue"',
+    'beckyhogge/position < 3',
+    'beckyhogge/position <= 3',
+    'beckyhogge/position > 40',
+    'beckyhogge/position >= 40',
+    'beckyhogge/position = 2.0',
+    'beckyhogge/position < "3"',
+    'beckyhogge/parent = "barefootintocyberspace:prologue" and '
+    'beckyhogge/position > 2 and beckyhogge/position <= 5',
+    'has beckyhogge/references and beckyhogge/position < 5',
+    'beckyhogge/position = 1 or beckyhogge/position = 2',
+    'beckyhogge/position < 10 except beckyhogge/position > 4',
+    'beckyhogge/position = 1 and (has ntoll/comment or '
+    'ntoll/tags contains "good")',
+    'ntoll/tags contains "good"',
+    'ntoll/comment matches "nice" and beckyhogge/position < 100',
+    'has ntoll/comment except ntoll/comment = "nice one"',
+]
+
+
+def scan(store, query):
+    """
+    Returns the ids matching query by testing every object, just as the
+    store did before it had indexes.
+    """
+    tree = fdbquery.parse(query)
+
+    def matches(node, tags):
+        kind = node[0]
+        if kind == 'and':
+            return matches(node[1], tags) and matches(node[2], tags)
+        if kind == 'or':
+            return matches(node[1], tags) or matches(node[2], tags)
+        if kind == 'except':
+            return matches(node[1], tags) and not matches(node[2], tags)
+        path = fdbquery.node_path(node)
+        return path in tags and fdbquery.test(node, tags[path])
+
+    return set(object_id for object_id, tags in store._objects.items()
+               if matches(tree, tags))
+
+
+class TestTagIndex(unittest.TestCase):
+    """
+    Ensures the index finds the right objects as values change.
+    """
+
+    def testEquality(self):
+        index = TagIndex()
+        index.add('a', 'x/y', 1)
+        index.add('b', 'x/y', True)
+        index.add('c', 'x/y', '1')
+        index.add('d', 'x/y', 1.0)
+        self.assertEqual(set(['a', 'd']),
+                         index.lookup(('compare', '=', 'x/y', 1)))
+        self.assertEqual(set(['c']),
+                         index.lookup(('compare', '=', 'x/y', '1')))
+        self.assertEqual(set(['b', 'c']),
+                         index.lookup(('compare', '!=', 'x/y', 1)))
+        index.remove('a', 'x/y', 1)
+        self.assertEqual(set(['d']), index.lookup(('compare', '=', 'x/y', 1)))
+        self.assertEqual(3, len(index.has('x/y')))
+
+    def testRanges(self):
+        index = TagIndex()
+        for i, value in enumerate([5, 1, 3, 3, 2.5, 'text']):
+            index.add(str(i), 'x/y', value)
+        found = lambda op, value: sorted(
+            index.lookup(('compare', op, 'x/y', value)))
+        self.assertEqual(['1', '4'], found('<', 3))
+        self.assertEqual(['1', '2', '3', '4'], found('<=', 3))
+        self.assertEqual(['0'], found('>', 3))
+        self.assertEqual(['0', '2', '3'], found('>=', 3))
+        self.assertEqual(1, index.estimate(('compare', '>=', 'x/y', 3.5)))
+        index.remove('2', 'x/y', 3)
+        self.assertEqual(['3'], found('=', 3))
+        self.assertEqual(['0', '3'], found('>=', 3))
+
+    def testContains(self):
+        index = TagIndex()
+        index.add('a', 'x/y', ['good', 'long'])
+        index.add('b', 'x/y', ['good'])
+        self.assertEqual(set(['a', 'b']),
+                         index.lookup(('contains', 'x/y', 'good')))
+        index.remove('a', 'x/y', ['good', 'long'])
+        self.assertEqual(set(), index.lookup(('contains', 'x/y', 'long')))
+        self.assertEqual(None, index.lookup(('matches', 'x/y', 'good')))
+
+
+class TestPlanner(unittest.TestCase):
+    """
+    Ensures queries answered from the indexes match a scan of every object.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chapters = load_book()
+
+    def setUp(self):
+        self.store = TagStore()
+        self.store.load_book(self.chapters)
+        about = 'barefootintocyberspace:prologue:%d'
+        for i in (1, 2, 3):
+            object_id = self.store.object_id(about % i)
+            self.store.set(object_id, 'ntoll/comment', 'a nice one')
+            self.store.set(object_id, 'ntoll/tags', ['good'])
+        object_id = self.store.object_id(about % 2)
+        self.store.set(object_id, 'ntoll/comment', 'nice one')
+        self.store.delete(self.store.object_id(about % 3), 'ntoll/tags')
+
+    def testQueries(self):
+        for query in QUERIES:
+            self.assertEqual(scan(self.store, query), self.store.query(query),
+                             query)
+
+    def testChangedValues(self):
+        object_id = self.store.object_id('barefootintocyberspace:prologue:1')
+        self.store.set(object_id, 'beckyhogge/position', 1000)
+        self.store.set(object_id, 'beckyhogge/parent', 'elsewhere')
+        for query in QUERIES:
+            self.assertEqual(scan(self.store, query), self.store.query(query),
+                             query)
+        self.assertEqual(set([object_id]), self.store.query(
+            'beckyhogge/position > 999 and beckyhogge/parent = "elsewhere"'))
+
+    def testChapterQueryDoesNotScan(self):
+        calls = []
+        original = fdbquery.test
+
+        def counting_test(node, value):
+            calls.append(node)
+            return original(node, value)
+
+        fdbquery.test = counting_test
+        try:
+            ids = self.store.query(
+                'beckyhogge/parent = "barefootintocyberspace:prologue" and '
+                'beckyhogge/position > 1')
+        finally:
+            fdbquery.test = original
+        chapter = self.chapters[1]
+        self.assertEqual(len(chapter['blocks']) - 1, len(ids))
+        self.assertTrue(len(calls) <= len(chapter['blocks']))
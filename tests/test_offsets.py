@@ -0,0 +1,101 @@
+"""
+Tests for reading parts of a book file in bookserver.offsets.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bookserver.book import DEFAULT_BOOK, chapter_name, load_book
+from bookserver.offsets import LazyBook, build_index, index_path
+
+
+# Written with non-ASCII characters both as they are and escaped, and with
+# the keys in an unusual order, to check the offsets are in bytes.
+BOOK = u'''[
+  {"blocks": [
+      {"html": "<p>Caf\u00e9 \\u00e9t\\u00e9</p>", "position": 2,
+       "about": "book:intro:2", "parent": "book:intro"},
+      {"position": 1, "about": "book:intro:1", "parent": "book:intro",
+       "html": "<p>[\\"{\u2603}\\"]</p>", "references": {"1": "A ref"}}
+    ],
+   "title": "Intro\u00efduction", "about": "book:intro", "position": 2},
+  {"about": "book:title", "position": 1, "title": "Title", "blocks": []}
+]
+'''
+
+
+class TestLazyBook(unittest.TestCase):
+    """
+    Ensures chapters and blocks read lazily are just as they'd be read by
+    loading the whole book.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.json')
+        with io.open(self.path, 'w', encoding='utf-8') as f:
+            f.write(BOOK)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testChapters(self):
+        book = LazyBook(self.path)
+        chapters = load_book(self.path)
+        self.assertEqual(['title', 'intro'], book.keys())
+        self.assertEqual([('title', u'Title'),
+                          ('intro', u'Intro\u00efduction')], book.contents())
+        for chapter in chapters:
+            self.assertEqual(chapter, book[chapter_name(chapter['about'])])
+        self.assertEqual(None, book.get('missing'))
+        self.assertRaises(KeyError, lambda: book['missing'])
+        book.close()
+
+    def testBlocks(self):
+        book = LazyBook(self.path)
+        blocks = load_book(self.path)[1]['blocks']
+        for block in blocks:
+            self.assertEqual(block, book.block(block['about']))
+        self.assertEqual(None, book.block('book:intro:3'))
+        book.close()
+
+    def testIndexFile(self):
+        LazyBook(self.path).close()
+        with io.open(index_path(self.path), encoding='utf-8') as f:
+            index = json.load(f)
+        self.assertEqual(os.path.getsize(self.path), index['source']['size'])
+        # A changed book file means the index is rebuilt.
+        with io.open(self.path, 'w', encoding='utf-8') as f:
+            f.write(u'[{"about": "book:other", "position": 1, '
+                    u'"title": "Other", "blocks": []}]')
+        book = LazyBook(self.path)
+        self.assertEqual(['other'], book.keys())
+        book.close()
+
+    def testChangedWhileOpen(self):
+        book = LazyBook(self.path)
+        # Truncated in place, then rewritten: neither is read at the old
+        # offsets.
+        with open(self.path, 'wb') as f:
+            f.truncate()
+        os.utime(self.path, (0, 0))
+        self.assertRaises(ValueError, book.get, 'intro')
+        with io.open(self.path, 'w', encoding='utf-8') as f:
+            f.write(u'[{"about": "book:intro", "position": 1, '
+                    u'"title": "Other", "blocks": []}]')
+        self.assertEqual(u'Other', book['intro']['title'])
+        self.assertEqual(None, book.get('title'))
+        self.assertEqual(None, book.block('book:intro:1'))
+        book.close()
+
+    def testDefaultBook(self):
+        with open(DEFAULT_BOOK, 'rb') as f:
+            index = build_index(f.read())
+        chapters = load_book()
+        self.assertEqual([chapter['about'] for chapter in chapters],
+                         [chapter['about'] for chapter in index])
+        self.assertEqual([len(chapter['blocks']) for chapter in chapters],
+                         [len(chapter['blocks']) for chapter in index])
@@ -0,0 +1,83 @@
+"""
+Tests for the Fluidinfo query language parser in bookserver.query.
+"""
+import unittest
+
+from bookserver import query
+from bookserver.query import QueryError, parse
+
+
+class TestParse(unittest.TestCase):
+    """
+    Ensures queries are parsed into the expected trees.
+    """
+
+    def testEquality(self):
+        """
+        The query used to fetch a chapter.
+        """
+        self.assertEqual(
+            ('compare', '=', 'beckyhogge/parent',
+             'barefootintocyberspace:prologue'),
+            parse('beckyhogge/parent ="barefootintocyberspace:prologue"'))
+
+    def testNumbers(self):
+        self.assertEqual(('compare', '<', 'a/b', 10), parse('a/b < 10'))
+        self.assertEqual(('compare', '>=', 'a/b', -1.5), parse('a/b>=-1.5'))
+
+    def testOperators(self):
+        """
+        "except" binds tightest, then "and", then "or".
+        """
+        self.assertEqual(
+            ('or', ('has', 'a/x'),
+             ('and', ('has', 'a/y'), ('except', ('has', 'a/z'),
+                                      ('contains', 'a/s', 'x')))),
+            parse('has a/x or has a/y and has a/z except a/s contains "x"'))
+        self.assertEqual(
+            ('and', ('or', ('has', 'a/x'), ('has', 'a/y')),
+             ('matches', 'a/t', 'word')),
+            parse('(has a/x OR has a/y) and a/t matches "word"'))
+
+    def testEscapedString(self):
+        self.assertEqual(('compare', '=', 'a/b', 'say "hi"'),
+                         parse('a/b = "say \\"hi\\""'))
+
+    def testErrors(self):
+        for query in ('', 'a/b =', 'has', '(has a/b', 'has a/b has a/c',
+                      'a/b = c', 'a/b ~ 1'):
+            self.assertRaises(QueryError, parse, query)
+
+
+class TestValues(unittest.TestCase):
+    """
+    Ensures tag values are tested against queries correctly.
+    """
+
+    def testEquality(self):
+        node = parse('a/b = 1')
+        self.assertTrue(query.test(node, 1))
+        self.assertTrue(query.test(node, 1.0))
+        self.assertFalse(query.test(node, '1'))
+        self.assertFalse(query.test(node, True))
+        self.assertTrue(query.test(parse('a/b != 1'), 2))
+
+    def testComparison(self):
+        node = parse('a/b < 10')
+        self.assertTrue(query.test(node, 9))
+        self.assertFalse(query.test(node, 10))
+        self.assertFalse(query.test(node, 'nine'))
+
+    def testContains(self):
+        node = parse('a/b contains "x"')
+        self.assertTrue(query.test(node, ['x', 'y']))
+        self.assertFalse(query.test(node, 'x'))
+
+    def testMatches(self):
+        node = parse('a/b matches "Dancing"')
+        self.assertTrue(query.test(node, 'Prologue: Fierce dancing'))
+        self.assertFalse(query.test(node, 'Dancer'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Tests for picking up changed book files in bookserver.reload.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from bookserver.blocks import load_blocks
+from bookserver.chapters import ChapterIndex
+from bookserver.handler import BookRequestHandler
+from bookserver.offsets import LazyBook
+from bookserver.reload import BookReloader, Watcher
+from bookserver.store import TagStore
+
+
+def book(first_html):
+    """
+    Returns a book of two chapters, the first block of which has the given
+    HTML.
+    """
+    return [{
+        'about': 'book:%s' % name, 'parent': 'book:Book', 'position': number,
+        'title': name.title(),
+        'blocks': [{'about': 'book:%s:1' % name, 'parent': 'book:%s' % name,
+                    'position': 1,
+                    'html': first_html if number == 1 else '<p>Two</p>'}],
+    } for number, name in ((1, 'one'), (2, 'two'))]
+
+
+class TestWatcher(unittest.TestCase):
+    """
+    Ensures changed, new and removed files are all noticed.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('a.json', b'[]')
+        self.calls = []
+        self.fail = False
+        self.watcher = Watcher([self.directory], self.callback)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, body, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(body)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def callback(self, changed):
+        self.calls.append(changed)
+        if self.fail:
+            raise ValueError('Half written')
+
+    def testChanges(self):
+        self.assertEqual(set(), self.watcher.check())
+        a = self.write('a.json', b'[{}]', time.time() + 10)
+        b = self.write('b.json', b'[]')
+        self.write('notes.txt', b'Not a book')
+        self.assertEqual(set([a, b]), self.watcher.check())
+        self.assertEqual([set([a, b])], self.calls)
+        os.remove(b)
+        self.assertEqual(set([b]), self.watcher.check())
+        self.assertEqual(set(), self.watcher.check())
+
+    def testRetry(self):
+        a = self.write('a.json', b'[{', time.time() + 10)
+        self.fail = True
+        self.watcher.check()
+        self.fail = False
+        self.assertEqual(set([a]), self.watcher.check())
+        self.assertEqual(set(), self.watcher.check())
+        self.assertEqual(2, len(self.calls))
+
+
+class TestReload(unittest.TestCase):
+    """
+    Ensures a new version of the book replaces the old one and that only
+    the chapters that changed look changed to browsers.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.json')
+        self.write('<p>One</p>', 1000000000)
+
+        class Handler(BookRequestHandler):
+            pass
+
+        self.handler = Handler
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, html, mtime):
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(book(html)).encode('utf-8'))
+        os.utime(self.path, (mtime, mtime))
+
+    def testUpdated(self):
+        old = ChapterIndex(book('<p>One</p>'), 1000000000, page=u'<html/>')
+        old.render_all()
+        new = old.updated(book('<p>First</p>'), 1000000100)
+        self.assertTrue(new.get('two') is old.get('two'))
+        self.assertTrue(new.get('two.html') is old.get('two.html'))
+        self.assertTrue(new.page('two') is old.page('two'))
+        self.assertNotEqual(old.get('one').etag, new.get('one').etag)
+        self.assertEqual(1000000100, new.get('one').mtime)
+
+    def testReload(self):
+        chapters = LazyBook(self.path)
+        self.handler.chapters = ChapterIndex(chapters, 1000000000)
+        # As runserver.py does, so nothing is read from the changed file.
+        self.handler.chapters.render_all()
+        old = self.handler.chapters
+        reloader = BookReloader(self.handler, self.path, chapters, LazyBook)
+        self.write('<p>First</p>', 1000000100)
+        reloader(set([os.path.normpath(self.path)]))
+        self.assertFalse(self.handler.chapters is old)
+        self.assertTrue(b'First' in self.handler.chapters.get('one').body)
+        self.assertEqual(old.get('two').etag,
+                         self.handler.chapters.get('two').etag)
+
+    def testStore(self):
+        blocks = load_blocks(self.path)
+        store = TagStore()
+        store.load_book(blocks.chapters())
+        self.handler.chapters = ChapterIndex(blocks, 1000000000)
+        reloader = BookReloader(self.handler, self.path, blocks, load_blocks,
+                                store)
+        self.write('<p>First</p>', 1000000100)
+        reloader(set([os.path.normpath(self.path)]))
+        self.assertEqual('<p>First</p>', store.get(
+            store.object_id('book:one:1'), 'beckyhogge/html'))
+        # Blocks removed from the book are removed from the store.
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(book('<p>First</p>')[:1]).encode('utf-8'))
+        os.utime(self.path, (1000000200, 1000000200))
+        reloader(set([os.path.normpath(self.path)]))
+        self.assertEqual(None, store.object_id('book:two:1'))
+        self.assertEqual(set(), store.query('has beckyhogge/html and '
+                                            'beckyhogge/parent = "book:two"'))
+        # Tags taken out of a block are taken out of the store.
+        chapters = book('<p>First</p>')[:1]
+        chapters[0]['blocks'][0]['references'] = {'1': 'A reference'}
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(chapters).encode('utf-8'))
+        os.utime(self.path, (1000000300, 1000000300))
+        reloader(set([os.path.normpath(self.path)]))
+        self.assertEqual(['A reference'], store.get(
+            store.object_id('book:one:1'), 'beckyhogge/references'))
+        del chapters[0]['blocks'][0]['references']
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(chapters).encode('utf-8'))
+        os.utime(self.path, (1000000400, 1000000400))
+        reloader(set([os.path.normpath(self.path)]))
+        self.assertEqual(set(), store.query('has beckyhogge/references'))
+        self.assertEqual('<p>First</p>', store.get(
+            store.object_id('book:one:1'), 'beckyhogge/html'))
@@ -0,0 +1,212 @@
+"""
+Tests for the HTTP servers in bookserver.server.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from bookserver.compat import BaseHTTPRequestHandler
+from bookserver.server import PooledHTTPServer
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with "ok", but only once the release event is set.
+    """
+
+    entered = threading.Semaphore(0)
+    release = threading.Event()
+
+    def do_GET(self):
+        self.entered.release()
+        self.release.wait(5)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+def raw_get(address, path='/'):
+    """
+    Makes a GET request and returns the raw response.
+    """
+    sock = socket.create_connection(address, 5)
+    try:
+        sock.sendall(('GET %s HTTP/1.0\r\n\r\n' % path).encode('ascii'))
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+
+class TestPooledHTTPServer(unittest.TestCase):
+    """
+    Ensures connections are shared amongst a bounded pool of workers.
+    """
+
+    def setUp(self):
+        SlowHandler.entered = threading.Semaphore(0)
+        SlowHandler.release.clear()
+        self.httpd = PooledHTTPServer(('localhost', 0), SlowHandler,
+                                      workers=2, max_connections=2)
+        self.address = self.httpd.socket.getsockname()
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        SlowHandler.release.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def testConcurrentRequests(self):
+        """
+        Several slow requests are served side by side.
+        """
+        results = []
+
+        def fetch():
+            results.append(raw_get(self.address))
+        threads = [threading.Thread(target=fetch) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        SlowHandler.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertTrue(result.startswith(b'HTTP/1.0 200'))
+            self.assertTrue(result.endswith(b'ok'))
+
+    def testRefuseWhenFull(self):
+        """
+        Connections beyond max_connections get a 503 straight away.
+        """
+        held = [socket.create_connection(self.address, 5) for i in range(2)]
+        try:
+            for sock in held:
+                sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+            # Wait for the held connections to reach the handler.
+            for sock in held:
+                SlowHandler.entered.acquire()
+            result = raw_get(self.address)
+            self.assertTrue(result.startswith(b'HTTP/1.0 503'))
+        finally:
+            SlowHandler.release.set()
+            for sock in held:
+                sock.close()
+
+    def testBadConfiguration(self):
+        """
+        Nonsensical pool sizes are rejected.
+        """
+        self.assertRaises(ValueError, PooledHTTPServer, ('localhost', 0),
+                          SlowHandler, workers=0)
+        self.assertRaises(ValueError, PooledHTTPServer, ('localhost', 0),
+                          SlowHandler, workers=4, max_connections=2)
+
+
+# A supervised server that reports which process answered each request.
+SUPERVISOR_SCRIPT = """
+import os, sys
+sys.path.insert(0, %r)
+from bookserver.compat import BaseHTTPRequestHandler
+from bookserver.server import PooledHTTPServer, PreforkSupervisor
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = str(os.getpid()).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+supervisor = PreforkSupervisor(
+    lambda: PooledHTTPServer(('localhost', 0), Handler,
+                             bind_and_activate=False), 2)
+supervisor.min_uptime = 0
+print(supervisor.server_address[1])
+sys.stdout.flush()
+supervisor.serve_forever(0.05)
+""" % os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+class TestPreforkSupervisor(unittest.TestCase):
+    """
+    Ensures the supervisor keeps its children running and stops them
+    cleanly.
+    """
+
+    def setUp(self):
+        self.process = subprocess.Popen([sys.executable, '-c',
+                                         SUPERVISOR_SCRIPT],
+                                        stdout=subprocess.PIPE)
+        port = int(self.process.stdout.readline())
+        self.address = ('localhost', port)
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            self.process.wait()
+        self.process.stdout.close()
+
+    def get_pid(self):
+        """
+        Returns the pid of the child that answered a request, retrying while
+        the children start up.
+        """
+        for attempt in range(100):
+            try:
+                response = raw_get(self.address)
+            except socket.error:
+                time.sleep(0.05)
+                continue
+            return int(response.split(b'\r\n\r\n', 1)[1])
+        self.fail('No child answered')
+
+    def testRestartCrashedChild(self):
+        """
+        A child that dies is replaced and requests keep being served.
+        """
+        pid = self.get_pid()
+        self.assertNotEqual(self.process.pid, pid)
+        os.kill(pid, signal.SIGKILL)
+        pids = set([pid])
+        deadline = time.time() + 10
+        while len(pids) < 3 and time.time() < deadline:
+            pids.add(self.get_pid())
+        # The surviving child and its replacement both answer.
+        self.assertEqual(3, len(pids))
+
+    def testTerminate(self):
+        """
+        SIGTERM stops the children and the supervisor.
+        """
+        self.get_pid()
+        self.process.send_signal(signal.SIGTERM)
+        deadline = time.time() + 10
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(0, self.process.returncode)
+        self.assertRaises(socket.error, raw_get, self.address)
+
+
+if __name__ == '__main__':
+    unittest.main()
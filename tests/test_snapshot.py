@@ -0,0 +1,106 @@
+"""
+Tests for saving and loading the server's state in bookserver.snapshot.
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from bookserver.book import load_book
+from bookserver.chapters import ChapterIndex
+from bookserver.snapshot import (Timings, load_snapshot, save_snapshot,
+                                 snapshot_path, source_key)
+from bookserver.store import TagStore
+
+
+class TestSnapshot(unittest.TestCase):
+    """
+    Ensures a snapshot is only used when it was built from the same files.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.json')
+        self.write(b'[]')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, body):
+        with open(self.path, 'wb') as f:
+            f.write(body)
+
+    def testKey(self):
+        key = source_key([self.path], 'a')
+        self.assertEqual(key, source_key([self.path], 'a'))
+        self.assertNotEqual(key, source_key([self.path], 'b'))
+        missing = os.path.join(self.directory, 'missing.html')
+        self.assertNotEqual(key, source_key([self.path, missing], 'a'))
+        self.write(b'[ ]')
+        self.assertNotEqual(key, source_key([self.path], 'a'))
+
+    def testSaveAndLoad(self):
+        key = source_key([self.path])
+        self.assertEqual(None, load_snapshot(self.path, 'test', key))
+        self.assertTrue(save_snapshot(self.path, 'test', key, {'a': [1]}))
+        self.assertEqual({'a': [1]}, load_snapshot(self.path, 'test', key))
+        self.assertEqual(None, load_snapshot(self.path, 'other', key))
+        self.write(b'[ ]')
+        self.assertEqual(None, load_snapshot(self.path, 'test',
+                                             source_key([self.path])))
+        self.assertEqual(['book.json', 'book.json.test.snapshot'],
+                         sorted(os.listdir(self.directory)))
+
+    def testCorrupt(self):
+        key = source_key([self.path])
+        with open(snapshot_path(self.path, 'test'), 'wb') as f:
+            f.write(pickle.dumps(key) + b'nonsense')
+        self.assertEqual(None, load_snapshot(self.path, 'test', key))
+
+    def testTimings(self):
+        timings = Timings()
+        with timings.phase('one'):
+            pass
+        self.assertEqual(['one'], [name for name, t in timings.phases])
+        report = timings.report()
+        self.assertTrue(report.startswith('Ready in '))
+        self.assertTrue(', ' not in report and '(one ' in report)
+
+
+class TestPickling(unittest.TestCase):
+    """
+    Ensures what's kept in a snapshot works just the same once loaded.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chapters = load_book()
+
+    def testChapterIndex(self):
+        index = ChapterIndex(self.chapters, 1000000000, page=u'<html/>')
+        index.render('prologue')
+        index.render('infowar')
+        copy = pickle.loads(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+        # The book isn't pickled, only what had been rendered.
+        self.assertEqual([], copy.names())
+        self.assertEqual(index.get('prologue').etag,
+                         copy.get('prologue').etag)
+        self.assertEqual(index.page('infowar').body,
+                         copy.page('infowar').body)
+        self.assertEqual(None, copy.get('epilogue'))
+        copy.set_book(self.chapters)
+        self.assertEqual(index.names(), copy.names())
+        self.assertEqual(index.get('epilogue').body,
+                         copy.get('epilogue').body)
+        self.assertEqual(None, copy.get('missing'))
+
+    def testTagStore(self):
+        store = TagStore()
+        store.load_book(self.chapters[:3])
+        copy = pickle.loads(pickle.dumps(store, pickle.HIGHEST_PROTOCOL))
+        query = 'beckyhogge/parent = "barefootintocyberspace:prologue"'
+        self.assertEqual(store.query(query), copy.query(query))
+        block = copy.object_id('barefootintocyberspace:prologue:1')
+        copy.set(block, 'ntoll/comment', u'Hi')
+        self.assertEqual(u'Hi', copy.get(block, 'ntoll/comment'))